@@ -22,6 +22,8 @@ class CommandManager:
     def __init__(self, rfum: "RegionFileUpdaterMulti"):
         self.__rfum = rfum
         self.__registered_commands: List[AbstractSubCommand] = []
+        # Prefixes of the registered command tree, config changes don't affect it until reload
+        self.__registered_prefixes: Optional[List[str]] = None
 
     @property
     def server(self):
@@ -33,6 +35,8 @@ class CommandManager:
 
     @property
     def prefixes(self):
+        if self.__registered_prefixes is not None:
+            return self.__registered_prefixes
         prefixes = self.__rfum.config.command.command_prefix
         if isinstance(prefixes, list):
             return prefixes
@@ -77,6 +81,7 @@ class CommandManager:
                 del_=DEL,
                 del_all=DEL_ALL,
                 list=LIST,
+                diff=DIFF,
                 history=HISTORY,
                 group=GROUP,
                 update=UPDATE,
@@ -102,6 +107,8 @@ class CommandManager:
                 return item
 
     def register(self):
+        self.__registered_prefixes = None
+        self.__registered_prefixes = self.prefixes
         root_node = (
             Literal(self.prefixes)
             .runs(self.plugin_overview)
@@ -1,8 +1,9 @@
+import os
 import time
 
 from mcdreforged.api.all import *
 
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 
 from region_file_updater_multi.components.misc import (
     get_rfum_comp_prefix,
@@ -12,7 +13,15 @@ from region_file_updater_multi.commands.tree_constants import *
 from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.utils import misc_tools
 from region_file_updater_multi.components.list import ListComponent
-from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.region_upstream_manager import (
+    Region,
+    RegionArea,
+    RegionFileDiff,
+)
+from region_file_updater_multi.utils.mca import chunk_index, chunk_coordinates
+
+# Chunks listed in a hover text of diff command at most
+DIFF_HOVER_CHUNK_LIMIT = 32
 
 
 class AddDelCommand(AbstractSubCommand):
@@ -40,9 +49,29 @@ class AddDelCommand(AbstractSubCommand):
         builder.command(f"{ADD} <{X}> <{Z}> <{DIM}>", self.add_region)
         builder.command(f"{ADD} <{X}> <{Z}> <{DIM}> {SUPRESS_WARNING}", self.add_region)
 
+        builder.command(
+            f"{ADD} {AREA} <{X1}> <{Z1}> <{X2}> <{Z2}> <{DIM}>", self.add_area
+        )
+        builder.command(
+            f"{ADD} {AREA} <{X1}> <{Z1}> <{X2}> <{Z2}> <{DIM}> {SUPRESS_WARNING}",
+            self.add_area,
+        )
+        builder.command(f"{ADD} {RADIUS} <{REGION_RADIUS}>", self.add_radius)
+        builder.command(
+            f"{ADD} {RADIUS} <{REGION_RADIUS}> {SUPRESS_WARNING}", self.add_radius
+        )
+
+        builder.command(f"{ADD} {CHUNK}", self.add_chunk_by_player_pos)
+        builder.command(f"{ADD} {CHUNK} <{X}> <{Z}> <{DIM}>", self.add_chunk)
+        builder.command(
+            f"{ADD} {CHUNK} <{X}> <{Z}> <{DIM}> {SUPRESS_WARNING}", self.add_chunk
+        )
+
         builder.command(DEL, self.del_region_with_player_pos)
         builder.command(f"{DEL} {GROUP} <{GROUP_NAME}>", self.group_del_region)
         builder.command(f"{DEL} <{X}> <{Z}> <{DIM}>", self.del_region)
+        builder.command(f"{DEL} {CHUNK}", self.del_chunk_with_player_pos)
+        builder.command(f"{DEL} {CHUNK} <{X}> <{Z}> <{DIM}>", self.del_chunk)
 
         builder.literal(ADD, self.permed_literal)
         builder.literal(DEL, self.permed_literal)
@@ -52,6 +81,8 @@ class AddDelCommand(AbstractSubCommand):
         self.set_builder_coordinate_args(
             builder, x_f=self.integer, z_f=self.integer, d_f=self.quotable_text
         )
+        self.set_builder_area_args(builder)
+        builder.arg(REGION_RADIUS, lambda name: self.integer(name).at_min(0))
         builder.arg(GROUP_NAME, self.quotable_text).post_process(attach_supress_warning)
 
         builder.command(DEL_ALL, self.del_all_region)
@@ -61,6 +92,11 @@ class AddDelCommand(AbstractSubCommand):
         builder.literal(LIST, self.permed_literal).post_process(
             self.list_command_factory
         )
+
+        builder.command(DIFF, self.diff_region)
+        builder.literal(DIFF, self.permed_literal).post_process(
+            self.list_command_factory
+        )
         builder.add_children_for(root_node)
 
     def __batch_add_region(
@@ -72,26 +108,24 @@ class AddDelCommand(AbstractSubCommand):
     ):
         if self.is_session_running(source):
             return
-        current_session = self.rfum.current_session
-
-        succeeded, failed = [], []
-        for region in regions:
-            if region in current_session.get_current_regions().keys():
-                failed.append(region)
-            elif (
-                self.config.region_protection.check_add_groups
-                and self.rfum.group_manager.is_region_permitted(source, region)
-            ):
-                failed.append(region)
-            else:
-                self.reply_warning(source, region, supress_warning)
-                current_session.add_region(
-                    region, misc_tools.get_player_from_src(source)
-                )
-                succeeded.append(region)
+        regions = tuple(dict.fromkeys(regions))
+        denied = {}
+        if self.config.region_protection.check_add_groups:
+            denied = self.rfum.group_manager.get_update_denied_regions(
+                source, regions
+            )
+        succeeded = self.rfum.current_session.add_regions(
+            (region for region in regions if region not in denied.keys()),
+            misc_tools.get_player_from_src(source),
+        )
+        self.reply_batch_warning(source, succeeded, supress_warning)
         source.reply(
             get_rfum_comp_prefix(
-                self.ctr("batch_add", succeeded=len(succeeded), failed=len(failed)),
+                self.ctr(
+                    "batch_add",
+                    succeeded=len(succeeded),
+                    failed=len(regions) - len(succeeded),
+                ),
                 self.rtr(f"{LIST}.{LIST}_hint.text")
                 .c(RAction.run_command, f"{current_prefix} {LIST}")
                 .h(self.rtr(f"{LIST}.{LIST}_hint.hover")),
@@ -104,25 +138,26 @@ class AddDelCommand(AbstractSubCommand):
     ):
         if self.is_session_running(source):
             return
-        current_session = self.rfum.current_session
-        succeeded, failed = [], []
-        for region in regions:
-            if region not in current_session.get_current_regions().keys():
-                failed.append(region)
-            elif (
-                self.config.region_protection.check_add_groups
-                and self.config.region_protection.check_del_operations
-                and self.rfum.group_manager.is_region_permitted(source, region)
-            ):
-                failed.append(region)
-            else:
-                current_session.remove_region(
-                    region, misc_tools.get_player_from_src(source)
-                )
-                succeeded.append(region)
+        regions = tuple(dict.fromkeys(regions))
+        denied = {}
+        if (
+            self.config.region_protection.check_add_groups
+            and self.config.region_protection.check_del_operations
+        ):
+            denied = self.rfum.group_manager.get_update_denied_regions(
+                source, regions
+            )
+        succeeded = self.rfum.current_session.remove_regions(
+            (region for region in regions if region not in denied.keys()),
+            misc_tools.get_player_from_src(source),
+        )
         source.reply(
             get_rfum_comp_prefix(
-                self.ctr("batch_del", succeeded=len(succeeded), failed=len(failed)),
+                self.ctr(
+                    "batch_del",
+                    succeeded=len(succeeded),
+                    failed=len(regions) - len(succeeded),
+                ),
                 self.rtr(f"{LIST}.{LIST}_hint.text")
                 .c(RAction.run_command, f"{current_prefix} {LIST}")
                 .h(self.rtr(f"{LIST}.{LIST}_hint.hover")),
@@ -138,17 +173,80 @@ class AddDelCommand(AbstractSubCommand):
             return source.reply(
                 self.rtr(f"{GROUP}.error.not_found", group_name).set_color(RColor.red)
             )
-        self.__batch_add_region(source, current_prefix, *group.regions)
+        self.__batch_add_region(
+            source,
+            current_prefix,
+            *group.iter_regions(),
+            supress_warning=self.get_ctx_supress_warning(context),
+        )
 
     def group_del_region(self, source: CommandSource, context: CommandContext):
         current_prefix = context.command.split(" ")[0]
         group_name = context[GROUP_NAME]
-        if not self.rfum.group_manager.is_present(group_name):
+        group = self.rfum.group_manager.get_group(group_name)
+        if group is None:
             return source.reply(
                 self.rtr(f"{GROUP}.error.not_found", group_name).set_color(RColor.red)
             )
-        regions = self.rfum.group_manager.get_group(group_name)
-        self.__batch_del_batch(source, current_prefix, *regions)
+        self.__batch_del_batch(source, current_prefix, *group.iter_regions())
+
+    # !!rfum add area
+    def __add_area(
+        self,
+        source: CommandSource,
+        current_prefix: str,
+        area: RegionArea,
+        supress_warning: bool = False,
+    ):
+        limit = self.config.get_max_batch_regions()
+        if area.region_count > limit:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(
+                        "error.too_many_regions", count=area.region_count, limit=limit
+                    ).set_color(RColor.red)
+                )
+            )
+        self.__batch_add_region(
+            source,
+            current_prefix,
+            *area.iter_regions(),
+            supress_warning=supress_warning,
+        )
+
+    def add_area(self, source: CommandSource, context: CommandContext):
+        self.__add_area(
+            source,
+            context.command.split(" ")[0],
+            self.get_ctx_area(context),
+            supress_warning=self.get_ctx_supress_warning(context),
+        )
+
+    def add_radius(self, source: CommandSource, context: CommandContext):
+        if not isinstance(source, PlayerCommandSource):
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.not_a_player").set_color(RColor.red)
+                )
+            )
+        if self.server.get_plugin_instance(MINECRAFT_DATA_API) is None:
+            return source.reply(
+                self.ctr("error.api_not_installed").set_color(RColor.red)
+            )
+        radius = context[REGION_RADIUS]
+        center = self.get_region_from_player(misc_tools.get_player_from_src(source))
+        self.__add_area(
+            source,
+            context.command.split(" ")[0],
+            RegionArea(
+                center.x - radius,
+                center.z - radius,
+                center.x + radius,
+                center.z + radius,
+                center.dim,
+            ),
+            supress_warning=self.get_ctx_supress_warning(context),
+        )
 
     @property
     def tr_key_prefix(self):
@@ -180,22 +278,60 @@ class AddDelCommand(AbstractSubCommand):
             )
         )
 
-    # !!rfum add
-    def __add_region(
-        self, source: CommandSource, region: Region, supress_warning: bool = False
+    def reply_batch_warning(
+        self, source: CommandSource, regions: List[Region], supress_warning: bool
     ):
-        if self.is_session_running(source):
+        if supress_warning:
             return
-        if region in self.rfum.current_session.get_current_regions().keys():
-            return source.reply(get_rfum_comp_prefix(self.ctr("existed", str(region))))
+        included = self.rfum.group_manager.get_groups_by_regions(regions)
+        if len(included) == 0:
+            return
+        groups = list(
+            dict.fromkeys(group for items in included.values() for group in items)
+        )
+        head = groups[:3] if len(groups) > 3 else groups
+        head_text = "§f, §r".join([f"§b{item.name}§r" for item in head])
+        if len(groups) > 3:
+            head_text += "..."
+        source.reply(
+            get_rfum_comp_prefix(
+                self.ctr("batch_group_warning", len(included)).set_color(
+                    RColor.yellow
+                ),
+                get_rfum_comp_prefix(head_text),
+                get_rfum_comp_prefix(
+                    self.ctr("warn_count", len(groups)).set_color(RColor.yellow)
+                ),
+                divider="\n",
+            )
+        )
+
+    def __is_add_denied(self, source: CommandSource, region: Region):
         denied = list(self.rfum.group_manager.get_update_denied_groups(source, region))
         self.verbose("Banned by: " + str([g.name for g in denied]))
         if len(denied) > 0:
             self.verbose(f"Source {get_rfum_comp_prefix(source)} perm denied")
-            return source.reply(
+            source.reply(
                 get_rfum_comp_prefix(self.command_manager.perm_denied_text_getter())
             )
+            return True
         self.verbose(f"Source {misc_tools.get_player_from_src(source)} allowed")
+        return False
+
+    # !!rfum add
+    def __add_region(
+        self, source: CommandSource, region: Region, supress_warning: bool = False
+    ):
+        if self.is_session_running(source):
+            return
+        current_session = self.rfum.current_session
+        if (
+            region in current_session.get_current_regions().keys()
+            and region not in current_session.get_current_chunks().keys()
+        ):
+            return source.reply(get_rfum_comp_prefix(self.ctr("existed", str(region))))
+        if self.__is_add_denied(source, region):
+            return
         self.reply_warning(source, region, supress_warning)
         time.sleep(0.01)
         self.rfum.current_session.add_region(
@@ -225,6 +361,62 @@ class AddDelCommand(AbstractSubCommand):
             supress_warning=self.get_ctx_supress_warning(context),
         )
 
+    # !!rfum add chunk
+    def __add_chunk(
+        self,
+        source: CommandSource,
+        chunk_x: int,
+        chunk_z: int,
+        dim: str,
+        supress_warning: bool = False,
+    ):
+        if self.is_session_running(source):
+            return
+        region = Region.from_chunk_coordinates(chunk_x, chunk_z, dim)
+        chunk_text = f"[{chunk_x}, {chunk_z}]"
+        if self.__is_add_denied(source, region):
+            return
+        try:
+            self.rfum.current_session.add_chunk(
+                region,
+                chunk_index(chunk_x, chunk_z),
+                misc_tools.get_player_from_src(source),
+            )
+        except ValueError:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("chunk_existed", chunk=chunk_text, region=str(region))
+                )
+            )
+        self.reply_warning(source, region, supress_warning)
+        source.reply(
+            get_rfum_comp_prefix(
+                self.ctr("chunk_added", chunk=chunk_text, region=str(region))
+            )
+        )
+
+    def add_chunk_by_player_pos(self, source: CommandSource):
+        if not isinstance(source, PlayerCommandSource):
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.not_a_player").set_color(RColor.red)
+                )
+            )
+        if self.server.get_plugin_instance(MINECRAFT_DATA_API) is None:
+            return source.reply(
+                self.ctr("error.api_not_installed").set_color(RColor.red)
+            )
+        self.__add_chunk(
+            source, *self.get_chunk_from_player(misc_tools.get_player_from_src(source))
+        )
+
+    def add_chunk(self, source: CommandSource, context: CommandContext):
+        self.__add_chunk(
+            source,
+            *self.get_ctx_coordinates(context),
+            supress_warning=self.get_ctx_supress_warning(context),
+        )
+
     # !!rfum del
     def __del_region(self, source: CommandSource, region: Region):
         if self.is_session_running(source):
@@ -263,6 +455,55 @@ class AddDelCommand(AbstractSubCommand):
     def del_region(self, source: CommandSource, context: CommandContext):
         self.__del_region(source, Region(*self.get_ctx_coordinates(context)))
 
+    # !!rfum del chunk
+    def __del_chunk(self, source: CommandSource, chunk_x: int, chunk_z: int, dim: str):
+        if self.is_session_running(source):
+            return
+        region = Region.from_chunk_coordinates(chunk_x, chunk_z, dim)
+        chunk_text = f"[{chunk_x}, {chunk_z}]"
+        if (
+            self.config.region_protection.check_del_operations
+            and not self.rfum.group_manager.is_region_permitted(source, region)
+        ):
+            return source.reply(
+                get_rfum_comp_prefix(self.command_manager.perm_denied_text_getter())
+            )
+        try:
+            self.rfum.current_session.remove_chunk(
+                region,
+                chunk_index(chunk_x, chunk_z),
+                misc_tools.get_player_from_src(source),
+            )
+        except ValueError:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("chunk_not_added", chunk=chunk_text, region=str(region))
+                )
+            )
+        source.reply(
+            get_rfum_comp_prefix(
+                self.ctr("chunk_removed", chunk=chunk_text, region=str(region))
+            )
+        )
+
+    def del_chunk_with_player_pos(self, source: CommandSource):
+        if not isinstance(source, PlayerCommandSource):
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.not_a_player").set_color(RColor.red)
+                )
+            )
+        if self.server.get_plugin_instance(MINECRAFT_DATA_API) is None:
+            return source.reply(
+                self.ctr("error.api_not_installed").set_color(RColor.red)
+            )
+        self.__del_chunk(
+            source, *self.get_chunk_from_player(misc_tools.get_player_from_src(source))
+        )
+
+    def del_chunk(self, source: CommandSource, context: CommandContext):
+        self.__del_chunk(source, *self.get_ctx_coordinates(context))
+
     # !!rfum del-all
     def del_all_region(self, source: CommandSource):
         if len(self.rfum.current_session.get_current_regions()) == 0:
@@ -288,6 +529,8 @@ class AddDelCommand(AbstractSubCommand):
         current_prefix = context.command.split(" ")[0]
         rfum = self.rfum
 
+        chunks = rfum.current_session.get_current_chunks()
+
         def region_line_factory(region_tuple: Tuple[Region, Optional[str]]):
             region, player = region_tuple
             region_text = str(region)
@@ -305,6 +548,16 @@ class AddDelCommand(AbstractSubCommand):
                     )
                 ),
             ]
+            if region in chunks.keys():
+                chunk_texts = [
+                    "[{}, {}]".format(*chunk_coordinates(index, region.x, region.z))
+                    for index in sorted(chunks[region])
+                ]
+                line.append(
+                    self.rtr(f"{LIST}.line.chunks", len(chunk_texts)).h(
+                        ", ".join(chunk_texts)
+                    )
+                )
             return get_rfum_comp_prefix(*line, divider=" ")
 
         regions = rfum.current_session.get_current_regions()
@@ -331,3 +584,113 @@ class AddDelCommand(AbstractSubCommand):
             )
         ]
         source.reply(get_rfum_comp_prefix(*full_text, divider="\n"))
+
+    def __get_chunk_count_text(
+        self,
+        region: Region,
+        kind: str,
+        indexes: List[int],
+        symbol: str,
+        color: RColor,
+    ):
+        text = RText(f"{symbol}{len(indexes)}", color)
+        if len(indexes) == 0:
+            return text
+        chunk_texts = [
+            "[{}, {}]".format(*chunk_coordinates(index, region.x, region.z))
+            for index in indexes[:DIFF_HOVER_CHUNK_LIMIT]
+        ]
+        if len(indexes) > DIFF_HOVER_CHUNK_LIMIT:
+            chunk_texts.append("...")
+        return text.h(
+            self.rtr(f"{DIFF}.line.{kind}", len(indexes)), "\n", ", ".join(chunk_texts)
+        )
+
+    # !!rfum diff
+    def diff_region(self, source: CommandSource, context: CommandContext):
+        page, item_per_page = self.get_list_args(context)
+        current_prefix = context.command.split(" ")[0]
+        session = self.rfum.current_session
+        regions = session.get_current_regions()
+        if len(regions) == 0:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.rtr(f"{UPDATE}.error.list_empty").set_color(RColor.red)
+                )
+            )
+        try:
+            diffs = self.rfum.region_upstream_manager.diff_regions(
+                regions.keys(), session.get_current_chunks()
+            )
+        except Exception as exc:
+            self.logger.exception("Error comparing region files")
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.rtr(f"{DIFF}.error", str(exc)).set_color(RColor.red)
+                )
+            )
+
+        def diff_line_factory(file_diff: RegionFileDiff):
+            region, diff = file_diff.region, file_diff.diff
+            if diff.is_empty:
+                status = self.rtr(f"{DIFF}.line.identical")
+            else:
+                status = RTextBase.join(
+                    " ",
+                    [
+                        self.__get_chunk_count_text(
+                            region, "changed", diff.changed, "~", RColor.yellow
+                        ),
+                        self.__get_chunk_count_text(
+                            region, "added", diff.added, "+", RColor.green
+                        ),
+                        self.__get_chunk_count_text(
+                            region, "missing", diff.missing, "-", RColor.red
+                        ),
+                    ],
+                )
+            line = [
+                RText("[x]", RColor.red, RStyle.bold)
+                .c(
+                    RAction.suggest_command,
+                    f"{current_prefix} {DEL} {region.x} {region.z} {region.dim}",
+                )
+                .h(self.rtr(f"{LIST}.line.del_hover")),
+                RText(str(region), RColor.aqua),
+                RText(os.path.dirname(file_diff.file_name), RColor.gray).h(
+                    file_diff.file_name
+                ),
+                status,
+            ]
+            if not file_diff.world_exists:
+                line.append(self.rtr(f"{DIFF}.line.not_in_world"))
+            elif not file_diff.upstream_exists:
+                line.append(self.rtr(f"{DIFF}.line.not_in_upstream"))
+            return get_rfum_comp_prefix(*line, divider=" ")
+
+        differed_regions = {
+            file_diff.region for file_diff in diffs if not file_diff.diff.is_empty
+        }
+        list_comp = ListComponent(
+            diffs, diff_line_factory, self.config.default_item_per_page
+        )
+        full_text = [
+            self.rtr(f"{DIFF}.title"),
+            get_rfum_comp_prefix(
+                self.rtr(
+                    f"{DIFF}.amount",
+                    upstream=self.rfum.region_upstream_manager.get_current_upstream().name,
+                    files=len(diffs),
+                    regions=len(regions),
+                    identical=len(regions) - len(differed_regions),
+                )
+            ),
+            *list_comp.get_page_line_list(page, item_per_page=item_per_page),
+            list_comp.get_page_hint_line(
+                page,
+                item_per_page=item_per_page,
+                command_format=f"{current_prefix} {DIFF} "
+                + self.get_list_command_args_format(),
+            ),
+        ]
+        source.reply(get_rfum_comp_prefix(*full_text, divider="\n"))
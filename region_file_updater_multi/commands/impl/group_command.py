@@ -1,6 +1,6 @@
 import threading
 from abc import ABC, abstractmethod
-from typing import Any, TYPE_CHECKING, Optional, Dict, Tuple
+from typing import Any, TYPE_CHECKING, Optional, Dict, Tuple, Union
 
 from mcdreforged.api.all import *
 
@@ -19,7 +19,7 @@ from region_file_updater_multi.components.misc import (
 )
 from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.storage.group import Group, GroupPermission
-from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.region_upstream_manager import Region, RegionArea
 from region_file_updater_multi.utils.misc_tools import (
     get_player_from_src,
     get_scheduler,
@@ -232,14 +232,22 @@ class GroupCommand(AbstractSubCommand):
             expand_sub = get_group_node().runs(self.expand_group_by_player_pos)
             expand_builder = SimpleCommandBuilder()
             expand_builder.command(f"<{X}> <{Z}> <{DIM}>", self.expand_group)
+            expand_builder.command(
+                f"{AREA} <{X1}> <{Z1}> <{X2}> <{Z2}> <{DIM}>", self.expand_group_area
+            )
             self.set_builder_coordinate_args(expand_builder)
+            self.set_builder_area_args(expand_builder)
             expand_builder.add_children_for(expand_sub)
 
             contract = self.literal(CONTRACT)
             contract_sub = get_group_node().runs(self.contract_group_by_player_pos)
             contract_builder = SimpleCommandBuilder()
             contract_builder.command(f"<{X}> <{Z}> <{DIM}>", self.contract_group)
+            contract_builder.command(
+                f"{AREA} <{X1}> <{Z1}> <{X2}> <{Z2}> <{DIM}>", self.contract_group_area
+            )
             self.set_builder_coordinate_args(contract_builder)
+            self.set_builder_area_args(contract_builder)
             contract_builder.add_children_for(contract_sub)
 
             return node.then(expand.then(expand_sub)).then(contract.then(contract_sub))
@@ -398,18 +406,23 @@ class GroupCommand(AbstractSubCommand):
         if not group.is_src_admin(source):
             return self.perm_denied(source)
 
-        region_list = group.regions
+        region_list = [*group.areas, *group.regions]
 
-        def get_line(region: Region):
+        def get_line(member: Union[Region, RegionArea]):
+            if isinstance(member, RegionArea):
+                args = (
+                    f"{AREA} {member.x1} {member.z1} {member.x2} {member.z2} {member.dim}"
+                )
+            else:
+                args = f"{member.x} {member.z} {member.dim}"
             line = [
                 RText("[x]", RColor.red, RStyle.bold)
                 .c(
                     RAction.suggest_command,
-                    f"{current_prefix} {GROUP} {CONTRACT} {group_name}"
-                    + f" {region.x} {region.z} {region.dim}",
+                    f"{current_prefix} {GROUP} {CONTRACT} {group_name} {args}",
                 )
                 .h(self.ctr("region_list.del_hover")),
-                RText(str(region), RColor.aqua),
+                RText(str(member), RColor.aqua),
             ]
             return get_rfum_comp_prefix(*line, divider=" ")
 
@@ -421,7 +434,10 @@ class GroupCommand(AbstractSubCommand):
             self.ctr("region_list.title"),
             get_rfum_comp_prefix(
                 self.ctr(
-                    "region_list.amount", group=group_name, count=len(region_list)
+                    "region_list.amount",
+                    group=group_name,
+                    count=len(group.regions),
+                    areas=len(group.areas),
                 ),
                 RText("[+]", RColor.light_purple, RStyle.bold)
                 .h(self.ctr("region_list.add_hover"))
@@ -486,6 +502,7 @@ class GroupCommand(AbstractSubCommand):
                 self.ctr(
                     "info.regions",
                     count=len(group.regions),
+                    areas=len(group.areas),
                     hint=self.rtr(f"{LIST}.{LIST}_hint.text")
                     .c(
                         RAction.run_command,
@@ -511,13 +528,22 @@ class GroupCommand(AbstractSubCommand):
         ]
         source.reply(get_rfum_comp_prefix(*text, divider="\n"))
 
-    def __expand_group(self, source: CommandSource, group_name: str, region: Region):
+    def __expand_group(
+        self,
+        source: CommandSource,
+        group_name: str,
+        region: Union[Region, RegionArea],
+    ):
         group = self.rfum.group_manager.get_group(group_name)
         if group is None:
             return self.group_not_found(source, group_name)
         if not group.is_src_admin(source):
             return self.perm_denied(source)
-        if region in group.regions:
+        if isinstance(region, RegionArea):
+            listed = group.is_area_listed(region)
+        else:
+            listed = group.is_listed(region)
+        if listed:
             return source.reply(
                 get_rfum_comp_prefix(
                     self.ctr(
@@ -525,7 +551,11 @@ class GroupCommand(AbstractSubCommand):
                     )
                 )
             )
-        if group.add_region(region):
+        if isinstance(region, RegionArea):
+            added = group.add_area(region)
+        else:
+            added = group.add_region(region)
+        if added:
             source.reply(
                 get_rfum_comp_prefix(
                     self.ctr("expanded", region=str(region), group=group_name)
@@ -536,13 +566,22 @@ class GroupCommand(AbstractSubCommand):
                 get_rfum_comp_prefix(self.ctr("error.unknown").set_color(RColor.red))
             )
 
-    def __contract_group(self, source: CommandSource, group_name: str, region: Region):
+    def __contract_group(
+        self,
+        source: CommandSource,
+        group_name: str,
+        region: Union[Region, RegionArea],
+    ):
         group = self.rfum.group_manager.get_group(group_name)
         if group is None:
             return self.group_not_found(source, group_name)
         if not group.is_src_admin(source):
             return self.perm_denied(source)
-        if region not in group.regions:
+        if isinstance(region, RegionArea):
+            listed = group.is_area_overlapped(region)
+        else:
+            listed = group.is_listed(region)
+        if not listed:
             return source.reply(
                 get_rfum_comp_prefix(
                     self.ctr(
@@ -550,7 +589,11 @@ class GroupCommand(AbstractSubCommand):
                     )
                 )
             )
-        if group.remove_region(region):
+        if isinstance(region, RegionArea):
+            removed = group.remove_area(region)
+        else:
+            removed = group.remove_region(region)
+        if removed:
             source.reply(
                 get_rfum_comp_prefix(
                     self.ctr("contracted", region=str(region), group=group_name)
@@ -573,6 +616,14 @@ class GroupCommand(AbstractSubCommand):
             source, group_name, Region(*self.get_ctx_coordinates(context))
         )
 
+    def expand_group_area(self, source: CommandSource, context: CommandContext):
+        group_name = context[GROUP_NAME]
+        self.__expand_group(source, group_name, self.get_ctx_area(context))
+
+    def contract_group_area(self, source: CommandSource, context: CommandContext):
+        group_name = context[GROUP_NAME]
+        self.__contract_group(source, group_name, self.get_ctx_area(context))
+
     def expand_group_by_player_pos(
         self, source: CommandSource, context: CommandContext
     ):
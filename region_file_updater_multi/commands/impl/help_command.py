@@ -25,7 +25,7 @@ class HelpCommand(AbstractSubCommand):
             _Literal([ADD, DEL, DEL_ALL]).runs(self.help_add_del)
         ).then(_Literal(LIST).runs(self.help_list)).then(
             _Literal(HISTORY).runs(self.help_history)
-        ).then(_Literal({CONFIRM, ABORT, UPDATE}).runs(self.help_update)).then(
+        ).then(_Literal({CONFIRM, ABORT, RECOVER, ROLLBACK, UPDATE}).runs(self.help_update)).then(
             _Literal(GROUP).runs(self.help_group)
         )
         return root_node.then(node)
@@ -99,6 +99,7 @@ class HelpCommand(AbstractSubCommand):
                 f"{LIST}.help.usage",
                 pre=current_prefix,
                 list=LIST,
+                diff=DIFF,
                 prefixes=self.prefixes,
             ),
             self.rtr("help.optional_arguments_title"),
@@ -149,6 +150,10 @@ class HelpCommand(AbstractSubCommand):
                 update=UPDATE,
                 confirm=CONFIRM,
                 abort=ABORT,
+                recover=RECOVER,
+                discard=DISCARD,
+                rollback=ROLLBACK,
+                confirm_flag=CONFIRM_FLAG,
                 prefixes=self.prefixes,
             ),
             self.rtr("help.optional_arguments_title"),
@@ -1,5 +1,9 @@
+import json
+import os
+
 from mcdreforged.api.all import *
 
+from region_file_updater_multi.storage.history import History, PHASES
 from region_file_updater_multi.commands.sub_command import AbstractSubCommand
 from region_file_updater_multi.commands.tree_constants import *
 from region_file_updater_multi.components.list import ListComponent
@@ -8,6 +12,18 @@ from region_file_updater_multi.components.misc import (
     datetime_tr,
 )
 from region_file_updater_multi.mcdr_globals import *
+from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.utils.units import ByteCount
+
+# Most updated regions in the stats message and in the dumped file
+STATS_TOP_REGIONS = 5
+STATS_DUMP_TOP_REGIONS = 100
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{round(seconds * 1000, 1)}ms"
+    return f"{round(seconds, 2)}s"
 
 
 class HistoryCommand(AbstractSubCommand):
@@ -20,27 +36,97 @@ class HistoryCommand(AbstractSubCommand):
         return False
 
     def add_children_for(self, root_node: AbstractNode):
-        return root_node.then(
-            self.permed_literal(HISTORY)
-            .runs(self.display_history)
-            .then(
-                self.list_command_factory(self.literal(LIST)).runs(
-                    self.list_history_regions
-                )
-            )
+        builder = SimpleCommandBuilder()
+        builder.command(HISTORY, self.display_latest_history)
+        builder.command(f"{HISTORY} {LIST}", self.list_history)
+        builder.command(f"{HISTORY} {TIMINGS}", self.display_timings)
+        builder.command(f"{HISTORY} {PLAYER} <{PLAYER}>", self.list_history)
+        builder.command(
+            f"{HISTORY} {REGION} <{X}> <{Z}> <{DIM}>", self.display_region_history
+        )
+        builder.command(f"{HISTORY} {STATS}", self.display_statistics)
+        builder.command(f"{HISTORY} {STATS} {DUMP}", self.dump_statistics)
+        builder.command(f"{HISTORY} {SHOW} <{HISTORY_ID}>", self.display_history)
+        builder.command(
+            f"{HISTORY} {SHOW} <{HISTORY_ID}> {REGIONS}", self.list_history_regions
         )
+        builder.command(f"{HISTORY} {SHOW} <{HISTORY_ID}> {TIMINGS}", self.display_timings)
+
+        builder.literal(HISTORY, self.permed_literal)
+        builder.literal(LIST, self.list_command_factory)
+        builder.literal(TIMINGS, self.list_command_factory)
+        builder.literal(REGIONS, self.list_command_factory)
+        for literal in (PLAYER, REGION, SHOW, STATS, DUMP):
+            builder.literal(literal, self.literal)
+        builder.arg(PLAYER, self.quotable_text).post_process(self.list_command_factory)
+        builder.arg(HISTORY_ID, lambda name: self.integer(name).at_min(1))
+        self.set_builder_coordinate_args(builder)
+        builder.add_children_for(root_node)
 
     @property
     def tr_key_prefix(self):
         return TRANSLATION_KEY_PREFIX + f"command.{HISTORY}."
 
-    def display_history(self, source: CommandSource, context: CommandContext):
-        current_prefix = context.command.split(" ")[0]
+    def __get_history(self, source: CommandSource, context: CommandContext):
+        """
+        Entry selected by history id argument, the latest one if not given
+        Replies and returns None if it's not found
+        """
+        history_id = context.get(HISTORY_ID)
+        if history_id is None:
+            history_id, data = self.rfum.history.data_id, self.rfum.history.data
+            if data is None:
+                source.reply(get_rfum_comp_prefix(self.ctr("error.not_recorded")))
+                return None
+        else:
+            data = self.rfum.history.get(history_id)
+            if data is None:
+                source.reply(
+                    get_rfum_comp_prefix(
+                        self.ctr("error.not_found", history_id).set_color(RColor.red)
+                    )
+                )
+                return None
+        return history_id, data
+
+    def display_latest_history(self, source: CommandSource, context: CommandContext):
         history = self.rfum.history.data
         if history is None:
             return source.reply(get_rfum_comp_prefix(self.ctr("error.not_recorded")))
+        self.__display_history(
+            source, context, self.rfum.history.data_id, history, latest=True
+        )
+
+    def display_history(self, source: CommandSource, context: CommandContext):
+        result = self.__get_history(source, context)
+        if result is not None:
+            self.__display_history(source, context, *result)
+
+    def display_region_history(self, source: CommandSource, context: CommandContext):
+        region = Region(*self.get_ctx_coordinates(context))
+        history_id = self.rfum.history.get_last_id_by_region(str(region))
+        data = None if history_id is None else self.rfum.history.get(history_id)
+        if data is None:
+            return source.reply(
+                get_rfum_comp_prefix(self.ctr("error.region_not_recorded", str(region)))
+            )
+        self.__display_history(source, context, history_id, data)
+
+    def __display_history(
+        self,
+        source: CommandSource,
+        context: CommandContext,
+        history_id: int,
+        history: History.HistoryData,
+        latest: bool = False,
+    ):
+        current_prefix = context.command.split(" ")[0]
+        if latest:
+            title = self.rtr(f"{HISTORY}.result.title")
+        else:
+            title = self.rtr(f"{HISTORY}.result.entry_title", history_id)
         text = [
-            self.rtr(f"{HISTORY}.result.title"),
+            title,
             get_rfum_comp_prefix(
                 self.ctr(
                     "result.executor", history.player or self.rfum.rtr("format.console")
@@ -63,17 +149,84 @@ class HistoryCommand(AbstractSubCommand):
                     f"{HISTORY}.result.region_amount",
                     count=len(history.last_operation_mca),
                     button=self.rtr(f"{HISTORY}.result.list_region_button")
-                    .c(RAction.run_command, f"{current_prefix} {HISTORY} {LIST}")
+                    .c(
+                        RAction.run_command,
+                        f"{current_prefix} {HISTORY} {SHOW} {history_id} {REGIONS}",
+                    )
                     .h(self.rtr(f"{HISTORY}.result.list_button_hover")),
                 )
             ),
         ]
+        snapshot = self.rfum.snapshot_store.get_snapshot(history.snapshot_id)
+        if snapshot is not None:
+            text.append(
+                get_rfum_comp_prefix(
+                    self.rtr(
+                        f"{HISTORY}.result.snapshot",
+                        count=snapshot.file_count,
+                        button=self.rtr(f"{HISTORY}.result.rollback_button")
+                        .c(RAction.run_command, f"{current_prefix} {ROLLBACK}")
+                        .h(self.rtr(f"{HISTORY}.result.rollback_button_hover")),
+                    )
+                )
+            )
+        source.reply(get_rfum_comp_prefix(*text, divider="\n"))
+
+    # !!rfum history list / !!rfum history player <player>
+    def list_history(self, source: CommandSource, context: CommandContext):
+        page, item_per_page = self.get_list_args(context)
+        current_prefix = context.command.split(" ")[0]
+        player = context.get(PLAYER)
+
+        def get_line(summary: History.Summary):
+            status = "succeeded" if summary.is_succeeded else "failed"
+            return get_rfum_comp_prefix(
+                self.ctr(
+                    f"{LIST}.line",
+                    id=summary.history_id,
+                    time=datetime_tr(summary.timestamp),
+                    player=summary.player or self.rfum.rtr("format.console"),
+                    status=self.ctr(status),
+                    count=summary.region_count,
+                )
+                .c(
+                    RAction.run_command,
+                    f"{current_prefix} {HISTORY} {SHOW} {summary.history_id}",
+                )
+                .h(self.ctr(f"{LIST}.line_hover", summary.history_id))
+            )
+
+        list_comp = ListComponent(
+            self.rfum.history.get_view(player),
+            get_line,
+            self.config.default_item_per_page,
+        )
+        if player is None:
+            command = f"{current_prefix} {HISTORY} {LIST} "
+            amount = self.ctr(f"{LIST}.amount", len(list_comp))
+        else:
+            command = f"{current_prefix} {HISTORY} {PLAYER} {player} "
+            amount = self.ctr(f"{LIST}.player_amount", player, len(list_comp))
+        text = [
+            self.ctr(f"{LIST}.title"),
+            get_rfum_comp_prefix(amount),
+            *list_comp.get_page_line_list(page, item_per_page=item_per_page),
+            list_comp.get_page_hint_line(
+                page,
+                item_per_page=item_per_page,
+                command_format=command + self.get_list_command_args_format(),
+            ),
+        ]
         source.reply(get_rfum_comp_prefix(*text, divider="\n"))
 
     def list_history_regions(self, source: CommandSource, context: CommandContext):
         page, item_per_page = self.get_list_args(context)
         current_prefix = context.command.split(" ")[0]
-        regions = self.rfum.history.data.last_operation_mca
+        result = self.__get_history(source, context)
+        if result is None:
+            return
+        history_id, history = result
+        regions = history.last_operation_mca
 
         list_comp = ListComponent(
             regions.items(),
@@ -88,14 +241,165 @@ class HistoryCommand(AbstractSubCommand):
             self.config.default_item_per_page,
         )
         text = [
-            self.rtr(f"{HISTORY}.{LIST}.title"),
-            get_rfum_comp_prefix(self.rtr(f"{HISTORY}.{LIST}.amount", len(regions))),
+            self.ctr(f"{REGIONS}.title", history_id),
+            get_rfum_comp_prefix(self.ctr(f"{REGIONS}.amount", len(regions))),
             *list_comp.get_page_line_list(page, item_per_page=item_per_page),
             list_comp.get_page_hint_line(
                 page,
                 item_per_page=item_per_page,
-                command_format=f"{current_prefix} {HISTORY} list "
+                command_format=f"{current_prefix} {HISTORY} {SHOW} {history_id} {REGIONS} "
                 + self.get_list_command_args_format(),
+            ),
+        ]
+        source.reply(get_rfum_comp_prefix(*text, divider="\n"))
+
+    def display_timings(self, source: CommandSource, context: CommandContext):
+        page, item_per_page = self.get_list_args(context)
+        current_prefix = context.command.split(" ")[0]
+        result = self.__get_history(source, context)
+        if result is None:
+            return
+        history_id, history = result
+        timings = history.timings
+        if timings is None:
+            return source.reply(
+                get_rfum_comp_prefix(self.ctr("error.timings_not_recorded"))
+            )
+
+        phase_lines = [
+            get_rfum_comp_prefix(
+                self.ctr(
+                    f"{TIMINGS}.phase",
+                    phase=self.ctr(f"{TIMINGS}.phases.{phase}"),
+                    time=format_seconds(timings.phases[phase]),
+                )
+            )
+            for phase in PHASES
+            if phase in timings.phases.keys()
+        ]
+        upstream_lines = [
+            get_rfum_comp_prefix(
+                self.ctr(
+                    f"{TIMINGS}.upstream",
+                    name=name,
+                    count=upstream.file_count,
+                    size=ByteCount(upstream.size).auto_str(),
+                    time=format_seconds(upstream.extract),
+                    speed=ByteCount(
+                        upstream.size / upstream.extract if upstream.extract > 0 else 0
+                    ).auto_str(),
+                )
+            )
+            for name, upstream in timings.upstreams.items()
+        ]
+
+        def file_line(file: History.FileTiming):
+            return get_rfum_comp_prefix(
+                self.ctr(
+                    f"{TIMINGS}.file",
+                    file=RText(file.file_name, RColor.aqua).h(file.region),
+                    status=file.status or "-",
+                    size=ByteCount(file.size).auto_str(),
+                    recycle=format_seconds(file.recycle),
+                    extract=format_seconds(file.extract),
+                    apply=format_seconds(file.apply),
+                )
             )
+
+        # Slowest files first
+        list_comp = ListComponent(
+            sorted(timings.files, key=lambda f: f.total, reverse=True),
+            file_line,
+            self.config.default_item_per_page,
+        )
+        text = [
+            self.ctr(f"{TIMINGS}.title"),
+            *phase_lines,
+            *upstream_lines,
+            get_rfum_comp_prefix(self.ctr(f"{TIMINGS}.file_amount", len(list_comp))),
+            *list_comp.get_page_line_list(page, item_per_page=item_per_page),
+            list_comp.get_page_hint_line(
+                page,
+                item_per_page=item_per_page,
+                command_format=f"{current_prefix} {HISTORY} {SHOW} {history_id} {TIMINGS} "
+                + self.get_list_command_args_format(),
+            ),
+        ]
+        source.reply(get_rfum_comp_prefix(*text, divider="\n"))
+
+    # !!rfum history stats
+    def display_statistics(self, source: CommandSource, context: CommandContext):
+        stats = self.rfum.history.get_statistics(STATS_TOP_REGIONS)
+        if stats.sessions == 0:
+            return source.reply(get_rfum_comp_prefix(self.ctr("error.not_recorded")))
+        current_prefix = context.command.split(" ")[0]
+
+        def downtime_text(seconds):
+            return "-" if seconds is None else format_seconds(seconds)
+
+        text = [
+            self.ctr(f"{STATS}.title"),
+            get_rfum_comp_prefix(
+                self.ctr(
+                    f"{STATS}.sessions",
+                    sessions=stats.sessions,
+                    rate=round(stats.success_rate * 100, 1),
+                )
+            ),
+            get_rfum_comp_prefix(
+                self.ctr(
+                    f"{STATS}.moved",
+                    files=stats.files,
+                    size=ByteCount(stats.size).auto_str(),
+                )
+            ),
         ]
+        for name, upstream in stats.upstreams.items():
+            text.append(
+                get_rfum_comp_prefix(
+                    self.ctr(
+                        f"{STATS}.upstream",
+                        name=name,
+                        sessions=upstream.sessions,
+                        files=upstream.files,
+                        size=ByteCount(upstream.size).auto_str(),
+                        median=downtime_text(upstream.downtime_median),
+                        p95=downtime_text(upstream.downtime_p95),
+                    )
+                )
+            )
+        if len(stats.top_regions) > 0:
+            text.append(get_rfum_comp_prefix(self.ctr(f"{STATS}.top_regions")))
+            for region in stats.top_regions:
+                text.append(
+                    get_rfum_comp_prefix(
+                        self.ctr(
+                            f"{STATS}.region", region=region.region, count=region.count
+                        )
+                    )
+                )
+        command = f"{current_prefix} {HISTORY} {STATS} {DUMP}"
+        text.append(
+            get_rfum_comp_prefix(
+                self.ctr(f"{STATS}.dump_button")
+                .c(RAction.run_command, command)
+                .h(self.ctr(f"{STATS}.dump_button_hover", command))
+            )
+        )
         source.reply(get_rfum_comp_prefix(*text, divider="\n"))
+
+    # !!rfum history stats dump
+    def dump_statistics(self, source: CommandSource):
+        stats = self.rfum.history.get_statistics(STATS_DUMP_TOP_REGIONS)
+        path = os.path.join(self.rfum.get_data_folder(), HISTORY_STATS_FILE)
+        try:
+            with self.rfum.file_utilities.safe_write(path) as f:
+                json.dump(stats.serialize(), f, ensure_ascii=False, indent=4)
+        except OSError as exc:
+            self.logger.exception("Dumping update statistics failed")
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(f"{STATS}.dump_failed", str(exc)).set_color(RColor.red)
+                )
+            )
+        source.reply(get_rfum_comp_prefix(self.ctr(f"{STATS}.dumped", path)))
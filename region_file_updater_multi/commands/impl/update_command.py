@@ -1,14 +1,20 @@
-from mcdreforged.api.all import *
+from typing import Callable, Iterable, List
 
+from mcdreforged.api.all import *
 
 from region_file_updater_multi.commands.sub_command import AbstractSubCommand
 from region_file_updater_multi.commands.tree_constants import *
 from region_file_updater_multi.components.misc import (
     get_rfum_comp_prefix,
     get_duration_text,
+    datetime_tr,
 )
 from region_file_updater_multi.mcdr_globals import *
-from region_file_updater_multi.utils.units import Duration
+from region_file_updater_multi.utils.units import Duration, ByteCount
+from region_file_updater_multi.region_upstream_manager import Region
+
+# Missing files listed in the hover text of update broadcast at most
+MISSING_FILES_HOVER_LIMIT = 16
 
 
 class UpdateCommand(AbstractSubCommand):
@@ -52,6 +58,20 @@ class UpdateCommand(AbstractSubCommand):
         # Abort
         builder.command(ABORT, self.abort_update)
         builder.literal(ABORT, self.permed_literal)
+
+        # Recover
+        builder.command(RECOVER, self.recover_session)
+        builder.command(f"{RECOVER} {DISCARD}", self.recover_session)
+        builder.literal(RECOVER, self.permed_literal)
+        builder.literal(
+            DISCARD, lambda name: self.counting_literal(name, DISCARD_COUNT)
+        )
+
+        # Rollback
+        builder.command(ROLLBACK, self.rollback_preview)
+        builder.command(f"{ROLLBACK} {CONFIRM_FLAG}", self.rollback_snapshot)
+        builder.literal(ROLLBACK, self.permed_literal)
+        builder.literal(CONFIRM_FLAG)
         builder.add_children_for(root_node)
 
     @property
@@ -69,6 +89,16 @@ class UpdateCommand(AbstractSubCommand):
                     self.rtr("error_message.session_running").set_color(RColor.red)
                 )
             )
+        if self.rfum.file_utilities.interrupted_session is not None:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(
+                        "error.interrupted_session",
+                        recover=f"{context.command.split(' ')[0]} {RECOVER}",
+                        discard=DISCARD,
+                    ).set_color(RColor.red)
+                )
+            )
         instantly = self.get_ctx_flag(context, INSTANTLY_COUNT)
         requires_confirm = self.get_ctx_flag(context, REQUIRES_CONFIRM_COUNT)
         time_wait: Duration = context.get(
@@ -111,6 +141,7 @@ class UpdateCommand(AbstractSubCommand):
                 .c(RAction.run_command, f"{current_prefix} {LIST}")
                 .h(self.rtr(f"{LIST}.{LIST}_hint.hover")),
             ),
+            *self.__get_missing_files_text(regions.keys()),
             self.ctr(
                 "make_decision",
                 duration=get_duration_text(int(time_wait.value)),
@@ -130,6 +161,30 @@ class UpdateCommand(AbstractSubCommand):
             source, requires_confirm=requires_confirm, confirm_time_wait=time_wait
         )
 
+    def __get_missing_files_text(self, regions: Iterable[Region]) -> List[RTextBase]:
+        try:
+            report = self.rfum.region_upstream_manager.get_missing_files(regions)
+        except Exception:
+            self.logger.exception("Error checking files in upstream")
+            return []
+        if report is None or len(report.missing) == 0:
+            return []
+        hover = report.missing[:MISSING_FILES_HOVER_LIMIT]
+        if len(report.missing) > MISSING_FILES_HOVER_LIMIT:
+            hover.append("...")
+        if self.config.update_operation.remove_file_while_not_found:
+            hover_title = self.ctr("missing_files_hover.removed")
+        else:
+            hover_title = self.ctr("missing_files_hover.kept")
+        return [
+            self.ctr(
+                "missing_files",
+                missing=len(report.missing),
+                total=report.total,
+                upstream=report.upstream_name,
+            ).h(hover_title, "\n", "\n".join(hover))
+        ]
+
     # !!rfum confirm
     def confirm_update(self, source: CommandSource):
         if not self.rfum.current_session.is_session_running:
@@ -151,3 +206,142 @@ class UpdateCommand(AbstractSubCommand):
             )
         source.reply(get_rfum_comp_prefix(self.ctr("execute_abort")))
         self.rfum.current_session.abort_session()
+
+    # !!rfum recover [--discard]
+    def recover_session(self, source: CommandSource, context: CommandContext):
+        file_utils = self.rfum.file_utilities
+        interrupted = file_utils.interrupted_session
+        if interrupted is None:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.nothing_to_recover").set_color(RColor.red)
+                )
+            )
+        if not self.__check_idle(source):
+            return
+        if self.get_ctx_flag(context, DISCARD_COUNT):
+            file_utils.discard_interrupted_session()
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("recover.discarded", len(interrupted.files))
+                )
+            )
+
+        restored = self.__run_with_server_stopped(
+            source,
+            "recover",
+            len(interrupted.files),
+            file_utils.recover_interrupted_session,
+        )
+        if restored is not None:
+            source.reply(
+                get_rfum_comp_prefix(self.ctr("recover.recovered", len(restored)))
+            )
+
+    def __run_with_server_stopped(
+        self, source: CommandSource, key: str, file_count: int, func: Callable
+    ):
+        """
+        Region files can't be replaced while the server is using them, the server is
+        started again afterward if it was running
+        Returns None if func failed
+        """
+        was_running = self.server.is_server_running()
+        if was_running:
+            self.server.broadcast(
+                get_rfum_comp_prefix(self.ctr(f"{key}.stopping_server", file_count))
+            )
+            self.server.stop()
+            self.server.wait_until_stop()
+        try:
+            return func()
+        except Exception as exc:
+            self.logger.exception(f"Error running {key}")
+            source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(f"{key}.failed", str(exc)).set_color(RColor.red)
+                )
+            )
+            return None
+        finally:
+            if was_running:
+                self.server.start()
+
+    def __check_idle(self, source: CommandSource) -> bool:
+        if self.rfum.current_session.is_session_running:
+            source.reply(
+                get_rfum_comp_prefix(
+                    self.rtr("error_message.session_running").set_color(RColor.red)
+                )
+            )
+            return False
+        return True
+
+    # !!rfum rollback
+    def rollback_preview(self, source: CommandSource, context: CommandContext):
+        snapshot = self.rfum.snapshot_store.get_latest()
+        if snapshot is None:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.nothing_to_rollback").set_color(RColor.red)
+                )
+            )
+        command = f"{context.command.split(' ')[0]} {ROLLBACK} {CONFIRM_FLAG}"
+        text = [
+            self.ctr(
+                "rollback.preview",
+                player=snapshot.player or self.rfum.rtr("format.console"),
+                time=datetime_tr(snapshot.timestamp),
+                upstream=snapshot.upstream_name,
+                region_count=snapshot.region_count,
+            ),
+            self.ctr(
+                "rollback.files",
+                file_count=snapshot.file_count,
+                size=ByteCount(snapshot.size).auto_str(),
+                created=len(snapshot.created_files),
+            ),
+            self.ctr("rollback.hint.text")
+            .c(RAction.suggest_command, command)
+            .h(self.ctr("rollback.hint.hover", command)),
+        ]
+        source.reply(RTextBase.join("\n", [get_rfum_comp_prefix(item) for item in text]))
+
+    # !!rfum rollback --confirm
+    def rollback_snapshot(self, source: CommandSource):
+        snapshot = self.rfum.snapshot_store.get_latest()
+        if snapshot is None:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr("error.nothing_to_rollback").set_color(RColor.red)
+                )
+            )
+        if not self.__check_idle(source):
+            return
+        if self.rfum.file_utilities.interrupted_session is not None:
+            return source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(
+                        "error.interrupted_session",
+                        recover=f"{self.command_manager.prefixes[0]} {RECOVER}",
+                        discard=DISCARD,
+                    ).set_color(RColor.red)
+                )
+            )
+        restored = self.__run_with_server_stopped(
+            source,
+            "rollback",
+            snapshot.file_count,
+            lambda: self.rfum.snapshot_store.rollback(snapshot),
+        )
+        if restored is not None:
+            source.reply(
+                get_rfum_comp_prefix(
+                    self.ctr(
+                        "rollback.done",
+                        time=datetime_tr(snapshot.timestamp),
+                        restored=len(restored),
+                        removed=len(snapshot.created_files),
+                    )
+                )
+            )
@@ -11,6 +11,9 @@ from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.components.list import ListComponent
 from region_file_updater_multi.upstream.impl.invalid_upstream import InvalidUpstream
 from region_file_updater_multi.upstream.impl.pb_upstream import PrimeBackupUpstream
+from region_file_updater_multi.upstream.impl.pb_db_upstream import (
+    PrimeBackupDatabaseUpstream,
+)
 from region_file_updater_multi.upstream.impl.world_upstream import WorldSaveUpstream
 from region_file_updater_multi.upstream.abstract_upstream import AbstractUpstream
 
@@ -89,6 +92,13 @@ class UpstreamCommand(AbstractSubCommand):
                 line_prefix = RText("§3[P]§r").h(
                     self.ctr(f"{LIST}.ups_prefix.pb_hover")
                 )
+            elif (
+                isinstance(upstream, PrimeBackupDatabaseUpstream)
+                or original_type is PrimeBackupDatabaseUpstream
+            ):
+                line_prefix = RText("§3[D]§r").h(
+                    self.ctr(f"{LIST}.ups_prefix.pb_db_hover")
+                )
             elif (
                 isinstance(upstream, WorldSaveUpstream)
                 or original_type is WorldSaveUpstream
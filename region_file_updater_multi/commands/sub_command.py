@@ -10,17 +10,19 @@ from typing import (
     Iterable,
     Union,
     Tuple,
+    overload,
 )
 from queue import Queue
 from threading import RLock
 from types import MethodType
 
 import inspect
+import math
 
 from mcdreforged.api.all import *
 from typing_extensions import Self, TypeAlias
 
-from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.region_upstream_manager import Region, RegionArea
 from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.commands.tree_constants import *
 from region_file_updater_multi.commands.node_factory import DurationNode
@@ -216,10 +218,17 @@ class AbstractSubCommand(ABC):
             get_rfum_comp_prefix(self.rfum.command_manager.perm_denied_text_getter())
         )
 
+    @overload
+    def list_command_factory(self, node_base: Union[str, Iterable[str]]) -> Literal: ...
+
+    @overload
+    def list_command_factory(self, node_base: AnyNode) -> AnyNode: ...
+
     def list_command_factory(
-        self, node_base: Union[str, Iterable[str], Literal]
-    ) -> Literal:
-        if not isinstance(node_base, Literal):
+        self, node_base: Union[str, Iterable[str], AbstractNode]
+    ) -> AbstractNode:
+        node: AbstractNode
+        if not isinstance(node_base, AbstractNode):
             node = self.literal(node_base)
         else:
             node = node_base
@@ -253,6 +262,13 @@ class AbstractSubCommand(ABC):
             lambda src, ctx: self.rtr("add_del.error.invalid_dimension", ctx[DIM]),
         ).suggests(lambda: self.__rfum.config.paths.dimension_mca_files.keys())
 
+    def set_builder_area_args(self, b: SimpleCommandBuilder) -> Any:
+        """
+        Corner arguments of an area, dimension argument is set by set_builder_coordinate_args
+        """
+        for name in (X1, Z1, X2, Z2):
+            b.arg(name, self.integer)
+
     def is_session_running(self, source: CommandSource, silent=False) -> bool:
         if self.rfum.current_session.is_session_running and not silent:
             source.reply(
@@ -264,6 +280,12 @@ class AbstractSubCommand(ABC):
     def get_ctx_coordinates(context: CommandContext) -> Tuple[int, int, str]:
         return context[X], context[Z], str(context[DIM])
 
+    @staticmethod
+    def get_ctx_area(context: CommandContext) -> RegionArea:
+        return RegionArea(
+            context[X1], context[Z1], context[X2], context[Z2], str(context[DIM])
+        )
+
     def get_region_from_player(self, player: str):
         api = self.server.get_plugin_instance(MINECRAFT_DATA_API)
         coord = api.get_player_coordinate(
@@ -273,3 +295,13 @@ class AbstractSubCommand(ABC):
             player, timeout=self.config.get_mc_data_api_timeout()
         )
         return Region.from_player_coordinates(coord.x, coord.z, str(dim))
+
+    def get_chunk_from_player(self, player: str) -> Tuple[int, int, str]:
+        api = self.server.get_plugin_instance(MINECRAFT_DATA_API)
+        coord = api.get_player_coordinate(
+            player, timeout=self.config.get_mc_data_api_timeout()
+        )
+        dim = api.get_player_dimension(
+            player, timeout=self.config.get_mc_data_api_timeout()
+        )
+        return math.floor(coord.x) >> 4, math.floor(coord.z) >> 4, str(dim)
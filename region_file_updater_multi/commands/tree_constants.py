@@ -6,7 +6,7 @@ Literal {'!!rfum', '!!region'}
 │   ├── Literal {'add', 'del', 'del-all'}
 │   ├── Literal 'list'
 │   ├── Literal 'history'
-│   ├── Literal {'abort', 'confirm', 'update'}
+│   ├── Literal {'abort', 'confirm', 'recover', 'rollback', 'update'}
 │   └── Literal 'group'
 ├── Literal 'upstream'
 │   ├── Literal 'list'
@@ -21,6 +21,21 @@ Literal {'!!rfum', '!!region'}
 │   ├── Literal 'group'
 │   │   └── _QuotableText <group_name>
 │   │       └── Literal '--suppress-warning'
+│   ├── Literal 'area'
+│   │   └── _Integer <x1>
+│   │       └── _Integer <z1>
+│   │           └── _Integer <x2>
+│   │               └── _Integer <z2>
+│   │                   └── _QuotableText <dimension>
+│   │                       └── Literal '--suppress-warning'
+│   ├── Literal 'radius'
+│   │   └── _Integer <radius>
+│   │       └── Literal '--suppress-warning'
+│   ├── Literal 'chunk'
+│   │   └── _Integer <x>
+│   │       └── _Integer <z>
+│   │           └── _QuotableText <dimension>
+│   │               └── Literal '--suppress-warning'
 │   └── _Integer <x>
 │       └── _Integer <z>
 │           └── _QuotableText <dimension>
@@ -29,6 +44,10 @@ Literal {'!!rfum', '!!region'}
 │   ├── Literal 'group'
 │   │   └── _QuotableText <group_name>
 │   │       └── Literal '--suppress-warning'
+│   ├── Literal 'chunk'
+│   │   └── _Integer <x>
+│   │       └── _Integer <z>
+│   │           └── _QuotableText <dimension>
 │   └── _Integer <x>
 │       └── _Integer <z>
 │           └── _QuotableText <dimension>
@@ -38,6 +57,11 @@ Literal {'!!rfum', '!!region'}
 │   │   └── Integer <page_num>
 │   └── Literal '--per-page'
 │       └── Integer <item_count>
+├── Literal 'diff'
+│   ├── Literal '--page'
+│   │   └── Integer <page_num>
+│   └── Literal '--per-page'
+│       └── Integer <item_count>
 ├── Literal 'update'
 │   ├── Literal '--instantly'
 │   ├── Literal '--requires-confirm'
@@ -45,20 +69,65 @@ Literal {'!!rfum', '!!region'}
 │       └── _DurationNode <duration>
 ├── Literal 'confirm'
 ├── Literal 'abort'
+├── Literal 'recover'
+│   └── Literal '--discard'
+├── Literal 'rollback'
+│   └── Literal '--confirm'
 ├── Literal 'history'
-│   └── Literal 'list'
-│       ├── Literal '--page'
-│       │   └── Integer <page_num>
-│       └── Literal '--per-page'
-│           └── Integer <item_count>
+│   ├── Literal 'list'
+│   │   ├── Literal '--page'
+│   │   │   └── Integer <page_num>
+│   │   └── Literal '--per-page'
+│   │       └── Integer <item_count>
+│   ├── Literal 'timings'
+│   │   ├── Literal '--page'
+│   │   │   └── Integer <page_num>
+│   │   └── Literal '--per-page'
+│   │       └── Integer <item_count>
+│   ├── Literal 'player'
+│   │   └── _QuotableText <player>
+│   │       ├── Literal '--page'
+│   │       │   └── Integer <page_num>
+│   │       └── Literal '--per-page'
+│   │           └── Integer <item_count>
+│   ├── Literal 'region'
+│   │   └── _Integer <x>
+│   │       └── _Integer <z>
+│   │           └── _QuotableText <dimension>
+│   ├── Literal 'stats'
+│   │   └── Literal 'dump'
+│   └── Literal 'show'
+│       └── _Integer <history_id>
+│           ├── Literal 'regions'
+│           │   ├── Literal '--page'
+│           │   │   └── Integer <page_num>
+│           │   └── Literal '--per-page'
+│           │       └── Integer <item_count>
+│           └── Literal 'timings'
+│               ├── Literal '--page'
+│               │   └── Integer <page_num>
+│               └── Literal '--per-page'
+│                   └── Integer <item_count>
 ├── Literal 'group'
 │   ├── Literal 'expand'
 │   │   └── _QuotableText <group_name>
+│   │       ├── Literal 'area'
+│   │       │   └── _Integer <x1>
+│   │       │       └── _Integer <z1>
+│   │       │           └── _Integer <x2>
+│   │       │               └── _Integer <z2>
+│   │       │                   └── _QuotableText <dimension>
 │   │       └── _Integer <x>
 │   │           └── _Integer <z>
 │   │               └── _QuotableText <dimension>
 │   ├── Literal 'contract'
 │   │   └── _QuotableText <group_name>
+│   │       ├── Literal 'area'
+│   │       │   └── _Integer <x1>
+│   │       │       └── _Integer <z1>
+│   │       │           └── _Integer <x2>
+│   │       │               └── _Integer <z2>
+│   │       │                   └── _QuotableText <dimension>
 │   │       └── _Integer <x>
 │   │           └── _Integer <z>
 │   │               └── _QuotableText <dimension>
@@ -119,11 +188,21 @@ ADD = "add"
 DEL = "del"
 DEL_ALL = "del-all"
 LIST = "list"
+DIFF = "diff"
 UPDATE = "update"
 CONFIRM = "confirm"
 ABORT = "abort"
+RECOVER = "recover"
+ROLLBACK = "rollback"
 HISTORY = "history"
+TIMINGS = "timings"
+SHOW = "show"
+REGION = "region"
+REGIONS = "regions"
+STATS = "stats"
+DUMP = "dump"
 GROUP = "group"
+CHUNK = "chunk"
 USE = "use"
 ENABLE = "enable"
 DISABLE = "disable"
@@ -139,6 +218,8 @@ DELETE = "delete"
 INFO = "info"
 EXPAND = "expand"
 CONTRACT = "contract"
+AREA = "area"
+RADIUS = "radius"
 
 SET = "set"
 SET_DEFAULT = "set-default"
@@ -149,9 +230,15 @@ GROUP_NAME = "group_name"
 NEW_GROUP_NAME = "new_group_name"
 PLAYER = "player"
 PERM_ENUM = "permission"
+REGION_RADIUS = "radius"
+HISTORY_ID = "history_id"
 
 X = "x"
 Z = "z"
+X1 = "x1"
+Z1 = "z1"
+X2 = "x2"
+Z2 = "z2"
 DIM = "dimension"
 PAGE_INDEX = "page_num"
 ITEM_PER_PAGE = "item_count"
@@ -165,6 +252,8 @@ CONFIRM_TIME_WAIT = "--confirm-time-wait"
 CONFIRM_FLAG = "--confirm"
 CONFIRM_COUNT = "confirm_flag"
 SUPRESS_WARNING = "--suppress-warning"
+DISCARD = "--discard"
+DISCARD_COUNT = "discard_count"
 DURATION = "duration"
 
 # Debug
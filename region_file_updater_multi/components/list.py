@@ -1,4 +1,4 @@
-from typing import Iterable, Generic, TypeVar, Callable, Optional, List
+from typing import Iterable, Generic, TypeVar, Callable, Optional, List, Sequence
 from math import ceil
 
 from mcdreforged.api.all import *
@@ -19,7 +19,10 @@ class ListComponent(Generic[T]):
         factory: Callable[[T], RTextBase],
         default_item_per_page: int,
     ):
-        self.__list = list(object_list)
+        # Sequences are sliced page by page instead of being copied
+        self.__list = (
+            object_list if isinstance(object_list, Sequence) else list(object_list)
+        )
         self.__factory = factory
         self.__length = None
         self.__default_item_per_page = default_item_per_page
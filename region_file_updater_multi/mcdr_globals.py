@@ -7,10 +7,17 @@ from enum import Enum
 __all__ = [
     "CONFIG_FILE",
     "LOG_FILE",
-    "HISTORY_FILE",
+    "HISTORY_DB_FILE",
+    "LEGACY_HISTORY_FILE",
+    "HISTORY_STATS_FILE",
     "GROUP_FILE",
     "RECYCLE_BIN_FOLDER",
-    "RECYCLED_FILE_META",
+    "COLOCATED_RECYCLE_BIN_FOLDER",
+    "SNAPSHOT_FOLDER",
+    "COLOCATED_SNAPSHOT_FOLDER",
+    "SNAPSHOT_META_FILE",
+    "STAGING_FOLDER",
+    "RECYCLE_JOURNAL_FILE",
     "RECYCLED_FILE_NAME",
     "CLI_STDOUT_LOG_FILE",
     "CUSTOM_TRANSLATION_FOLDER",
@@ -38,17 +45,32 @@ __all__ = [
 # - config/region_file_updater_multi
 #     - lang
 #     - .recycle_bin
+#     - .snapshots
 #     config.yml
 #     range.json
-#     history.json
+#     history.db
+#     history_stats.json
 #     rfu_multi.log
 
 CONFIG_FILE = "config.yml"
 LOG_FILE = "rfu_multi.log"
-HISTORY_FILE = "history.json"
+HISTORY_DB_FILE = "history.db"
+# Last update only, imported into history database
+LEGACY_HISTORY_FILE = "history.json"
+# Written by history stats dump
+HISTORY_STATS_FILE = "history_stats.json"
 GROUP_FILE = "group.json"
 RECYCLE_BIN_FOLDER = ".recycle_bin"
-RECYCLED_FILE_META = ".rfu_multi.recycled.json"
+# Placed beside the destination world when update_operation.colocate_recycle_bin is on
+COLOCATED_RECYCLE_BIN_FOLDER = ".rfu_multi.recycle_bin"
+# Replaced files of finished updates, beside the recycle bin to be moved in by renaming
+SNAPSHOT_FOLDER = ".snapshots"
+COLOCATED_SNAPSHOT_FOLDER = ".rfu_multi.snapshots"
+SNAPSHOT_META_FILE = ".rfu_multi.snapshot.json"
+# Beside the destination world, files are extracted here before the server stops
+STAGING_FOLDER = ".rfu_multi.staging"
+# Append-only log of recycle bin changes, left behind only by an interrupted session
+RECYCLE_JOURNAL_FILE = ".rfu_multi.journal"
 RECYCLED_FILE_NAME = ".recycled"
 CLI_STDOUT_LOG_FILE = "cli.log"
 PB_LOGGER_NAME = "PB"
@@ -1,22 +1,75 @@
 import enum
 import os
+import tempfile
 import threading
-from typing import Iterable, TYPE_CHECKING, Dict, Optional, Type, Tuple
+import time
+from math import ceil
+from pathlib import Path
+from concurrent.futures import Future, CancelledError
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Iterable,
+    TYPE_CHECKING,
+    Dict,
+    Optional,
+    Type,
+    Tuple,
+    List,
+    AbstractSet,
+    FrozenSet,
+    NamedTuple,
+)
+
+from mcdreforged.api.all import MCDRPluginEvents
 
 from region_file_updater_multi.upstream.abstract_upstream import AbstractUpstream
 from region_file_updater_multi.upstream.impl.world_upstream import WorldSaveUpstream
 from region_file_updater_multi.upstream.impl.pb_upstream import PrimeBackupUpstream
+from region_file_updater_multi.upstream.impl.pb_db_upstream import (
+    PrimeBackupDatabaseUpstream,
+)
 from region_file_updater_multi.upstream.impl.invalid_upstream import InvalidUpstream
-from region_file_updater_multi.mcdr_globals import PathLike
-from region_file_updater_multi.utils.file_utils import RFUMFileNotFound
+from region_file_updater_multi.mcdr_globals import PathLike, STAGING_FOLDER
+from region_file_updater_multi.utils.file_utils import RFUMFileNotFound, RecycledFile
+from region_file_updater_multi.utils.misc_tools import get_thread_pool_executor
+from region_file_updater_multi.utils.mca import (
+    MCA_SUFFIX,
+    HEADER_SIZE,
+    MCAHeader,
+    HeaderDiff,
+    splice_chunks,
+    diff_headers,
+)
+from region_file_updater_multi.utils.file_compare import (
+    FileFingerprint,
+    is_same_stream,
+)
 
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
-    from region_file_updater_multi.storage.config import Config
+    from region_file_updater_multi.storage.config import Config, ConfigSnapshot
 
 
 class DimensionString(str):
+    """
+    Dimension of a region, its namespace and name are available to file templates
+
+    Use DimensionString.of() to get the shared instance of a dimension
+    """
+
+    __slots__ = ()
+
+    __instances: Dict[str, "DimensionString"] = {}
+
+    @classmethod
+    def of(cls, dim: str) -> "DimensionString":
+        instance = cls.__instances.get(dim)
+        if instance is None:
+            instance = cls.__instances.setdefault(dim, cls(dim))
+        return instance
+
     @property
     def namespace(self):
         if str(self) in ["-1", "0", "1"]:
@@ -36,64 +89,284 @@ class DimensionString(str):
 
 
 class Region:
-    x: Optional[int]
-    z: Optional[int]
-    dim: Optional[str]
+    """
+    Immutable region coordinate, hashed once on creation
 
-    def __init__(
-        self,
-        x: Optional[int] = None,
-        z: Optional[int] = None,
-        dim: Optional[str] = None,
-    ):
-        self.x = x
-        self.z = z
-        self.dim = DimensionString(dim) if dim is not None else None
+    Regions of one dimension share a single DimensionString object
+    """
+
+    __slots__ = ("x", "z", "dim", "__hash")
 
-    def assert_valid(self):
-        if self.x is None or self.z is None or self.dim is None:
+    x: int
+    z: int
+    dim: DimensionString
+
+    def __init__(self, x: int, z: int, dim: str):
+        if x is None or z is None or dim is None:
             raise ValueError("Value not initiated")
+        x, z, dim = int(x), int(z), DimensionString.of(str(dim))
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "z", z)
+        object.__setattr__(self, "dim", dim)
+        object.__setattr__(self, "_Region__hash", hash((x, z, dim)))
 
     @classmethod
     def from_player_coordinates(cls, x: float, z: float, dim: str):
         return cls(int(x) // 512, int(z) // 512, dim)
 
+    @classmethod
+    def from_chunk_coordinates(cls, chunk_x: int, chunk_z: int, dim: str):
+        return cls(chunk_x >> 5, chunk_z >> 5, dim)
+
+    def serialize(self) -> Dict[str, Any]:
+        return {"x": self.x, "z": self.z, "dim": str(self.dim)}
+
+    @classmethod
+    def deserialize(cls, data: Any) -> "Region":
+        if not isinstance(data, dict):
+            raise ValueError(f"Region should be a dict, found {type(data)}")
+        x, z, dim = data.get("x"), data.get("z"), data.get("dim")
+        if type(x) is not int or type(z) is not int or not isinstance(dim, str):
+            raise ValueError(f"Invalid region {data}")
+        return cls(x, z, dim)
+
     # Deprecated
     def to_file_name(self):
         return "r.{}.{}.mca".format(self.x, self.z)
 
-    def to_file_list(self, config: "Config"):
-        self.assert_valid()
-        file_list = []
-        files = config.paths.dimension_mca_files[str(self.dim)]
-        if isinstance(files, str):
-            file_list.append(files.format(x=self.x, z=self.z, dim=self.dim))
-        elif isinstance(files, Iterable):
-            for file in files:
-                file_list.append(file.format(x=self.x, z=self.z, dim=self.dim))
-        else:
-            pass
-        return file_list
+    def to_file_list(self, snapshot: "ConfigSnapshot"):
+        return snapshot.get_region_files(self)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), (self.x, self.z, self.dim)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __eq__(self, other):
-        self.assert_valid()
-        if not isinstance(other, type(self)):
+        if self is other:
+            return True
+        if not isinstance(other, Region):
             return False
         return (
-            self.x == other.x and self.z == other.z and str(self.dim) == str(other.dim)
+            self.__hash == other.__hash
+            and self.x == other.x
+            and self.z == other.z
+            and self.dim == other.dim
         )
 
     def __hash__(self):
-        self.assert_valid()
-        return hash((self.x, self.z, self.dim))
+        return self.__hash
 
     def __repr__(self):
         return "Region[x={}, z={}, dim={}]".format(self.x, self.z, self.dim)
 
 
+class RegionArea:
+    """
+    Immutable rectangle of regions, both corners included
+    """
+
+    __slots__ = ("x1", "z1", "x2", "z2", "dim", "__hash")
+
+    x1: int
+    z1: int
+    x2: int
+    z2: int
+    dim: DimensionString
+
+    def __init__(self, x1: int, z1: int, x2: int, z2: int, dim: str):
+        if None in (x1, z1, x2, z2, dim):
+            raise ValueError("Value not initiated")
+        x1, x2 = sorted((int(x1), int(x2)))
+        z1, z2 = sorted((int(z1), int(z2)))
+        dim = DimensionString.of(str(dim))
+        object.__setattr__(self, "x1", x1)
+        object.__setattr__(self, "z1", z1)
+        object.__setattr__(self, "x2", x2)
+        object.__setattr__(self, "z2", z2)
+        object.__setattr__(self, "dim", dim)
+        object.__setattr__(self, "_RegionArea__hash", hash((x1, z1, x2, z2, dim)))
+
+    @classmethod
+    def of_region(cls, region: Region):
+        return cls(region.x, region.z, region.x, region.z, region.dim)
+
+    @property
+    def region_count(self):
+        return (self.x2 - self.x1 + 1) * (self.z2 - self.z1 + 1)
+
+    def iter_regions(self) -> Iterable[Region]:
+        for x in range(self.x1, self.x2 + 1):
+            for z in range(self.z1, self.z2 + 1):
+                yield Region(x, z, self.dim)
+
+    def contains(self, region: Region):
+        return (
+            region.dim == self.dim
+            and self.x1 <= region.x <= self.x2
+            and self.z1 <= region.z <= self.z2
+        )
+
+    def covers(self, other: "RegionArea"):
+        return (
+            other.dim == self.dim
+            and self.x1 <= other.x1
+            and other.x2 <= self.x2
+            and self.z1 <= other.z1
+            and other.z2 <= self.z2
+        )
+
+    def intersects(self, other: "RegionArea"):
+        return (
+            other.dim == self.dim
+            and self.x1 <= other.x2
+            and other.x1 <= self.x2
+            and self.z1 <= other.z2
+            and other.z1 <= self.z2
+        )
+
+    def subtract(self, other: "RegionArea") -> List["RegionArea"]:
+        """
+        Splits the part of this area outside other into at most 4 areas
+        """
+        if not self.intersects(other):
+            return [self]
+        x1, z1 = max(self.x1, other.x1), max(self.z1, other.z1)
+        x2, z2 = min(self.x2, other.x2), min(self.z2, other.z2)
+        pieces = []
+        if self.x1 < x1:
+            pieces.append(RegionArea(self.x1, self.z1, x1 - 1, self.z2, self.dim))
+        if x2 < self.x2:
+            pieces.append(RegionArea(x2 + 1, self.z1, self.x2, self.z2, self.dim))
+        if self.z1 < z1:
+            pieces.append(RegionArea(x1, self.z1, x2, z1 - 1, self.dim))
+        if z2 < self.z2:
+            pieces.append(RegionArea(x1, z2 + 1, x2, self.z2, self.dim))
+        return pieces
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            "x1": self.x1,
+            "z1": self.z1,
+            "x2": self.x2,
+            "z2": self.z2,
+            "dim": str(self.dim),
+        }
+
+    @classmethod
+    def deserialize(cls, data: Any) -> "RegionArea":
+        if not isinstance(data, dict):
+            raise ValueError(f"Region area should be a dict, found {type(data)}")
+        coordinates: Tuple[Any, Any, Any, Any] = (
+            data.get("x1"),
+            data.get("z1"),
+            data.get("x2"),
+            data.get("z2"),
+        )
+        dim = data.get("dim")
+        if any(type(item) is not int for item in coordinates) or not isinstance(
+            dim, str
+        ):
+            raise ValueError(f"Invalid region area {data}")
+        x1, z1, x2, z2 = coordinates
+        return cls(x1, z1, x2, z2, dim)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), (self.x1, self.z1, self.x2, self.z2, self.dim)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, RegionArea):
+            return False
+        return self.__hash == other.__hash and (
+            self.x1,
+            self.z1,
+            self.x2,
+            self.z2,
+            self.dim,
+        ) == (other.x1, other.z1, other.x2, other.z2, other.dim)
+
+    def __hash__(self):
+        return self.__hash
+
+    def __repr__(self):
+        return "RegionArea[x={}..{}, z={}..{}, dim={}]".format(
+            self.x1, self.x2, self.z1, self.z2, self.dim
+        )
+
+
+class ExtractStatus(enum.Enum):
+    extracted = enum.auto()
+    removed = enum.auto()
+    kept = enum.auto()
+    spliced = enum.auto()
+    unchanged = enum.auto()
+
+
+@dataclass
+class FileExtractResult:
+    region: Region
+    file_name: str
+    # Indexes of selected chunks, None for the whole file
+    chunks: Optional[FrozenSet[int]] = None
+    # Upstream file to take chunks from
+    source_path: Optional[str] = None
+    # Destination file when it was found unchanged, it's compared again before skipping
+    target_fingerprint: Optional[FileFingerprint] = None
+    status: Optional[ExtractStatus] = None
+    error: Optional[BaseException] = None
+    # Monotonic durations in seconds, and size of the extracted file in bytes
+    recycle_time: float = 0.0
+    extract_time: float = 0.0
+    apply_time: float = 0.0
+    size: Optional[int] = None
+
+
+class RegionFileDiff(NamedTuple):
+    region: Region
+    file_name: str
+    world_exists: bool
+    upstream_exists: bool
+    diff: HeaderDiff
+
+
+class MissingFileReport(NamedTuple):
+    upstream_name: str
+    total: int
+    missing: List[str]
+
+
 class UpstreamType(enum.Enum):
     world = WorldSaveUpstream
     prime_backup = PrimeBackupUpstream
+    prime_backup_db = PrimeBackupDatabaseUpstream
+
+
+def _is_cancelled(cancel_event: Optional[threading.Event]) -> bool:
+    return cancel_event is not None and cancel_event.is_set()
 
 
 class RegionUpstreamManager:
@@ -115,21 +388,56 @@ class RegionUpstreamManager:
         if self.__rfum.config.paths.upstreams is None:
             return
         for name, upstream_info in self.__rfum.config.paths.upstreams.items():
-            cls: Type["AbstractUpstream"] = UpstreamType[upstream_info.type].value
-            try:
-                cls.assert_path_valid(upstream_info.path, self.__rfum)
-                self.__upstream[name] = cls(
-                    rfum, name, upstream_info.path, upstream_info.world_name
-                )
-            except Exception as exc:
-                self.__upstream[name] = InvalidUpstream(
-                    rfum, name, upstream_info.path, upstream_info.world_name
-                ).set_error_message(cls, exc)
+            self.__upstream[name] = self.__build_upstream(name, upstream_info)
+
+    def __build_upstream(
+        self, name: str, upstream_info: "Config.Paths.Upstream"
+    ) -> "AbstractUpstream":
+        cls: Type["AbstractUpstream"] = UpstreamType[upstream_info.type].value
+        try:
+            cls.assert_path_valid(upstream_info.path, self.__rfum)
+            return cls(self.__rfum, name, upstream_info.path, upstream_info.world_name)
+        except Exception as exc:
+            return InvalidUpstream(
+                self.__rfum, name, upstream_info.path, upstream_info.world_name
+            ).set_error_message(cls, exc)
+
+    def reload_upstreams(self, names: Iterable[str]):
+        """
+        Builds these upstreams again from current config, the others are left untouched
+        Upstreams no longer in config are closed and removed
+        """
+        upstreams = self.__rfum.config.paths.upstreams or {}
+        with self.__lock:
+            for name in names:
+                old = self.__upstream.pop(name, None)
+                if old is not None:
+                    try:
+                        old.close()
+                    except Exception:
+                        self.__rfum.logger.exception(f"Error closing upstream {name}")
+                if name in upstreams.keys():
+                    self.__upstream[name] = self.__build_upstream(name, upstreams[name])
+                    self.__rfum.verbose(f"Upstream {name} rebuilt")
+                else:
+                    self.__rfum.verbose(f"Upstream {name} removed")
 
     @property
     def upstreams(self):
         return self.__upstream
 
+    def register_event_listeners(self):
+        self.__rfum.server.register_event_listener(
+            MCDRPluginEvents.PLUGIN_UNLOADED, lambda *args, **kwargs: self.close()
+        )
+
+    def close(self):
+        for name, upstream in self.__upstream.items():
+            try:
+                upstream.close()
+            except Exception:
+                self.__rfum.logger.exception(f"Error closing upstream {name}")
+
     def get_sorted_upstreams(self) -> Iterable[Tuple[str, AbstractUpstream]]:
         with self.__lock:
             return sorted(self.upstreams.items(), key=lambda item: item[0])
@@ -154,7 +462,7 @@ class RegionUpstreamManager:
         self.__rfum.save_config()
 
     def get_required_file_list(self, region: "Region"):
-        return region.to_file_list(self.__rfum.config)
+        return region.to_file_list(self.__rfum.config_snapshot)
 
     def extract_region_files(
         self,
@@ -162,30 +470,673 @@ class RegionUpstreamManager:
         directory: Optional[PathLike] = None,
         allow_not_found: bool = True,
     ):
+        return self.extract_regions([region], directory, allow_not_found)
+
+    def extract_regions(
+        self,
+        regions: Iterable["Region"],
+        directory: Optional[PathLike] = None,
+        allow_not_found: bool = True,
+        chunks: Optional[Dict["Region", AbstractSet[int]]] = None,
+        staging: bool = False,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> List[FileExtractResult]:
+        """
+        Regions in chunks mapping only get their selected chunks replaced
+
+        With staging, files are only extracted into directory, destination world is
+        changed later by apply_staged_files()
+        """
         with self.__lock:
-            file_list = region.to_file_list(self.__rfum.config)
-            target_dir = (
-                directory or self.__rfum.config.paths.destination_world_directory
-            )
+            config = self.__rfum.config
+            snapshot = self.__rfum.config_snapshot
+            target_dir = directory or config.paths.destination_world_directory
             current_upstream = self.get_current_upstream()
-            for file in file_list:
-                target_file = os.path.join(target_dir, file)
+            chunks = chunks or {}
+            tasks = [
+                FileExtractResult(
+                    region,
+                    file,
+                    chunks=(
+                        frozenset(chunks[region]) if region in chunks.keys() else None
+                    ),
+                )
+                for region in regions
+                for file in region.to_file_list(snapshot)
+            ]
+            whole_file_tasks = [task for task in tasks if task.chunks is None]
+            if config.update_operation.skip_unchanged_files:
+                # Staged files are compared with the destination world, not the staging area
+                self.__mark_unchanged(
+                    current_upstream,
+                    whole_file_tasks,
+                    (
+                        config.paths.destination_world_directory
+                        if staging
+                        else target_dir
+                    ),
+                )
+            self.__mark_missing(
+                current_upstream,
+                [task for task in whole_file_tasks if task.status is None],
+                target_dir,
+                allow_not_found,
+            )
+            self.__extract_whole_files(
+                current_upstream,
+                [
+                    task
+                    for task in whole_file_tasks
+                    if task.status is None and task.error is None
+                ],
+                target_dir,
+                allow_not_found,
+                cancel_event,
+            )
+            chunk_tasks = [task for task in tasks if task.chunks is not None]
+            if len(chunk_tasks) > 0 and not _is_cancelled(cancel_event):
+                self.__extract_chunks(
+                    current_upstream,
+                    chunk_tasks,
+                    target_dir,
+                    allow_not_found,
+                    staging,
+                )
+            self.__rfum.file_utilities.sync_journal()
+            return tasks
+
+    def __mark_unchanged(
+        self,
+        upstream: "AbstractUpstream",
+        tasks: List[FileExtractResult],
+        compare_dir: PathLike,
+    ):
+        """
+        Only works for upstreams whose files can be read in place, sizes are compared
+        before any content is read
+        """
+        if len(tasks) == 0:
+            return
+        try:
+            readers = upstream.get_file_readers([task.file_name for task in tasks])
+        except Exception as exc:
+            self.__rfum.verbose(f"Can't read files of upstream {upstream.name}: {exc}")
+            return
+        if readers is None:
+            return
+        unchanged = 0
+        for task in tasks:
+            reader = readers.get(str(task.file_name))
+            if reader is None:
+                continue
+            target_file = os.path.join(compare_dir, task.file_name)
+            fingerprint = FileFingerprint.of(target_file)
+            if fingerprint is None:
+                continue
+            if reader.size is not None and reader.size != fingerprint.size:
+                continue
+            try:
+                if not is_same_stream(reader.open, target_file):
+                    continue
+            except Exception as exc:
+                # e.g. a blob stored in a way that can't be read directly
+                self.__rfum.verbose(f"Can't compare {task.file_name}: {exc}")
+                continue
+            task.status = ExtractStatus.unchanged
+            task.target_fingerprint = fingerprint
+            self.__log_result(upstream, task, compare_dir)
+            unchanged += 1
+        if unchanged > 0:
+            self.__rfum.verbose(f"{unchanged} of {len(tasks)} files are unchanged")
+
+    def __mark_missing(
+        self,
+        upstream: "AbstractUpstream",
+        tasks: List[FileExtractResult],
+        target_dir: PathLike,
+        allow_not_found: bool,
+    ):
+        """
+        Resolves the files upstream doesn't have in bulk, so no extraction is attempted for them
+        """
+        if len(tasks) == 0:
+            return
+        existing = upstream.get_existing_files([task.file_name for task in tasks])
+        if existing is None:
+            return
+        missing = [task for task in tasks if task.file_name not in existing]
+        self.__rfum.verbose(
+            f"{len(missing)} of {len(tasks)} files are not found in upstream {upstream.name}"
+        )
+        for task in missing:
+            target_file = os.path.join(target_dir, task.file_name)
+            if not allow_not_found:
+                task.error = RFUMFileNotFound(task.file_name)
+            elif self.__rfum.config.update_operation.remove_file_while_not_found:
                 if os.path.exists(target_file):
-                    recycled_file = self.__rfum.file_utilities.recycle(target_file)
+                    self.__rfum.file_utilities.recycle(target_file)
+                task.status = ExtractStatus.removed
+            else:
+                task.status = ExtractStatus.kept
+            self.__log_result(upstream, task, target_dir)
+            if task.error is not None:
+                raise task.error
+
+    def __extract_whole_files(
+        self,
+        current_upstream: "AbstractUpstream",
+        tasks: List[FileExtractResult],
+        target_dir: PathLike,
+        allow_not_found: bool,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        if len(tasks) == 0:
+            return
+        config = self.__rfum.config
+        max_workers = max(
+            min(config.update_operation.max_extract_workers, len(tasks)), 1
+        )
+        if current_upstream.supports_batch_extraction:
+            # A few big batches, each of them is handled by a single upstream call
+            batch_size = ceil(len(tasks) / max_workers) or 1
+        else:
+            batch_size = 1
+        batches = [
+            tasks[index : index + batch_size]
+            for index in range(0, len(tasks), batch_size)
+        ]
+        self.__rfum.verbose(
+            f"Extracting {len(tasks)} files in {len(batches)} batches with {max_workers} workers"
+        )
+
+        def extract_batch(batch_: List[FileExtractResult]):
+            # Checked before each batch, a running batch is finished
+            if _is_cancelled(cancel_event):
+                return
+            self.__extract_batch(current_upstream, batch_, target_dir, allow_not_found)
+
+        def handle_batch_result(batch_: List[FileExtractResult]):
+            # Files recycled by this batch must be recoverable after a power loss
+            self.__rfum.file_utilities.sync_journal()
+            for task_ in batch_:
+                self.__log_result(current_upstream, task_, target_dir)
+            return next(
+                (task_.error for task_ in batch_ if task_.error is not None), None
+            )
+
+        if max_workers <= 1:
+            for batch in batches:
+                extract_batch(batch)
+                error = handle_batch_result(batch)
+                if error is not None:
+                    raise error
+        else:
+            first_error: Optional[BaseException] = None
+            with get_thread_pool_executor(
+                max_workers=max_workers, thread_name_prefix="RegionExtractor"
+            ) as executor:
+                futures: List[Future] = [
+                    executor.submit(extract_batch, batch) for batch in batches
+                ]
+                # Results are collected in submission order, so logs stay ordered
+                for future, batch in zip(futures, batches):
+                    try:
+                        future.result()
+                    except CancelledError:
+                        continue
+                    error = handle_batch_result(batch)
+                    if error is not None and first_error is None:
+                        first_error = error
+                        for pending in futures:
+                            pending.cancel()
+            if first_error is not None:
+                raise first_error
+        if _is_cancelled(cancel_event):
+            self.__rfum.verbose("Extraction cancelled, remaining files are skipped")
+
+    def __extract_chunks(
+        self,
+        upstream: "AbstractUpstream",
+        tasks: List[FileExtractResult],
+        target_dir: PathLike,
+        allow_not_found: bool,
+        staging: bool,
+    ):
+        for task in tasks:
+            if not task.file_name.endswith(MCA_SUFFIX):
+                # Only anvil region files are made of chunks
+                task.status = ExtractStatus.kept
+        tasks = [task for task in tasks if task.status is None]
+        if staging:
+            source_dir = target_dir
+        else:
+            source_dir = tempfile.mkdtemp(
+                prefix=".chunk_source.",
+                dir=self.__rfum.file_utilities.ensure_dir(self.get_staging_root()),
+            )
+        try:
+            self.__prepare_chunk_sources(upstream, tasks, source_dir)
+            for task in tasks:
+                if task.error is None and not staging:
+                    self.__splice_task(upstream, task, target_dir, allow_not_found)
+                self.__log_result(upstream, task, target_dir)
+                if task.error is not None:
+                    raise task.error
+        finally:
+            if not staging:
+                self.__rfum.file_utilities.delete(source_dir)
+                try:
+                    os.rmdir(self.get_staging_root())
+                except OSError:
+                    pass
+
+    def __prepare_chunk_sources(
+        self,
+        upstream: "AbstractUpstream",
+        tasks: List[FileExtractResult],
+        source_dir: PathLike,
+    ):
+        """
+        Finds or extracts upstream files of chunk tasks, source_path stays None if upstream doesn't have it
+        """
+        to_extract: List[FileExtractResult] = []
+        for task in tasks:
+            local_path = upstream.get_local_file_path(task.file_name)
+            if local_path is None:
+                to_extract.append(task)
+            elif os.path.isfile(local_path):
+                task.source_path = str(local_path)
+        if len(to_extract) == 0:
+            return
+        existing = upstream.get_existing_files([task.file_name for task in to_extract])
+        if existing is not None:
+            to_extract = [task for task in to_extract if task.file_name in existing]
+            if len(to_extract) == 0:
+                return
+        start = time.monotonic()
+        try:
+            results = upstream.extract_files(
+                [task.file_name for task in to_extract], source_dir
+            )
+        except Exception as exc:
+            for task in to_extract:
+                task.error = exc
+            return
+        extract_time = (time.monotonic() - start) / len(to_extract)
+        for task, (_, error) in zip(to_extract, results):
+            task.extract_time = extract_time
+            if error is None:
+                task.source_path = os.path.join(source_dir, task.file_name)
+            elif not isinstance(error, RFUMFileNotFound):
+                task.error = error
+
+    def __copy_external_chunk_files(
+        self,
+        upstream: "AbstractUpstream",
+        task: FileExtractResult,
+        source_path: str,
+        file_names: List[str],
+        target_file: str,
+    ):
+        """
+        Chunks too large for a region file are kept in c.<x>.<z>.mcc files beside it.
+        Upstreams which can't be read in place only extracted the region file, the
+        external files are extracted next to it first. A missing one raises RFUMFileNotFound
+        """
+        source_dir = os.path.dirname(source_path)
+        file_dir = os.path.dirname(task.file_name)
+        missing = [
+            file_name
+            for file_name in file_names
+            if not os.path.isfile(os.path.join(source_dir, file_name))
+        ]
+        if len(missing) > 0 and upstream.get_local_file_path(task.file_name) is None:
+            # Directory the region file was extracted into as a world
+            extract_root = Path(source_path).parents[len(Path(task.file_name).parts) - 1]
+            results = upstream.extract_files(
+                [os.path.join(file_dir, file_name) for file_name in missing],
+                extract_root,
+            )
+            for _, error in results:
+                if error is not None and not isinstance(error, RFUMFileNotFound):
+                    raise error
+        for file_name in file_names:
+            source_file = os.path.join(source_dir, file_name)
+            if not os.path.isfile(source_file):
+                raise RFUMFileNotFound(
+                    f"{os.path.join(file_dir, file_name)} of {task.file_name} not found"
+                )
+            self.__rfum.file_utilities.copy(
+                source_file, os.path.join(os.path.dirname(target_file), file_name)
+            )
+
+    def __splice_task(
+        self,
+        upstream: "AbstractUpstream",
+        task: FileExtractResult,
+        target_dir: PathLike,
+        allow_not_found: bool,
+    ):
+        assert task.chunks is not None
+        file_utils = self.__rfum.file_utilities
+        remove_not_found = (
+            self.__rfum.config.update_operation.remove_file_while_not_found
+        )
+        target_file = os.path.join(target_dir, task.file_name)
+        if task.source_path is None:
+            if not allow_not_found:
+                task.error = RFUMFileNotFound(task.file_name)
+                return
+            if not remove_not_found or not os.path.exists(target_file):
+                task.status = ExtractStatus.kept
+                return
+
+        start = time.monotonic()
+        recycled_file: Optional[RecycledFile] = None
+        if os.path.exists(target_file):
+            recycled_file = file_utils.recycle(target_file)
+        else:
+            file_utils.safe_ensure_dir(os.path.dirname(target_file))
+        try:
+            result = splice_chunks(
+                None if recycled_file is None else recycled_file.file_path,
+                task.source_path,
+                task.chunks,
+                target_file,
+                region_x=task.region.x,
+                region_z=task.region.z,
+                clear_missing=remove_not_found,
+            )
+            if task.source_path is not None:
+                self.__copy_external_chunk_files(
+                    upstream,
+                    task,
+                    task.source_path,
+                    result.external_chunk_files,
+                    target_file,
+                )
+        except Exception as exc:
+            task.error = exc
+            if recycled_file is not None:
+                recycled_file.restore()
+                recycled_file.delete()
+            return
+        finally:
+            task.apply_time = time.monotonic() - start
+        self.__rfum.verbose(
+            f"Spliced {result.written_chunks} chunks into {target_file}, {result.cleared_chunks} chunks cleared"
+        )
+        task.status = ExtractStatus.spliced
+        task.size = result.written_bytes
+
+    def get_staging_root(self) -> str:
+        world_dir = os.path.abspath(
+            self.__rfum.config.paths.destination_world_directory
+        )
+        return os.path.join(os.path.dirname(world_dir), STAGING_FOLDER)
+
+    def get_staging_directory(self) -> str:
+        world_dir = os.path.abspath(
+            self.__rfum.config.paths.destination_world_directory
+        )
+        return os.path.join(self.get_staging_root(), os.path.basename(world_dir))
+
+    def discard_staging(self):
+        with self.__lock:
+            staging_root = self.get_staging_root()
+            if os.path.exists(staging_root):
+                self.__rfum.verbose(f"Discarding staging area {staging_root}")
+                self.__rfum.file_utilities.delete(staging_root)
+
+    def get_missing_files(
+        self, regions: Iterable["Region"]
+    ) -> Optional[MissingFileReport]:
+        """
+        Files of regions current upstream doesn't have, None if it can't tell without extracting
+        """
+        snapshot = self.__rfum.config_snapshot
+        upstream = self.get_current_upstream()
+        file_names = [
+            file_name
+            for region in regions
+            for file_name in region.to_file_list(snapshot)
+        ]
+        existing = upstream.get_existing_files(file_names)
+        if existing is None:
+            return None
+        return MissingFileReport(
+            upstream.name,
+            len(file_names),
+            [file_name for file_name in file_names if file_name not in existing],
+        )
+
+    def diff_regions(
+        self,
+        regions: Iterable["Region"],
+        chunks: Optional[Dict["Region", AbstractSet[int]]] = None,
+    ) -> List[RegionFileDiff]:
+        """
+        Compares chunk timestamps in region file headers of current upstream and destination world
+
+        Only headers are read, so it's safe to call while the server is running
+        Files missing in both of them are left out
+        """
+        config = self.__rfum.config
+        snapshot = self.__rfum.config_snapshot
+        upstream = self.get_current_upstream()
+        chunks = chunks or {}
+        results: List[RegionFileDiff] = []
+        for region in regions:
+            for file_name in region.to_file_list(snapshot):
+                if not file_name.endswith(MCA_SUFFIX):
+                    continue
+                world_file = os.path.join(
+                    config.paths.destination_world_directory, file_name
+                )
                 try:
-                    current_upstream.extract_file(file, target_dir)
-                except RFUMFileNotFound:
-                    if not allow_not_found:
-                        raise
-                    if self.__rfum.config.update_operation.remove_file_while_not_found:
-                        self.__rfum.logger.info(
-                            f'- [{current_upstream.__class__.__name__}] <{current_upstream.name}> has no such file named "{file}", removed'
+                    with open(world_file, "rb") as f:
+                        world_head: Optional[bytes] = f.read(HEADER_SIZE)
+                except FileNotFoundError:
+                    world_head = None
+                upstream_head = upstream.read_file_head(file_name, HEADER_SIZE)
+                if world_head is None and upstream_head is None:
+                    continue
+                results.append(
+                    RegionFileDiff(
+                        region,
+                        file_name,
+                        world_head is not None,
+                        upstream_head is not None,
+                        diff_headers(
+                            self.__parse_header(world_head),
+                            self.__parse_header(upstream_head),
+                            chunks.get(region),
+                        ),
+                    )
+                )
+        return results
+
+    @staticmethod
+    def __parse_header(data: Optional[bytes]):
+        # Missing and empty files have no chunks generated
+        if not data:
+            return MCAHeader.empty()
+        return MCAHeader.from_bytes(data)
+
+    def stage_regions(
+        self,
+        regions: Iterable["Region"],
+        chunks: Optional[Dict["Region", AbstractSet[int]]] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> List[FileExtractResult]:
+        """
+        Extracts region files into the staging area beside the destination world
+
+        The destination world is not touched, use apply_staged_files() to swap them in
+        Once cancel_event is set, batches not started yet are skipped and the result is incomplete
+        """
+        with self.__lock:
+            self.discard_staging()
+            staging_dir = self.__rfum.file_utilities.ensure_dir(
+                self.get_staging_directory()
+            )
+            return self.extract_regions(
+                regions,
+                staging_dir,
+                allow_not_found=True,
+                chunks=chunks,
+                staging=True,
+                cancel_event=cancel_event,
+            )
+
+    def apply_staged_files(
+        self,
+        tasks: Iterable[FileExtractResult],
+        directory: Optional[PathLike] = None,
+    ):
+        with self.__lock:
+            file_utils = self.__rfum.file_utilities
+            staging_dir = self.get_staging_directory()
+            target_dir = directory or self.__rfum.config.paths.destination_world_directory
+            tasks = list(tasks)
+            moved, removed = 0, 0
+            for task in tasks:
+                if task.chunks is not None:
+                    if task.status is None and task.error is None:
+                        self.__splice_task(
+                            self.get_current_upstream(),
+                            task,
+                            target_dir,
+                            allow_not_found=True,
                         )
-                    else:
+                        self.__log_result(self.get_current_upstream(), task, target_dir)
+                        if task.error is not None:
+                            raise task.error
+                    continue
+                start = time.monotonic()
+                target_file = os.path.join(target_dir, task.file_name)
+                if task.status is ExtractStatus.extracted:
+                    file_utils.safe_ensure_dir(os.path.dirname(target_file))
+                    # Replaced file goes to recycle bin, a rename on the same filesystem
+                    file_utils.move(
+                        os.path.join(staging_dir, task.file_name), target_file
+                    )
+                    moved += 1
+                elif task.status is ExtractStatus.removed and os.path.exists(
+                    target_file
+                ):
+                    file_utils.recycle(target_file)
+                    removed += 1
+                task.apply_time = time.monotonic() - start
+            file_utils.sync_journal()
+            self.__rfum.logger.info(
+                f"Applied {moved} staged files to {target_dir}, {removed} files removed"
+            )
+            self.__extract_stale_unchanged(tasks, target_dir)
+
+    def __extract_stale_unchanged(
+        self, tasks: List[FileExtractResult], target_dir: PathLike
+    ):
+        """
+        Files found unchanged before server stopped might be saved again by the server,
+        those are extracted directly into the world now
+        """
+        stale = []
+        for task in tasks:
+            if task.status is not ExtractStatus.unchanged:
+                continue
+            target_file = os.path.join(target_dir, task.file_name)
+            if FileFingerprint.of(target_file) != task.target_fingerprint:
+                self.__rfum.verbose(
+                    f"{task.file_name} was modified after comparison, extracting again"
+                )
+                task.status, task.target_fingerprint = None, None
+                stale.append(task)
+        if len(stale) > 0:
+            self.__extract_whole_files(
+                self.get_current_upstream(), stale, target_dir, True
+            )
+
+    def __extract_batch(
+        self,
+        upstream: "AbstractUpstream",
+        batch: List[FileExtractResult],
+        target_dir: PathLike,
+        allow_not_found: bool,
+    ):
+        recycled_files: Dict[str, RecycledFile] = {}
+        try:
+            for task in batch:
+                start = time.monotonic()
+                target_file = os.path.join(target_dir, task.file_name)
+                if os.path.exists(target_file):
+                    recycled_files[task.file_name] = self.__rfum.file_utilities.recycle(
+                        target_file
+                    )
+                task.recycle_time = time.monotonic() - start
+            start = time.monotonic()
+            results = upstream.extract_files(
+                [task.file_name for task in batch], target_dir
+            )
+            # One upstream call handles the whole batch, its time is shared by the files
+            extract_time = (time.monotonic() - start) / len(batch)
+        except Exception as exc:
+            for task in batch:
+                task.error = exc
+            return batch
+
+        for task, (_, error) in zip(batch, results):
+            task.extract_time = extract_time
+            if error is None:
+                task.status = ExtractStatus.extracted
+                try:
+                    task.size = os.path.getsize(os.path.join(target_dir, task.file_name))
+                except OSError:
+                    task.size = None
+            elif not isinstance(error, RFUMFileNotFound) or not allow_not_found:
+                task.error = error
+            elif self.__rfum.config.update_operation.remove_file_while_not_found:
+                task.status = ExtractStatus.removed
+            else:
+                recycled_file = recycled_files.get(task.file_name)
+                try:
+                    if recycled_file is not None:
                         recycled_file.restore()
                         recycled_file.delete()
+                except Exception as restore_exc:
+                    task.error = restore_exc
                 else:
-                    self.__rfum.logger.info(
-                        f"- [{current_upstream.__class__.__name__}] <{current_upstream.name}> {file} -> {target_dir}"
-                    )
-                    # self.__rfum.file_utilities.restore(os.path.join(target_dir, file))
+                    task.status = ExtractStatus.kept
+        return batch
+
+    def __log_result(
+        self,
+        upstream: "AbstractUpstream",
+        task: FileExtractResult,
+        target_dir: PathLike,
+    ):
+        prefix = f"- [{upstream.__class__.__name__}] <{upstream.name}>"
+        if task.error is not None:
+            self.__rfum.logger.error(
+                f'{prefix} failed to extract "{task.file_name}": [{task.error.__class__.__name__}] {task.error}'
+            )
+        elif task.status is ExtractStatus.extracted:
+            self.__rfum.logger.info(f"{prefix} {task.file_name} -> {target_dir}")
+        elif task.status is ExtractStatus.removed:
+            self.__rfum.logger.info(
+                f'{prefix} has no such file named "{task.file_name}", removed'
+            )
+        elif task.status is ExtractStatus.kept:
+            self.__rfum.verbose(
+                f'{prefix} has no such file named "{task.file_name}", kept'
+            )
+        elif task.status is ExtractStatus.unchanged:
+            self.__rfum.logger.info(f"{prefix} {task.file_name} is unchanged, skipped")
+        elif task.status is ExtractStatus.spliced and task.chunks is not None:
+            self.__rfum.logger.info(
+                f"{prefix} {task.file_name} ({len(task.chunks)} chunks) -> {target_dir}"
+            )
+        elif task.chunks is not None:
+            self.__rfum.verbose(
+                f"{prefix} {task.file_name} is ready for splicing {len(task.chunks)} chunks"
+            )
@@ -2,17 +2,26 @@ import json
 import os
 import re
 from logging import Logger
-from typing import Optional, Union, List, Dict, Any
+from typing import Optional, Union, List, Dict, Any, Set
 from types import MethodType
 
 from mcdreforged.api.all import *
 from ruamel import yaml
 
-from region_file_updater_multi.components.misc import get_rfum_comp_prefix
+from region_file_updater_multi.commands.tree_constants import RECOVER, DISCARD, RELOAD
+from region_file_updater_multi.components.misc import (
+    get_rfum_comp_prefix,
+    datetime_tr,
+)
 from region_file_updater_multi.commands.command_manager import CommandManager
-from region_file_updater_multi.storage.config import Config
+from region_file_updater_multi.storage.config import Config, ConfigSnapshot
+from region_file_updater_multi.storage.config_watcher import (
+    ConfigWatcher,
+    get_config_changes,
+)
 from region_file_updater_multi.storage.group import GroupManager
 from region_file_updater_multi.storage.history import History
+from region_file_updater_multi.storage.snapshot import SnapshotStore
 from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.region_upstream_manager import RegionUpstreamManager
 from region_file_updater_multi.update_session import UpdateSession
@@ -27,6 +36,27 @@ from region_file_updater_multi.utils.online_players import OnlinePlayers
 from region_file_updater_multi.utils.misc_tools import RFUMInstance
 from region_file_updater_multi.commands.impl import *
 
+# Config changes taking effect only after the plugin is reloaded
+RELOAD_REQUIRED_CONFIG_PATHS = [
+    "command.command_prefix",
+    "load_custom_translation",
+    "experimental.enable_debug_commands",
+    "experimental.enable_custom_language_filter",
+    "experimental.thread_pool_executor_max_workers",
+    "experimental.config_watch_interval",
+]
+# Prime Backup upstreams keep these in their worker processes and database connections
+PB_UPSTREAM_CONFIG_PATHS = [
+    "paths.pb_plugin_package_path",
+    "experimental.python_executable",
+    "experimental.popen_decoding",
+    "experimental.prime_backup_worker_processes",
+]
+RECYCLE_BIN_CONFIG_PATHS = [
+    "update_operation.colocate_recycle_bin",
+    "paths.destination_world_directory",
+]
+
 
 class RegionFileUpdaterMulti:
     def __init__(self):
@@ -40,17 +70,27 @@ class RegionFileUpdaterMulti:
             os.path.join(self.get_data_folder(), RECYCLE_BIN_FOLDER), self
         )
         Config.set_rfum(self)
+        self.config_watcher = ConfigWatcher(
+            os.path.join(self.get_data_folder(), CONFIG_FILE), self
+        )
         self.__verbosity = False
+        self.__config_snapshot: Optional[ConfigSnapshot] = None
         self.config: Config = self.load_config()  # type: ignore[annotation-unchecked]
         self.__file_handler = None
         if self.config.get_attach_log_handler():
             self.set_log(os.path.join(self.server.get_data_folder(), LOG_FILE))
 
         self.__set_verbosity(self.config.get_verbosity())
+        self.file_utilities.set_recycle_bin_path(self.get_recycle_bin_path())
+        self.snapshot_store = SnapshotStore(self.get_snapshot_path(), self)
         # self.verbose(self.config.update_operation.confirm_time_wait)
 
         self.online_players = OnlinePlayers(self)
-        self.history = History(os.path.join(self.get_data_folder(), HISTORY_FILE), self)
+        self.history = History(
+            os.path.join(self.get_data_folder(), HISTORY_DB_FILE),
+            self,
+            legacy_path=os.path.join(self.get_data_folder(), LEGACY_HISTORY_FILE),
+        )
         self.region_upstream_manager = RegionUpstreamManager.get_instance(self)
         self.current_session = UpdateSession(self)
         self.group_manager = GroupManager(
@@ -62,13 +102,109 @@ class RegionFileUpdaterMulti:
 
     def load_config(self):
         self.config = Config.load(self)
-        self.verbose("PB log format = {}".format(self.config.get_pb_log_format()))
+        self.config_watcher.mark_current()
+        self.__build_config_snapshot()
         return self.config
 
+    def __build_config_snapshot(self):
+        self.verbose("PB log format = {}".format(self.config.get_pb_log_format()))
+        self.__config_snapshot = ConfigSnapshot(
+            self.config,
+            self.server.get_mcdr_config().get(MCDR_CFG_DECODING_KEY),
+            previous=self.__config_snapshot,
+        )
+
+    @property
+    def config_snapshot(self) -> ConfigSnapshot:
+        if self.__config_snapshot is None:
+            raise RuntimeError("Config snapshot is read before config loading")
+        return self.__config_snapshot
+
     def save_config(self):
         if self.config is None:
             raise ValueError("Trying to save config before load")
         self.config.save(self)
+        self.config_watcher.mark_current()
+        self.__build_config_snapshot()
+
+    def apply_config(self, config: Config) -> bool:
+        """
+        Replaces current config, only the parts affected by changed values are rebuilt
+        Returns False if nothing changed
+        """
+        changes = get_config_changes(self.config.serialize(), config.serialize())
+        if len(changes) == 0:
+            return False
+        self.verbose(f"Config changes: {', '.join(sorted(changes))}")
+
+        def changed(paths: List[str]) -> Set[str]:
+            return {
+                change
+                for change in changes
+                for path in paths
+                if change == path or change.startswith(path + ".")
+            }
+
+        old_upstreams = self.config.paths.upstreams or {}
+        self.config = config
+        self.__build_config_snapshot()
+        upstream_names = {
+            change.split(".")[2]
+            for change in changes
+            if change.startswith("paths.upstreams.")
+        }
+        if len(changed(PB_UPSTREAM_CONFIG_PATHS)) > 0:
+            for upstreams in (old_upstreams, config.paths.upstreams or {}):
+                upstream_names |= {
+                    name
+                    for name, upstream in upstreams.items()
+                    if upstream.type.startswith("prime_backup")
+                }
+        if len(upstream_names) > 0:
+            self.region_upstream_manager.reload_upstreams(upstream_names)
+        if "experimental.verbosity" in changes:
+            self.__set_verbosity(self.config.get_verbosity())
+        if "experimental.attach_plugin_log_handler" in changes:
+            if self.config.get_attach_log_handler():
+                self.set_log(os.path.join(self.server.get_data_folder(), LOG_FILE))
+            else:
+                self.unset_log()
+        if len(changed(RECYCLE_BIN_CONFIG_PATHS)) > 0:
+            self.file_utilities.set_recycle_bin_path(self.get_recycle_bin_path())
+            self.snapshot_store.relocate(self.get_snapshot_path())
+
+        reload_required = changed(RELOAD_REQUIRED_CONFIG_PATHS)
+        if len(reload_required) > 0:
+            self.logger.warning(
+                self.rtr(
+                    "config_watcher.reload_required",
+                    ", ".join(sorted(reload_required)),
+                    f"{self.command_manager.prefixes[0]} {RELOAD}",
+                )
+            )
+        self.logger.info(self.rtr("config_watcher.applied", len(changes)))
+        return True
+
+    def get_recycle_bin_path(self):
+        if self.config.update_operation.colocate_recycle_bin:
+            # Same filesystem as the world, so recycling a file is always a rename
+            world_dir = os.path.abspath(
+                self.config.paths.destination_world_directory
+            )
+            return os.path.join(
+                os.path.dirname(world_dir), COLOCATED_RECYCLE_BIN_FOLDER
+            )
+        return os.path.join(self.get_data_folder(), RECYCLE_BIN_FOLDER)
+
+    def get_snapshot_path(self):
+        # Beside the recycle bin, snapshots are taken by renaming it
+        recycle_bin_path = self.get_recycle_bin_path()
+        folder = (
+            COLOCATED_SNAPSHOT_FOLDER
+            if self.config.update_operation.colocate_recycle_bin
+            else SNAPSHOT_FOLDER
+        )
+        return os.path.join(os.path.dirname(recycle_bin_path), folder)
 
     def get_data_folder(self):
         return self.server.get_data_folder()
@@ -108,6 +244,8 @@ class RegionFileUpdaterMulti:
         if verbosity:
             self.logger.debug = MethodType(debugger, self.logger)
             self.verbose("Verbose mode is enabled")
+        elif "debug" in vars(self.logger):
+            del self.logger.debug
 
     @property
     def verbosity(self):
@@ -276,6 +414,20 @@ class RegionFileUpdaterMulti:
     def reply_reload_message(self, source: CommandSource):
         source.reply(get_rfum_comp_prefix(self.rtr("command.reload.reloaded")))
 
+    def warn_interrupted_session(self):
+        interrupted = self.file_utilities.interrupted_session
+        if interrupted is None:
+            return
+        self.logger.warning(
+            self.rtr(
+                "session.interrupted_found",
+                count=len(interrupted.files),
+                time=datetime_tr(interrupted.begin_time),
+                recover=f"{self.command_manager.prefixes[0]} {RECOVER}",
+                discard=f"{self.command_manager.prefixes[0]} {RECOVER} {DISCARD}",
+            )
+        )
+
     def on_load(self, server: "PluginServerInterface", prev_module):
         self.register_custom_translations()
         self.server.register_event_listener(
@@ -284,6 +436,10 @@ class RegionFileUpdaterMulti:
         self.online_players.register_event_listeners()
         self.current_session.register_event_listeners()
         self.payload_executor.register_event_listeners()
+        self.region_upstream_manager.register_event_listeners()
+        self.group_manager.register_event_listeners()
+        self.history.register_event_listeners()
+        self.config_watcher.register_event_listeners()
 
         self.command_manager.add_command(HelpCommand(self))
         self.command_manager.add_command(UpstreamCommand(self))
@@ -294,5 +450,7 @@ class RegionFileUpdaterMulti:
         self.command_manager.add_command(DebugCommands(self))
 
         self.command_manager.register()
+        self.warn_interrupted_session()
+        self.config_watcher.start()
         for pre in self.command_manager.prefixes:
             server.register_help_message(pre, self.rtr("help_message.mcdr"))
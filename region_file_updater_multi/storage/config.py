@@ -1,5 +1,5 @@
 import sys
-from typing import Dict, Union, List, Any, Optional, TYPE_CHECKING
+from typing import Dict, Union, List, Any, Optional, Tuple, TYPE_CHECKING
 
 from region_file_updater_multi.mcdr_globals import PrimeBackupLogParsingArguments
 from region_file_updater_multi.utils.serializer import (
@@ -7,10 +7,14 @@ from region_file_updater_multi.utils.serializer import (
     ConfigurationBase,
 )
 from region_file_updater_multi.commands.tree_constants import *
-from region_file_updater_multi.utils.units import Duration
+from region_file_updater_multi.region_upstream_manager import DimensionString
+from region_file_updater_multi.upstream.impl.pb_log_parser import PrimeBackupLogParser
+from region_file_updater_multi.utils.fast_copy import CopyStrategy, get_strategies
+from region_file_updater_multi.utils.units import Duration, ByteCount
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+    from region_file_updater_multi.region_upstream_manager import Region
 
 
 class Config(ConfigurationBase):
@@ -34,8 +38,11 @@ class Config(ConfigurationBase):
                 DEL: 0,
                 DEL_ALL: 1,
                 LIST: 0,
+                DIFF: 1,
                 HISTORY: 1,
                 UPDATE: 2,
+                RECOVER: 2,
+                ROLLBACK: 2,
                 GROUP: 2,
                 UPSTREAM: 3,
             }
@@ -61,6 +68,12 @@ class Config(ConfigurationBase):
             "File '{file_name}' in backup #{backup_id:d} does not exist"
         ]
         remove_file_while_not_found: bool = False
+        max_extract_workers: int = 4
+        colocate_recycle_bin: bool = False
+        pre_extract_to_staging: bool = True
+        skip_unchanged_files: bool = True
+        snapshot_retention: int = 3
+        snapshot_size_limit: ByteCount = ByteCount("2GiB")
 
     update_operation: UpdateOperation = UpdateOperation.get_default()
 
@@ -75,7 +88,11 @@ class Config(ConfigurationBase):
             world_name: str = "world"
 
             def validate_attribute(self, attr_name: str, attr_value: Any, **kwargs):
-                if attr_name == "type" and attr_value not in ["prime_backup", "world"]:
+                if attr_name == "type" and attr_value not in [
+                    "prime_backup",
+                    "prime_backup_db",
+                    "world",
+                ]:
                     raise ValueError("Invalid upstream type provided")
 
         upstreams: Optional[Dict[str, Upstream]] = {
@@ -125,6 +142,15 @@ class Config(ConfigurationBase):
         lost_permission_requires_confirm: bool
         minecraft_data_api_timeout: float
         enable_custom_language_filter: bool
+        prime_backup_batch_extraction: bool
+        prime_backup_worker_processes: int
+        copy_strategies: List[str]
+        # Seconds group changes are gathered before the group file is written, 0 writes at once
+        group_save_delay: float = 1.0
+        # Seconds between config file checks, 0 disables watching
+        config_watch_interval: float = 2.0
+        # Regions an area or radius selection may cover at most
+        max_batch_regions: int = 16384
 
     experimental: Optional[Debug] = None
 
@@ -177,3 +203,134 @@ class Config(ConfigurationBase):
 
     def get_enable_custom_language_filter(self):
         return self.get_debug_options().get("enable_custom_language_filter", True)
+
+    def get_pb_batch_extraction(self):
+        return self.get_debug_options().get("prime_backup_batch_extraction", True)
+
+    def get_pb_worker_processes(self) -> int:
+        return self.get_debug_options().get("prime_backup_worker_processes", 0)
+
+    def get_copy_strategies(self) -> Optional[List[str]]:
+        return self.get_debug_options().get("copy_strategies")
+
+    def get_max_batch_regions(self) -> int:
+        return self.get_debug_options().get("max_batch_regions", 16384)
+
+    def get_group_save_delay(self) -> float:
+        return self.get_debug_options().get("group_save_delay", 1.0)
+
+    def get_config_watch_interval(self) -> float:
+        return self.get_debug_options().get("config_watch_interval", 2.0)
+
+
+def _escape_braces(value: str) -> str:
+    return value.replace("{", "{{").replace("}", "}}")
+
+
+class _EscapedDimension:
+    """
+    Fills {dim}, {dim.namespace} and {dim.name} of a template with braces escaped,
+    so the result can be formatted again with x and z
+    """
+
+    __slots__ = ("__dim",)
+
+    def __init__(self, dim: DimensionString):
+        self.__dim = dim
+
+    @property
+    def namespace(self):
+        return _escape_braces(self.__dim.namespace)
+
+    @property
+    def name(self):
+        return _escape_braces(self.__dim.name)
+
+    def __format__(self, format_spec):
+        return format(_escape_braces(str(self.__dim)), format_spec)
+
+
+class ConfigSnapshot:
+    """
+    Immutable values derived from a config once, read by update sessions instead of
+    the config getters
+
+    A new snapshot is built whenever config is loaded, saved or applied
+    """
+
+    __slots__ = (
+        "config",
+        "python_executable",
+        "popen_decoding",
+        "popen_terminate_timeout",
+        "pb_batch_extraction",
+        "pb_worker_processes",
+        "pb_log_formats",
+        "pb_log_parser",
+        "copy_strategies",
+        "dimension_file_templates",
+    )
+
+    config: Config
+    python_executable: str
+    popen_decoding: str
+    popen_terminate_timeout: int
+    pb_batch_extraction: bool
+    pb_worker_processes: int
+    pb_log_formats: Tuple[Tuple[str, ...], Tuple[str, ...]]
+    pb_log_parser: PrimeBackupLogParser
+    copy_strategies: Tuple[CopyStrategy, ...]
+    # Dimension is filled in, only {x} and {z} are left
+    dimension_file_templates: Dict[str, Tuple[str, ...]]
+
+    def __init__(
+        self,
+        config: Config,
+        mcdr_decoding: Optional[str] = None,
+        previous: Optional["ConfigSnapshot"] = None,
+    ):
+        pb_log_formats = (
+            tuple(config.get_pb_log_format()),
+            tuple(config.update_operation.prime_backup_file_not_found_log_format),
+        )
+        if previous is not None and previous.pb_log_formats == pb_log_formats:
+            pb_log_parser = previous.pb_log_parser
+        else:
+            pb_log_parser = PrimeBackupLogParser(*pb_log_formats)
+        dimension_file_templates = {}
+        for dim, files in config.paths.dimension_mca_files.items():
+            if isinstance(files, str):
+                files = [files]
+            escaped_dim = _EscapedDimension(DimensionString.of(dim))
+            dimension_file_templates[sys.intern(dim)] = tuple(
+                file.format(x="{x}", z="{z}", dim=escaped_dim) for file in files
+            )
+        values = dict(
+            config=config,
+            python_executable=config.get_python_executable(),
+            popen_decoding=config.get_popen_decoding() or mcdr_decoding or "utf8",
+            popen_terminate_timeout=config.get_popen_terminate_timeout(),
+            pb_batch_extraction=config.get_pb_batch_extraction(),
+            pb_worker_processes=config.get_pb_worker_processes(),
+            pb_log_formats=pb_log_formats,
+            pb_log_parser=pb_log_parser,
+            copy_strategies=tuple(get_strategies(config.get_copy_strategies())),
+            dimension_file_templates=dimension_file_templates,
+        )
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def get_region_files(self, region: "Region") -> List[str]:
+        """
+        Raises KeyError if the dimension is not configured
+        """
+        return [
+            template.format(x=region.x, z=region.z)
+            for template in self.dimension_file_templates[region.dim]
+        ]
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
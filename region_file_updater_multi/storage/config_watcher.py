@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Optional, Set, Tuple
+
+from mcdreforged.api.all import MCDRPluginEvents
+from ruamel import yaml
+
+from region_file_updater_multi.storage.config import Config
+from region_file_updater_multi.utils.misc_tools import named_thread
+
+if TYPE_CHECKING:
+    from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+
+
+def get_config_changes(old: Any, new: Any, prefix: str = "") -> Set[str]:
+    """
+    Dotted paths of the differing leaves of two serialized configs
+    A missing section is compared as an empty one
+    """
+    if isinstance(old, dict) or isinstance(new, dict):
+        old = old if isinstance(old, dict) else {}
+        new = new if isinstance(new, dict) else {}
+        changes = set()
+        for key in old.keys() | new.keys():
+            changes |= get_config_changes(old.get(key), new.get(key), f"{prefix}{key}.")
+        return changes
+    if old != new:
+        return {prefix.rstrip(".")}
+    return set()
+
+
+class ConfigWatcher:
+    """
+    Polls the config file, its content is parsed only when the hash changed
+
+    Parsing skips the template and missing key fixing of Config.load, the file is
+    expected to be a complete config written by the plugin and edited by hand
+    """
+
+    def __init__(self, path: str, rfum: "RegionFileUpdaterMulti"):
+        self.__rfum = rfum
+        self.__path = path
+        self.__lock = threading.RLock()
+        self.__stop_event = threading.Event()
+        self.__running = False
+        # (mtime_ns, size) and content hash of the file current config came from
+        self.__stat: Optional[Tuple[int, int]] = None
+        self.__digest: Optional[bytes] = None
+
+    def __read(self) -> Tuple[Tuple[int, int], bytes]:
+        stat = os.stat(self.__path)
+        with open(self.__path, "rb") as f:
+            content = f.read()
+        return (stat.st_mtime_ns, stat.st_size), content
+
+    def mark_current(self):
+        """
+        Current file is what the plugin just loaded or saved, don't apply it again
+        """
+        with self.__lock:
+            try:
+                self.__stat, content = self.__read()
+            except OSError:
+                self.__stat, self.__digest = None, None
+                return
+            self.__digest = hashlib.sha256(content).digest()
+
+    def check(self) -> bool:
+        """
+        Returns True if a changed config was applied
+        """
+        with self.__lock:
+            try:
+                stat_result = os.stat(self.__path)
+            except OSError:
+                return False
+            if (stat_result.st_mtime_ns, stat_result.st_size) == self.__stat:
+                return False
+            try:
+                stat, content = self.__read()
+            except OSError:
+                return False
+            digest = hashlib.sha256(content).digest()
+            if digest == self.__digest:
+                self.__stat = stat
+                return False
+            if self.__rfum.current_session.is_session_running:
+                # Checked again in the next poll
+                self.__rfum.verbose("Config changed during update, applying it later")
+                return False
+            self.__stat, self.__digest = stat, digest
+            try:
+                config = Config.deserialize(
+                    yaml.YAML(typ="safe").load(content.decode("utf8"))
+                )
+            except Exception as exc:
+                self.__rfum.logger.warning(
+                    self.__rfum.rtr(
+                        "config_watcher.parse_failed",
+                        f"[{exc.__class__.__name__}] {str(exc)}",
+                    )
+                )
+                return False
+            return self.__rfum.apply_config(config)
+
+    def register_event_listeners(self):
+        self.__rfum.server.register_event_listener(
+            MCDRPluginEvents.PLUGIN_UNLOADED, lambda *args, **kwargs: self.stop()
+        )
+
+    def start(self):
+        interval = self.__rfum.config.get_config_watch_interval()
+        if interval <= 0 or self.__running:
+            return
+
+        @named_thread("ConfigWatcher")
+        def watch():
+            while not self.__stop_event.wait(interval):
+                try:
+                    self.check()
+                except Exception:
+                    self.__rfum.logger.exception("Error checking config file")
+            self.__running = False
+
+        self.__running = True
+        self.__stop_event.clear()
+        watch()
+
+    def stop(self):
+        self.__stop_event.set()
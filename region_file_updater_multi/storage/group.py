@@ -5,11 +5,23 @@ import threading
 from copy import deepcopy
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING, List, Optional, Iterable, Dict, Union, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Optional,
+    Iterable,
+    Dict,
+    Union,
+    TypeVar,
+    Set,
+    Tuple,
+    Iterator,
+    Type,
+)
 
 from mcdreforged.api.all import *
 
-from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.region_upstream_manager import Region, RegionArea
 from region_file_updater_multi.mcdr_globals import CommandCallback
 from region_file_updater_multi.utils.misc_tools import get_player_from_src, RFUMInstance
 from region_file_updater_multi.utils.serializer import RFUMSerializable
@@ -20,6 +32,12 @@ if TYPE_CHECKING:
 
 T = TypeVar("T")
 
+# Immutable members of a group file which are converted here instead of by MCDR serializer
+GROUP_MEMBER_FIELDS: Dict[str, Union[Type[Region], Type[RegionArea]]] = {
+    "regions": Region,
+    "areas": RegionArea,
+}
+
 
 @dataclass
 class GroupPermissionItem:
@@ -43,9 +61,104 @@ class GroupPermission(GroupPermissionItem, Enum):
 class GroupFileData(RFUMSerializable):
     name: str = ""
     regions: List[Region] = []
+    areas: List[RegionArea] = []
     default_permission: GroupPermission = GroupPermission.user
     player_permission: Dict[str, GroupPermission] = {}
 
+    def serialize(self) -> dict:
+        return {
+            key: (
+                [item.serialize() for item in value]
+                if key in GROUP_MEMBER_FIELDS.keys()
+                else serialize(value)
+            )
+            for key, value in (
+                (key, getattr(self, key)) for key in self.get_field_annotations()
+            )
+        }
+
+    @classmethod
+    def deserialize(cls, data: dict, **kwargs):
+        if not isinstance(data, dict):
+            raise ValueError(f"Group should be a dict, found {type(data)}")
+        data = dict(data)
+        members = {
+            key: [member_cls.deserialize(item) for item in data.pop(key, [])]
+            for key, member_cls in GROUP_MEMBER_FIELDS.items()
+        }
+        result = super().deserialize(data, **kwargs)
+        for key, value in members.items():
+            setattr(result, key, value)
+        return result
+
+
+class AreaIndex:
+    """
+    Areas of one dimension in a centered interval tree over x
+
+    Each node keeps the areas crossing its center, sorted by west edge and by east edge,
+    a lookup only checks z of the areas whose x range includes the region.
+    The tree is rebuilt on the next lookup after a change
+    """
+
+    class Node:
+        def __init__(self, entries: List[Tuple[RegionArea, "Group"]]):
+            edges = sorted(edge for area, _ in entries for edge in (area.x1, area.x2))
+            self.center = edges[len(edges) // 2]
+            left, right, crossing = [], [], []
+            for entry in entries:
+                if entry[0].x2 < self.center:
+                    left.append(entry)
+                elif entry[0].x1 > self.center:
+                    right.append(entry)
+                else:
+                    crossing.append(entry)
+            self.by_start = sorted(crossing, key=lambda entry: entry[0].x1)
+            self.by_end = sorted(crossing, key=lambda entry: -entry[0].x2)
+            self.left = AreaIndex.Node(left) if len(left) > 0 else None
+            self.right = AreaIndex.Node(right) if len(right) > 0 else None
+
+    def __init__(self):
+        self.__entries: List[Tuple[RegionArea, "Group"]] = []
+        self.__root: Optional[AreaIndex.Node] = None
+        self.__dirty = False
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def add(self, area: RegionArea, group: "Group"):
+        self.__entries.append((area, group))
+        self.__dirty = True
+
+    def remove(self, area: RegionArea, group: "Group"):
+        for index, (item, item_group) in enumerate(self.__entries):
+            if item == area and item_group is group:
+                del self.__entries[index]
+                self.__dirty = True
+                return
+
+    def find(self, region: Region) -> Iterator["Group"]:
+        if self.__dirty:
+            self.__root = AreaIndex.Node(self.__entries) if len(self) > 0 else None
+            self.__dirty = False
+        x, z = region.x, region.z
+        node = self.__root
+        while node is not None:
+            if x < node.center:
+                for area, group in node.by_start:
+                    if area.x1 > x:
+                        break
+                    if area.z1 <= z <= area.z2:
+                        yield group
+                node = node.left
+            else:
+                for area, group in node.by_end:
+                    if area.x2 < x:
+                        break
+                    if area.z1 <= z <= area.z2:
+                        yield group
+                node = node.right
+
 
 class Group:
     def __init__(
@@ -58,6 +171,10 @@ class Group:
         self.__data = data
         self.__lock = lock or threading.RLock()
         self.__cached_data: Optional["GroupFileData"] = None
+        self.__region_set: Set[Region] = set(data.regions)
+        self.__cached_region_set: Optional[Set[Region]] = None
+        # Areas by dimension, built on the next lookup after areas are changed
+        self.__area_index: Optional[Dict[str, AreaIndex]] = None
 
     @property
     def name(self):
@@ -67,6 +184,23 @@ class Group:
     def regions(self):
         return self.__data.regions
 
+    @property
+    def areas(self):
+        return self.__data.areas
+
+    def iter_regions(self) -> Iterator[Region]:
+        """
+        Every region in the group once, single regions first
+        """
+        with self.__lock:
+            seen = set(self.regions)
+            yield from self.regions
+            for area in self.areas:
+                for region in area.iter_regions():
+                    if region not in seen:
+                        seen.add(region)
+                        yield region
+
     @property
     def is_present(self):
         return self.__manager.is_present(self)
@@ -89,24 +223,109 @@ class Group:
             if self.is_listed(region):
                 return False
             self.regions.append(region)
+            self.__region_set.add(region)
             if not self.requires_save:
                 RFUMInstance.get_rfum().verbose(f"{region} added and not saved")
                 return True
             RFUMInstance.get_rfum().verbose(f"{region} added")
+            self.__manager.on_region_added(self, region)
             return self.save()
 
     def remove_region(self, region: "Region"):
+        """
+        Areas including the region are split around it
+        """
+        return self.remove_area(RegionArea.of_region(region))
+
+    def add_area(self, area: RegionArea):
+        """
+        Single regions and areas inside the new area are merged into it
+        """
+        with self.__lock:
+            if any(item.covers(area) for item in self.areas):
+                return False
+            merged_areas = [item for item in self.areas if area.covers(item)]
+            merged_regions = [item for item in self.regions if area.contains(item)]
+            self.__data.areas = [
+                item for item in self.areas if not area.covers(item)
+            ] + [area]
+            self.__data.regions = [
+                item for item in self.regions if not area.contains(item)
+            ]
+            self.__region_set.difference_update(merged_regions)
+            self.__area_index = None
+            if not self.requires_save:
+                return True
+            RFUMInstance.get_rfum().verbose(
+                f"{area} added, merged {len(merged_areas)} areas"
+                f" and {len(merged_regions)} regions"
+            )
+            for item in merged_areas:
+                self.__manager.on_area_removed(self, item)
+            for item in merged_regions:
+                self.__manager.on_region_removed(self, item)
+            self.__manager.on_area_added(self, area)
+            return self.save()
+
+    def remove_area(self, area: RegionArea):
+        """
+        Removes every region inside the area, areas crossing its border keep their outer part
+        """
         with self.__lock:
-            if not self.is_listed(region):
+            removed_regions = [item for item in self.regions if area.contains(item)]
+            split_areas = [item for item in self.areas if item.intersects(area)]
+            if len(removed_regions) == 0 and len(split_areas) == 0:
                 return False
-            self.regions.remove(region)
+            pieces = [piece for item in split_areas for piece in item.subtract(area)]
+            self.__data.regions = [
+                item for item in self.regions if not area.contains(item)
+            ]
+            self.__region_set.difference_update(removed_regions)
+            self.__data.areas = [
+                item for item in self.areas if not item.intersects(area)
+            ] + pieces
+            self.__area_index = None
             if not self.requires_save:
                 return True
+            RFUMInstance.get_rfum().verbose(
+                f"{area} removed, split {len(split_areas)} areas into {len(pieces)}"
+            )
+            for item in removed_regions:
+                self.__manager.on_region_removed(self, item)
+            for item in split_areas:
+                self.__manager.on_area_removed(self, item)
+            for item in pieces:
+                self.__manager.on_area_added(self, item)
             return self.save()
 
+    def __get_area_index(self, dim: str) -> Optional[AreaIndex]:
+        if self.__area_index is None:
+            area_index: Dict[str, AreaIndex] = {}
+            for area in self.areas:
+                area_index.setdefault(area.dim, AreaIndex()).add(area, self)
+            self.__area_index = area_index
+        return self.__area_index.get(dim)
+
     def is_listed(self, region: "Region"):
         with self.__lock:
-            return region in self.regions
+            if region in self.__region_set:
+                return True
+            area_index = self.__get_area_index(region.dim)
+            if area_index is None:
+                return False
+            return next(area_index.find(region), None) is not None
+
+    def is_area_listed(self, area: RegionArea):
+        with self.__lock:
+            if area.region_count == 1:
+                return self.is_listed(Region(area.x1, area.z1, area.dim))
+            return any(item.covers(area) for item in self.areas)
+
+    def is_area_overlapped(self, area: RegionArea):
+        with self.__lock:
+            return any(area.contains(item) for item in self.regions) or any(
+                item.intersects(area) for item in self.areas
+            )
 
     def get_data(self, group_manager: "GroupManager"):
         with self.__lock:
@@ -181,12 +400,18 @@ class Group:
     def keep_modify_context(self):
         with self.__lock:
             self.__cached_data = self.__data
+            self.__cached_region_set = self.__region_set
             self.__data = deepcopy(self.__data)
+            self.__region_set = set(self.__data.regions)
+            self.__area_index = None
             try:
                 yield
             finally:
                 self.__data = self.__cached_data
+                self.__region_set = self.__cached_region_set
+                self.__area_index = None
                 self.__cached_data = None
+                self.__cached_region_set = None
 
     @property
     def requires_save(self):
@@ -199,6 +424,13 @@ class GroupManager:
         self.__path = path
         self.__rfum = rfum
         self.__groups: Dict[str, Group] = {}
+        # Dimension -> (x, z) -> groups listing the region, in the order they were added
+        self.__region_index: Dict[str, Dict[Tuple[int, int], List[Group]]] = {}
+        self.__area_index: Dict[str, AreaIndex] = {}
+        # Writes are serialized by this lock, group data is only locked while it's copied
+        self.__write_lock = threading.Lock()
+        self.__flush_timer: Optional[threading.Timer] = None
+        self.__dirty = False
         self.load()
 
     @property
@@ -220,9 +452,13 @@ class GroupManager:
     def load(self) -> bool:
         with self.__lock:
             self.__groups = {}
+            self.__region_index = {}
+            self.__area_index = {}
             try:
                 with open(self.__path, "r", encoding="utf8") as f:
-                    data_list = deserialize(json.load(f), List[GroupFileData])
+                    data_list = [
+                        GroupFileData.deserialize(item) for item in json.load(f)
+                    ]
             except FileNotFoundError:
                 self.save()
                 return True
@@ -231,26 +467,79 @@ class GroupManager:
                 self.save()
                 return False
             for item in data_list:
-                self.__groups[item.name] = Group(item, self, self.__lock)
+                group = Group(item, self, self.__lock)
+                self.__groups[item.name] = group
+                for region in set(item.regions):
+                    self.on_region_added(group, region)
+                for area in item.areas:
+                    self.on_area_added(group, area)
             return True
 
+    def register_event_listeners(self):
+        self.__rfum.server.register_event_listener(
+            MCDRPluginEvents.PLUGIN_UNLOADED, lambda *args, **kwargs: self.close()
+        )
+
     def save(self) -> bool:
+        """
+        Marks group data as changed, changes in the next few moments are written together
+        by a background flush
+        """
+        delay = self.__rfum.config.get_group_save_delay()
+        with self.__lock:
+            self.__dirty = True
+        if delay <= 0:
+            return self.flush()
+        with self.__lock:
+            if self.__flush_timer is None:
+                self.__flush_timer = threading.Timer(delay, self.__scheduled_flush)
+                self.__flush_timer.name = "RFUM-GroupSave"
+                self.__flush_timer.daemon = True
+                self.__flush_timer.start()
+            return True
+
+    def __scheduled_flush(self):
         with self.__lock:
-            data_list = map(lambda group: group.get_data(self), self.__groups.values())
-            if os.path.isdir(self.__path):
-                os.removedirs(self.__path)
+            self.__flush_timer = None
+        self.flush()
+
+    def flush(self) -> bool:
+        """
+        Writes pending changes now, the file is replaced atomically
+        """
+        with self.__write_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return True
+                try:
+                    data_list = [
+                        group.get_data(self).serialize()
+                        for group in self.__groups.values()
+                    ]
+                except (KeyError, ValueError):
+                    self.__rfum.logger.exception("Saving group file failed")
+                    return False
+                self.__dirty = False
             try:
-                with open(self.__path, "w", encoding="utf8") as f:
-                    json.dump(
-                        serialize(list(data_list)), f, ensure_ascii=False, indent=4
-                    )
-            except (KeyError, ValueError):
+                if os.path.isdir(self.__path):
+                    os.removedirs(self.__path)
+                with self.__rfum.file_utilities.safe_write(self.__path) as f:
+                    json.dump(data_list, f, ensure_ascii=False, indent=4)
+            except (OSError, ValueError):
                 self.__rfum.logger.exception("Saving group file failed")
+                with self.__lock:
+                    self.__dirty = True
                 return False
-            else:
-                self.__rfum.verbose("Saved group file")
+            self.__rfum.verbose(f"Saved group file with {len(data_list)} groups")
             return True
 
+    def close(self):
+        with self.__lock:
+            if self.__flush_timer is not None:
+                self.__flush_timer.cancel()
+                self.__flush_timer = None
+        self.flush()
+
     def get_group(self, name: str):
         with self.__lock:
             return self.__groups.get(name)
@@ -269,15 +558,112 @@ class GroupManager:
             target_group = self.__groups.pop(name, None)
             if target_group is None:
                 return None
+            for region in set(target_group.regions):
+                self.on_region_removed(target_group, region)
+            for area in target_group.areas:
+                self.on_area_removed(target_group, area)
             if self.save():
                 return target_group
             return None
 
+    def on_region_added(self, group: Group, region: Region):
+        """
+        Called by the group after a region is added to its saved data
+        """
+        with self.__lock:
+            groups = self.__region_index.setdefault(region.dim, {}).setdefault(
+                (region.x, region.z), []
+            )
+            if group not in groups:
+                groups.append(group)
+
+    def on_region_removed(self, group: Group, region: Region):
+        """
+        Called by the group after a region is removed from its saved data
+        """
+        with self.__lock:
+            dim_index = self.__region_index.get(region.dim)
+            if dim_index is None:
+                return
+            groups = dim_index.get((region.x, region.z))
+            if groups is None or group not in groups:
+                return
+            groups.remove(group)
+            if len(groups) == 0:
+                del dim_index[(region.x, region.z)]
+                if len(dim_index) == 0:
+                    del self.__region_index[region.dim]
+
+    def on_area_added(self, group: Group, area: RegionArea):
+        with self.__lock:
+            self.__area_index.setdefault(area.dim, AreaIndex()).add(area, group)
+
+    def on_area_removed(self, group: Group, area: RegionArea):
+        with self.__lock:
+            area_index = self.__area_index.get(area.dim)
+            if area_index is None:
+                return
+            area_index.remove(area, group)
+            if len(area_index) == 0:
+                del self.__area_index[area.dim]
+
+    def __find_groups(self, region: Region) -> List[Group]:
+        groups = self.__region_index.get(region.dim, {}).get((region.x, region.z), [])
+        groups = groups.copy()
+        area_index = self.__area_index.get(region.dim)
+        if area_index is not None:
+            for group in area_index.find(region):
+                if group not in groups:
+                    groups.append(group)
+        return groups
+
     def get_group_by_region(self, region: Region) -> Iterable[Group]:
-        for group in self.__groups.values():
-            if group.is_listed(region):
-                self.__rfum.verbose(f"{region} included in {group.name}")
-                yield group
+        with self.__lock:
+            groups = self.__find_groups(region)
+        for group in groups:
+            self.__rfum.verbose(f"{region} included in {group.name}")
+            yield group
+
+    def get_groups_by_regions(
+        self, regions: Iterable[Region]
+    ) -> Dict[Region, List[Group]]:
+        """
+        Groups of every included region, regions not in any group are left out
+        """
+        with self.__lock:
+            if len(self.__region_index) == 0 and len(self.__area_index) == 0:
+                return {}
+            result = {}
+            for region in regions:
+                groups = self.__find_groups(region)
+                if len(groups) > 0:
+                    result[region] = groups
+            return result
+
+    def get_update_denied_regions(
+        self, source: CommandSource, regions: Iterable[Region]
+    ) -> Dict[Region, List[Group]]:
+        """
+        Batched is_region_permitted, permission of the source is evaluated once per group
+        Returns denied regions and the groups denying them
+        """
+        with self.__lock:
+            denied_groups = [
+                group
+                for group in self.__groups.values()
+                if not group.is_src_permitted(source)
+            ]
+            if len(denied_groups) == 0:
+                return {}
+            result = {}
+            for region, groups in self.get_groups_by_regions(regions).items():
+                groups = [group for group in groups if group in denied_groups]
+                if len(groups) > 0:
+                    result[region] = groups
+            self.__rfum.verbose(
+                f"{len(result)} regions denied by {len(denied_groups)} groups"
+            )
+            return result
 
     def get_update_denied_groups(self, source: CommandSource, region: Region):
         return filter(
@@ -289,4 +675,10 @@ class GroupManager:
         return len(list(self.get_update_denied_groups(source, region))) == 0
 
     def is_region_included(self, region: Region):
-        return len(list(self.get_group_by_region(region))) > 0
+        with self.__lock:
+            if (region.x, region.z) in self.__region_index.get(region.dim, {}):
+                return True
+            area_index = self.__area_index.get(region.dim)
+            return area_index is not None and any(
+                True for _ in area_index.find(region)
+            )
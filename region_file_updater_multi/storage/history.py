@@ -1,26 +1,261 @@
 import json
+import math
+import sqlite3
 import threading
 import time
-from typing import TYPE_CHECKING, Optional, Dict
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    Dict,
+    List,
+    Iterable,
+    NamedTuple,
+    Sequence,
+    Tuple,
+)
 
+from mcdreforged.api.all import MCDRPluginEvents
+
+from region_file_updater_multi.region_upstream_manager import ExtractStatus
 from region_file_updater_multi.utils.serializer import RFUMSerializable
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+    from region_file_updater_multi.region_upstream_manager import FileExtractResult
+
+
+# Phases of an update session, in the order they happen
+PHASE_CONFIRM_WAIT = "confirm_wait"
+PHASE_COUNTDOWN = "countdown"
+PHASE_PRE_EXTRACT = "pre_extract"
+PHASE_PRE_EXTRACT_WAIT = "pre_extract_wait"
+PHASE_SERVER_STOP = "server_stop"
+PHASE_EXTRACT = "extract"
+PHASE_APPLY = "apply"
+PHASE_RESTORE = "restore"
+PHASE_SERVER_START = "server_start"
+PHASE_DOWNTIME = "downtime"
+PHASES = [
+    PHASE_CONFIRM_WAIT,
+    PHASE_COUNTDOWN,
+    PHASE_PRE_EXTRACT,
+    PHASE_PRE_EXTRACT_WAIT,
+    PHASE_SERVER_STOP,
+    PHASE_EXTRACT,
+    PHASE_APPLY,
+    PHASE_RESTORE,
+    PHASE_SERVER_START,
+    PHASE_DOWNTIME,
+]
+
+# Results of files whose content was written to the world
+_WRITTEN_STATUSES = (ExtractStatus.extracted, ExtractStatus.spliced)
+
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    player TEXT,
+    succeeded INTEGER NOT NULL,
+    upstream TEXT NOT NULL,
+    region_count INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_player ON history (player, id);
+CREATE TABLE IF NOT EXISTS history_region (
+    region TEXT NOT NULL,
+    history_id INTEGER NOT NULL,
+    PRIMARY KEY (region, history_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_upstream (
+    upstream TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    regions INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats_downtime (
+    upstream TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (upstream, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_region (
+    region TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stats_region_count ON stats_region (count);
+"""
+
+# Downtime samples are counted in log scale buckets, each one about 9% wider than the
+# previous one, so quantiles are read from a few hundred counters at most
+DOWNTIME_BUCKET_BASE = 0.01
+DOWNTIME_BUCKET_RATIO = 2 ** (1 / 8)
+
+
+def get_downtime_bucket(seconds: float) -> int:
+    """
+    Bucket 0 holds samples up to the base, bucket n holds (base * ratio^(n-1), base * ratio^n]
+    """
+    if seconds <= DOWNTIME_BUCKET_BASE:
+        return 0
+    return math.ceil(
+        math.log(seconds / DOWNTIME_BUCKET_BASE, DOWNTIME_BUCKET_RATIO) - 1e-9
+    )
+
+
+def get_downtime_bucket_value(bucket: int) -> float:
+    """
+    Geometric middle of the bucket
+    """
+    if bucket <= 0:
+        return DOWNTIME_BUCKET_BASE
+    return DOWNTIME_BUCKET_BASE * DOWNTIME_BUCKET_RATIO ** (bucket - 0.5)
+
+
+def get_bucket_quantile(buckets: List[Tuple[int, int]], quantile: float) -> Optional[float]:
+    """
+    Nearest rank quantile of (bucket, count) pairs sorted by bucket
+    """
+    total = sum(count for _, count in buckets)
+    if total == 0:
+        return None
+    rank = max(math.ceil(quantile * total), 1)
+    for bucket, count in buckets:
+        rank -= count
+        if rank <= 0:
+            return get_downtime_bucket_value(bucket)
+    return get_downtime_bucket_value(buckets[-1][0])
 
 
 class History:
+    """
+    Every finished update, kept in a SQLite database beside the config
+
+    Entries are only appended, the latest one is amended with its timings and snapshot.
+    Nothing but the latest entry is held in memory, statistics are counted as entries are written
+    """
+
+    class FileTiming(RFUMSerializable):
+        file_name: str
+        region: str
+        status: Optional[str]
+        size: int
+        recycle: float
+        extract: float
+        apply: float
+
+        @property
+        def total(self):
+            return self.recycle + self.extract + self.apply
+
+    class UpstreamTiming(RFUMSerializable):
+        file_count: int
+        size: int
+        extract: float
+
+    class SessionTimings(RFUMSerializable):
+        phases: Dict[str, float]
+        files: List["History.FileTiming"]
+        upstreams: Dict[str, "History.UpstreamTiming"]
+
+        @classmethod
+        def create(
+            cls,
+            phases: Dict[str, float],
+            results: Optional[Iterable["FileExtractResult"]],
+            upstream_name: str,
+        ):
+            """
+            Upstream totals only count files actually written to the world,
+            unchanged, kept, removed and failed files are only listed
+            """
+            files = []
+            upstream = History.UpstreamTiming(file_count=0, size=0, extract=0.0)
+            for result in results or []:
+                files.append(
+                    History.FileTiming(
+                        file_name=result.file_name,
+                        region=str(result.region),
+                        status=None if result.status is None else result.status.name,
+                        size=result.size or 0,
+                        recycle=result.recycle_time,
+                        extract=result.extract_time,
+                        apply=result.apply_time,
+                    )
+                )
+                if result.status not in _WRITTEN_STATUSES:
+                    continue
+                upstream.file_count += 1
+                upstream.size += result.size or 0
+                upstream.extract += result.extract_time
+            return cls(
+                phases=phases, files=files, upstreams={upstream_name: upstream}
+            )
+
     class HistoryData(RFUMSerializable):
         player: Optional[str]
         timestamp: float
         is_last_operation_succeeded: bool
         upstream_name: str
         last_operation_mca: Dict[str, Optional[str]]
+        timings: Optional["History.SessionTimings"] = None
+        # Replaced files of this update are kept in the snapshot for rollback
+        snapshot_id: Optional[str] = None
+
+    class Summary(NamedTuple):
+        """
+        A history entry without its region list and timings, used by list queries
+        """
+
+        history_id: int
+        timestamp: float
+        player: Optional[str]
+        is_succeeded: bool
+        upstream_name: str
+        region_count: int
+
+    class UpstreamStatistics(RFUMSerializable):
+        sessions: int
+        succeeded: int
+        regions: int
+        files: int
+        size: int
+        downtime_samples: int
+        # Seconds, None if the server was never stopped by an update from this upstream
+        downtime_median: Optional[float] = None
+        downtime_p95: Optional[float] = None
+
+    class RegionStatistics(RFUMSerializable):
+        region: str
+        count: int
 
-    def __init__(self, path: str, rfum: "RegionFileUpdaterMulti"):
+    class Statistics(RFUMSerializable):
+        sessions: int
+        succeeded: int
+        success_rate: float
+        files: int
+        size: int
+        upstreams: Dict[str, "History.UpstreamStatistics"]
+        top_regions: List["History.RegionStatistics"]
+
+    def __init__(
+        self,
+        path: str,
+        rfum: "RegionFileUpdaterMulti",
+        legacy_path: Optional[str] = None,
+    ):
         self.__rfum = rfum
         self.__path = path
         self.__lock = threading.RLock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.executescript(HISTORY_SCHEMA)
+        if legacy_path is not None:
+            self.__import_legacy(legacy_path)
+        self.__rebuild_statistics_if_missing()
+        self.__data_id: Optional[int] = None
         self.__data: Optional[History.HistoryData] = self.load_history()
 
     @property
@@ -29,30 +264,291 @@ class History:
 
     @property
     def data(self):
+        """
+        Latest entry
+        """
         return self.__data
 
-    def load_history(self) -> Optional["HistoryData"]:
+    @property
+    def data_id(self):
+        return self.__data_id
+
+    def register_event_listeners(self):
+        self.__rfum.server.register_event_listener(
+            MCDRPluginEvents.PLUGIN_UNLOADED, lambda *args, **kwargs: self.close()
+        )
+
+    def close(self):
         with self.__lock:
+            self.__connection.close()
+
+    def __import_legacy(self, legacy_path: str):
+        """
+        history.json only kept the last update, it's imported once into an empty database
+        """
+        with self.__lock:
+            if self.__connection.execute("SELECT 1 FROM history LIMIT 1").fetchone():
+                return
             try:
-                with open(self.__path, "r", encoding="utf8") as f:
-                    return History.HistoryData.deserialize(json.load(f))
+                with open(legacy_path, "r", encoding="utf8") as f:
+                    data = History.HistoryData.deserialize(json.load(f))
             except (KeyError, ValueError, FileNotFoundError):
+                return
+            self.__insert(data)
+            self.__rfum.verbose(f"Imported last update from {legacy_path}")
+
+    def __insert(self, data: "History.HistoryData") -> int:
+        with self.__lock, self.__connection:
+            cursor = self.__connection.execute(
+                "INSERT INTO history (timestamp, player, succeeded, upstream, region_count, data)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    data.timestamp,
+                    data.player,
+                    data.is_last_operation_succeeded,
+                    data.upstream_name,
+                    len(data.last_operation_mca),
+                    json.dumps(data.serialize(), ensure_ascii=False),
+                ),
+            )
+            history_id = cursor.lastrowid
+            if history_id is None:
+                raise sqlite3.DatabaseError("History entry is not inserted")
+            self.__connection.executemany(
+                "INSERT OR IGNORE INTO history_region (region, history_id) VALUES (?, ?)",
+                ((region, history_id) for region in data.last_operation_mca.keys()),
+            )
+            self.__count_entry(data)
+            if data.timings is not None:
+                self.__count_timings(data.upstream_name, data.timings)
+            return history_id
+
+    def __count_entry(self, data: "History.HistoryData"):
+        self.__connection.execute(
+            "INSERT INTO stats_upstream (upstream, sessions, succeeded, regions)"
+            " VALUES (?, 1, ?, ?) ON CONFLICT (upstream) DO UPDATE SET"
+            " sessions = sessions + 1,"
+            " succeeded = succeeded + excluded.succeeded,"
+            " regions = regions + excluded.regions",
+            (
+                data.upstream_name,
+                int(data.is_last_operation_succeeded),
+                len(data.last_operation_mca),
+            ),
+        )
+        self.__connection.executemany(
+            "INSERT INTO stats_region (region, count) VALUES (?, 1)"
+            " ON CONFLICT (region) DO UPDATE SET count = count + 1",
+            ((region,) for region in data.last_operation_mca.keys()),
+        )
+
+    def __count_timings(self, upstream_name: str, timings: "History.SessionTimings"):
+        for name, upstream in timings.upstreams.items():
+            self.__connection.execute(
+                "INSERT INTO stats_upstream (upstream, files, size) VALUES (?, ?, ?)"
+                " ON CONFLICT (upstream) DO UPDATE SET"
+                " files = files + excluded.files, size = size + excluded.size",
+                (name, upstream.file_count, upstream.size),
+            )
+        downtime = timings.phases.get(PHASE_DOWNTIME)
+        if downtime is not None:
+            self.__connection.execute(
+                "INSERT INTO stats_downtime (upstream, bucket, count) VALUES (?, ?, 1)"
+                " ON CONFLICT (upstream, bucket) DO UPDATE SET count = count + 1",
+                (upstream_name, get_downtime_bucket(downtime)),
+            )
+
+    def __rebuild_statistics_if_missing(self):
+        """
+        Databases written before statistics were kept are counted once
+        """
+        with self.__lock:
+            if self.__connection.execute(
+                "SELECT 1 FROM stats_upstream LIMIT 1"
+            ).fetchone() or not self.__connection.execute(
+                "SELECT 1 FROM history LIMIT 1"
+            ).fetchone():
+                return
+            count = 0
+            with self.__connection:
+                for (text,) in self.__connection.execute(
+                    "SELECT data FROM history ORDER BY id"
+                ).fetchall():
+                    try:
+                        data = History.HistoryData.deserialize(json.loads(text))
+                    except (KeyError, ValueError):
+                        continue
+                    self.__count_entry(data)
+                    if data.timings is not None:
+                        self.__count_timings(data.upstream_name, data.timings)
+                    count += 1
+            self.__rfum.verbose(f"Counted statistics of {count} history entries")
+
+    def __update(self, history_id: int, data: "History.HistoryData"):
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "UPDATE history SET data = ? WHERE id = ?",
+                (json.dumps(data.serialize(), ensure_ascii=False), history_id),
+            )
+
+    def load_history(self) -> Optional["HistoryData"]:
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT id FROM history ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
                 return None
+            self.__data_id = row[0]
+            return self.get(row[0])
 
     def save_history(self, data: Optional["History.HistoryData"] = None) -> bool:
+        """
+        Appends data as a new entry, or writes the latest entry again when data is None
+        """
         with self.__lock:
-            if data is None:
-                data = self.__data
-            if data is None:
-                return False
             try:
-                with open(self.__path, "w", encoding="utf8") as f:
-                    json.dump(data.serialize(), f, ensure_ascii=False, indent=4)
-            except (KeyError, ValueError):
+                if data is None:
+                    if self.__data is None or self.__data_id is None:
+                        return False
+                    self.__update(self.__data_id, self.__data)
+                else:
+                    self.__data_id = self.__insert(data)
+                    self.__data = data
+            except (KeyError, ValueError, sqlite3.Error):
+                self.__rfum.logger.exception("Saving history failed")
                 return False
+            return True
+
+    def get(self, history_id: int) -> Optional["History.HistoryData"]:
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT data FROM history WHERE id = ?", (history_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return History.HistoryData.deserialize(json.loads(row[0]))
+        except (KeyError, ValueError):
+            self.__rfum.logger.exception(f"Broken history entry #{history_id}")
+            return None
+
+    def count(self, player: Optional[str] = None) -> int:
+        with self.__lock:
+            if player is None:
+                # Entries are never deleted, ids are continuous
+                row = self.__connection.execute("SELECT MAX(id) FROM history").fetchone()
             else:
-                self.__data = data
-                return True
+                row = self.__connection.execute(
+                    "SELECT COUNT(*) FROM history WHERE player = ?", (player,)
+                ).fetchone()
+            return row[0] or 0
+
+    def get_summaries(
+        self, head: int, tail: int, player: Optional[str] = None
+    ) -> List["History.Summary"]:
+        """
+        Entries in range [head, tail) counting from the latest one
+        """
+        columns = "id, timestamp, player, succeeded, upstream, region_count"
+        with self.__lock:
+            if player is None:
+                last_id = self.count()
+                rows = self.__connection.execute(
+                    f"SELECT {columns} FROM history WHERE id > ? AND id <= ?"
+                    " ORDER BY id DESC",
+                    (last_id - tail, last_id - head),
+                ).fetchall()
+            else:
+                rows = self.__connection.execute(
+                    f"SELECT {columns} FROM history WHERE player = ?"
+                    " ORDER BY id DESC LIMIT ? OFFSET ?",
+                    (player, tail - head, head),
+                ).fetchall()
+        return [
+            History.Summary(
+                history_id=row[0],
+                timestamp=row[1],
+                player=row[2],
+                is_succeeded=bool(row[3]),
+                upstream_name=row[4],
+                region_count=row[5],
+            )
+            for row in rows
+        ]
+
+    def get_view(self, player: Optional[str] = None) -> "HistoryView":
+        return HistoryView(self, player)
+
+    def get_last_id_by_region(self, region: str) -> Optional[int]:
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT MAX(history_id) FROM history_region WHERE region = ?", (region,)
+            ).fetchone()
+        return row[0]
+
+    def get_statistics(self, top_region_count: int) -> "History.Statistics":
+        with self.__lock:
+            upstream_rows = self.__connection.execute(
+                "SELECT upstream, sessions, succeeded, regions, files, size"
+                " FROM stats_upstream ORDER BY upstream"
+            ).fetchall()
+            downtime: Dict[str, List[Tuple[int, int]]] = {}
+            for upstream, bucket, count in self.__connection.execute(
+                "SELECT upstream, bucket, count FROM stats_downtime ORDER BY upstream, bucket"
+            ):
+                downtime.setdefault(upstream, []).append((bucket, count))
+            region_rows = self.__connection.execute(
+                "SELECT region, count FROM stats_region ORDER BY count DESC LIMIT ?",
+                (top_region_count,),
+            ).fetchall()
+        upstreams = {}
+        for name, sessions, succeeded, regions, files, size in upstream_rows:
+            buckets = downtime.get(name, [])
+            upstreams[name] = History.UpstreamStatistics(
+                sessions=sessions,
+                succeeded=succeeded,
+                regions=regions,
+                files=files,
+                size=size,
+                downtime_samples=sum(count for _, count in buckets),
+                downtime_median=get_bucket_quantile(buckets, 0.5),
+                downtime_p95=get_bucket_quantile(buckets, 0.95),
+            )
+        sessions = sum(upstream.sessions for upstream in upstreams.values())
+        succeeded = sum(upstream.succeeded for upstream in upstreams.values())
+        return History.Statistics(
+            sessions=sessions,
+            succeeded=succeeded,
+            success_rate=succeeded / sessions if sessions > 0 else 0.0,
+            files=sum(upstream.files for upstream in upstreams.values()),
+            size=sum(upstream.size for upstream in upstreams.values()),
+            upstreams=upstreams,
+            top_regions=[
+                History.RegionStatistics(region=region, count=count)
+                for region, count in region_rows
+            ],
+        )
+
+    def record_timings(self, timings: "History.SessionTimings"):
+        with self.__lock:
+            if self.__data is None:
+                return False
+            counted = self.__data.timings is not None
+            self.__data.timings = timings
+            if not counted:
+                try:
+                    with self.__connection:
+                        self.__count_timings(self.__data.upstream_name, timings)
+                except sqlite3.Error:
+                    self.__rfum.logger.exception("Counting update statistics failed")
+            return self.save_history()
+
+    def record_snapshot(self, snapshot_id: str):
+        with self.__lock:
+            if self.__data is None:
+                return False
+            self.__data.snapshot_id = snapshot_id
+            return self.save_history()
 
     def record(
         self,
@@ -74,3 +570,31 @@ class History:
                     )
                 )
             )
+
+
+class HistoryView(Sequence["History.Summary"]):
+    """
+    Entries newest first, a slice only queries the rows in it
+    """
+
+    def __init__(self, history: History, player: Optional[str] = None):
+        self.__history = history
+        self.__player = player
+        self.__length = history.count(player)
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            head, tail, step = index.indices(self.__length)
+            if step != 1:
+                raise ValueError("Stepped slice is not supported")
+            if tail <= head:
+                return []
+            return self.__history.get_summaries(head, tail, self.__player)
+        if index < 0:
+            index += self.__length
+        if not 0 <= index < self.__length:
+            raise IndexError("History index out of range")
+        return self.__history.get_summaries(index, index + 1, self.__player)[0]
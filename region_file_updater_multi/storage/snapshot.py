@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+from region_file_updater_multi.mcdr_globals import *
+from region_file_updater_multi.region_upstream_manager import (
+    ExtractStatus,
+    FileExtractResult,
+)
+from region_file_updater_multi.utils.file_utils import FileUtils, RecycledFile
+from region_file_updater_multi.utils.serializer import RFUMSerializable
+
+if TYPE_CHECKING:
+    from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+    from region_file_updater_multi.storage.history import History
+
+
+class Snapshot(RFUMSerializable):
+    snapshot_id: str
+    # Same as the timestamp of History entry which produced this snapshot
+    timestamp: float
+    player: Optional[str]
+    upstream_name: str
+    region_count: int
+    file_count: int
+    size: int
+    # Files which didn't exist before the update, removed on rollback
+    created_files: List[str] = []
+
+
+class SnapshotStore:
+    """
+    Keeps replaced files of the last few successful updates, so they can be rolled back
+
+    A snapshot is the recycle bin of a finished session moved here as a whole, its journal
+    still tells where each recycled file came from
+    """
+
+    def __init__(self, path: str, rfum: "RegionFileUpdaterMulti"):
+        self.__rfum = rfum
+        self.__lock = threading.RLock()
+        self.__path = path
+        self.__snapshots: List[Snapshot] = []
+        self.__load()
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def snapshots(self) -> List[Snapshot]:
+        """
+        Oldest first
+        """
+        with self.__lock:
+            return self.__snapshots.copy()
+
+    def get_latest(self) -> Optional[Snapshot]:
+        with self.__lock:
+            return self.__snapshots[-1] if len(self.__snapshots) > 0 else None
+
+    def get_snapshot(self, snapshot_id: Optional[str]) -> Optional[Snapshot]:
+        with self.__lock:
+            for snapshot in self.__snapshots:
+                if snapshot.snapshot_id == snapshot_id:
+                    return snapshot
+            return None
+
+    def get_snapshot_path(self, snapshot: Snapshot) -> str:
+        return os.path.join(self.__path, snapshot.snapshot_id)
+
+    def relocate(self, path: str):
+        """
+        Moves kept snapshots to path, called when the recycle bin moved
+        Snapshots already in path are loaded as well
+        """
+        with self.__lock:
+            if os.path.abspath(path) == os.path.abspath(self.__path):
+                return
+            file_utils = self.__rfum.file_utilities
+            for snapshot in self.__snapshots:
+                target_path = os.path.join(path, snapshot.snapshot_id)
+                if os.path.exists(target_path):
+                    self.__rfum.logger.warning(
+                        f"Snapshot {snapshot.snapshot_id} already exists in {path}, "
+                        f"left in {self.__path}"
+                    )
+                    continue
+                FileUtils.ensure_dir(path)
+                file_utils.move(
+                    self.get_snapshot_path(snapshot), target_path, allow_overwrite=False
+                )
+            self.__rfum.verbose(f"Snapshot path set to {path}")
+            old_path, self.__path = self.__path, path
+            try:
+                os.rmdir(old_path)
+            except OSError:
+                pass
+            self.__load()
+
+    def __load(self):
+        with self.__lock:
+            self.__snapshots = []
+            if not os.path.isdir(self.__path):
+                return
+            for item in os.listdir(self.__path):
+                meta_path = os.path.join(self.__path, item, SNAPSHOT_META_FILE)
+                try:
+                    with open(meta_path, "r", encoding="utf8") as f:
+                        self.__snapshots.append(Snapshot.deserialize(json.load(f)))
+                except (KeyError, ValueError, OSError) as e:
+                    self.__rfum.verbose(
+                        f"Skipped snapshot {item}: [{e.__class__.__name__}] {str(e)}"
+                    )
+            self.__snapshots.sort(key=lambda snapshot: snapshot.timestamp)
+            self.__rfum.verbose(f"Loaded {len(self.__snapshots)} snapshots")
+
+    def take(
+        self,
+        history_data: "History.HistoryData",
+        results: Optional[Iterable[FileExtractResult]],
+    ) -> Optional[Snapshot]:
+        """
+        Moves current recycle bin into a new snapshot, then evicts the oldest ones out of budget
+        Must be called before the recycle bin is emptied
+        """
+        config = self.__rfum.config.update_operation
+        if config.snapshot_retention <= 0:
+            return None
+        file_utils = self.__rfum.file_utilities
+        world_dir = self.__rfum.config.paths.destination_world_directory
+        with self.__lock:
+            created_files = []
+            for result in results or []:
+                if result.status is not ExtractStatus.extracted:
+                    continue
+                target_file = os.path.abspath(os.path.join(world_dir, result.file_name))
+                if file_utils.get_recycled_file_by_original_path(target_file) is None:
+                    created_files.append(target_file)
+            file_count = len(file_utils.get_recycled_files())
+            if file_count == 0 and len(created_files) == 0:
+                return None
+
+            snapshot_id = time.strftime(
+                "%Y%m%d-%H%M%S", time.localtime(history_data.timestamp)
+            )
+            while os.path.exists(os.path.join(self.__path, snapshot_id)):
+                snapshot_id += "_"
+            target_path = os.path.join(self.__path, snapshot_id)
+            FileUtils.ensure_dir(self.__path)
+            size = file_utils.detach(target_path)
+            snapshot = Snapshot(
+                snapshot_id=snapshot_id,
+                timestamp=history_data.timestamp,
+                player=history_data.player,
+                upstream_name=history_data.upstream_name,
+                region_count=len(history_data.last_operation_mca),
+                file_count=file_count,
+                size=size,
+                created_files=created_files,
+            )
+            with open(
+                os.path.join(target_path, SNAPSHOT_META_FILE), "w", encoding="utf8"
+            ) as f:
+                json.dump(snapshot.serialize(), f, ensure_ascii=False, indent=4)
+            self.__snapshots.append(snapshot)
+            self.__rfum.logger.info(
+                f"Kept {file_count} replaced files ({size} bytes) in snapshot {snapshot_id}"
+            )
+            self.__evict()
+            return snapshot
+
+    def __evict(self):
+        config = self.__rfum.config.update_operation
+        budget = config.snapshot_size_limit.value
+        while len(self.__snapshots) > 0 and (
+            len(self.__snapshots) > config.snapshot_retention
+            or sum(snapshot.size for snapshot in self.__snapshots) > budget
+        ):
+            snapshot = self.__snapshots[0]
+            self.__rfum.verbose(f"Evicting snapshot {snapshot.snapshot_id}")
+            self.delete(snapshot)
+
+    def delete(self, snapshot: Snapshot):
+        with self.__lock:
+            FileUtils.delete(self.get_snapshot_path(snapshot))
+            if snapshot in self.__snapshots:
+                self.__snapshots.remove(snapshot)
+
+    def rollback(self, snapshot: Snapshot) -> List[RecycledFile]:
+        """
+        Puts replaced files of the snapshot back and removes files created by its update
+        Files overwritten here go through the recycle bin, so a failed rollback restores them
+        Returns the restored files
+        """
+        with self.__lock:
+            file_utils = self.__rfum.file_utilities
+            # Snapshot is a detached recycle bin, replaying its journal finds the files
+            interrupted = FileUtils(
+                self.get_snapshot_path(snapshot), self.__rfum
+            ).interrupted_session
+            restored = [] if interrupted is None else interrupted.files
+            with file_utils:
+                # Newest first, the file before the update is the one put back last
+                for recycled_file in reversed(restored):
+                    file_utils.move(
+                        recycled_file.file_path, str(recycled_file.original_path)
+                    )
+                for created_file in snapshot.created_files:
+                    if os.path.exists(created_file):
+                        file_utils.recycle(created_file)
+                file_utils.sync_journal()
+            self.delete(snapshot)
+            return restored
@@ -1,11 +1,25 @@
 import copy
 import sys
 import threading
-from typing import TYPE_CHECKING, Dict, Optional, Callable, Any, Union
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Optional,
+    Callable,
+    Any,
+    Union,
+    List,
+    Iterable,
+    Set,
+    FrozenSet,
+)
 
 from mcdreforged.api.all import *
 
-from region_file_updater_multi.region_upstream_manager import Region
+from region_file_updater_multi.region_upstream_manager import (
+    Region,
+    FileExtractResult,
+)
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.base import BaseTrigger
@@ -15,6 +29,20 @@ from region_file_updater_multi.utils.misc_tools import (
     get_player_from_src,
 )
 from region_file_updater_multi.utils.units import Duration
+from region_file_updater_multi.utils.timing import PhaseTimer
+from region_file_updater_multi.storage.history import (
+    History,
+    PHASE_CONFIRM_WAIT,
+    PHASE_COUNTDOWN,
+    PHASE_PRE_EXTRACT,
+    PHASE_PRE_EXTRACT_WAIT,
+    PHASE_SERVER_STOP,
+    PHASE_EXTRACT,
+    PHASE_APPLY,
+    PHASE_RESTORE,
+    PHASE_SERVER_START,
+    PHASE_DOWNTIME,
+)
 from region_file_updater_multi.components.misc import get_rfum_comp_prefix
 
 if TYPE_CHECKING:
@@ -26,6 +54,8 @@ class UpdateSession:
         self.__region_list_lock = threading.RLock()
         self.__session_pending_lock = threading.Lock()
         self.__regions: Dict[Region, Optional[str]] = {}
+        # Regions only have these chunks updated, the others are updated as a whole
+        self.__chunks: Dict[Region, Set[int]] = {}
         self.__rfum = rfum
         self.__scheduler_lock = threading.RLock()
         self.__scheduler = get_scheduler(BlockingScheduler)
@@ -33,6 +63,7 @@ class UpdateSession:
         self.__aborted = True
         self.__started_lock = threading.Lock()
         self.__cached_countdown = 0
+        self.__confirmed_at: Optional[float] = None
 
     def reset_countdown(self):
         self.__cached_countdown = round(
@@ -58,6 +89,12 @@ class UpdateSession:
     def get_current_regions(self, deepcopy: bool = False):
         return copy.deepcopy(self.__regions) if deepcopy else self.__regions.copy()
 
+    def get_current_chunks(self) -> Dict[Region, FrozenSet[int]]:
+        with self.__region_list_lock:
+            return {
+                region: frozenset(chunks) for region, chunks in self.__chunks.items()
+            }
+
     def assert_allowed(self):
         if self.is_session_running:
             raise RuntimeError("Modifying is not allowed at this time")
@@ -65,19 +102,84 @@ class UpdateSession:
     def add_region(self, region: Region, player: Optional[str]):
         self.assert_allowed()
         with self.__region_list_lock:
-            if region in self.__regions.keys():
+            if region in self.__regions.keys() and region not in self.__chunks.keys():
                 raise ValueError(f"{repr(region)} already exists")
+            # Adding the whole region overrides its chunk selection
+            self.__chunks.pop(region, None)
             self.__regions[region] = player
             self.__rfum.verbose(f"{player or 'Console'} added region {str(region)}")
 
+    def add_regions(self, regions: Iterable[Region], player: Optional[str]):
+        """
+        Adds regions under one lock, regions already added as a whole are skipped
+        Returns the added regions
+        """
+        self.assert_allowed()
+        added = []
+        with self.__region_list_lock:
+            for region in regions:
+                if region in self.__regions.keys() and region not in self.__chunks:
+                    continue
+                self.__chunks.pop(region, None)
+                self.__regions[region] = player
+                added.append(region)
+            self.__rfum.verbose(f"{player or 'Console'} added {len(added)} regions")
+        return added
+
+    def add_chunk(self, region: Region, index: int, player: Optional[str]):
+        self.assert_allowed()
+        with self.__region_list_lock:
+            if region in self.__regions.keys() and region not in self.__chunks.keys():
+                raise ValueError(f"{repr(region)} already exists as a whole")
+            chunks = self.__chunks.setdefault(region, set())
+            if index in chunks:
+                raise ValueError(f"Chunk {index} of {repr(region)} already exists")
+            chunks.add(index)
+            self.__regions.setdefault(region, player)
+            self.__rfum.verbose(
+                f"{player or 'Console'} added chunk {index} of region {str(region)}"
+            )
+
+    def remove_chunk(self, region: Region, index: int, player: Optional[str]):
+        self.assert_allowed()
+        with self.__region_list_lock:
+            chunks = self.__chunks.get(region)
+            if chunks is None or index not in chunks:
+                raise ValueError(f"Chunk {index} of {repr(region)} not found")
+            chunks.remove(index)
+            if len(chunks) == 0:
+                del self.__chunks[region]
+                del self.__regions[region]
+            self.__rfum.verbose(
+                f"{player or 'Console'} removed chunk {index} of region {str(region)}"
+            )
+
     def remove_region(self, region: Region, player: Optional[str]):
         self.assert_allowed()
         with self.__region_list_lock:
             if region not in self.__regions.keys():
                 raise ValueError(f"{repr(region)} not found in current session")
             del self.__regions[region]
+            self.__chunks.pop(region, None)
             self.__rfum.verbose(f"{player or 'Console'} removed region {str(region)}")
 
+    def remove_regions(self, regions: Iterable[Region], player: Optional[str]):
+        """
+        Removes regions under one lock, regions not in the session are skipped
+        Returns the removed regions
+        """
+        self.assert_allowed()
+        removed = []
+        with self.__region_list_lock:
+            for region in regions:
+                if region not in self.__regions.keys():
+                    continue
+                del self.__regions[region]
+                self.__chunks.pop(region, None)
+                removed.append(region)
+            self.__rfum.verbose(f"{player or 'Console'} removed {len(removed)} regions")
+        return removed
+
     def remove_all_regions(self):
         self.assert_allowed()
         self.__remove_all_regions()
@@ -85,6 +187,7 @@ class UpdateSession:
     def __remove_all_regions(self):
         with self.__region_list_lock:
             self.__regions = {}
+            self.__chunks = {}
             self.__rfum.verbose("Removed all the regions from session")
 
     @named_thread
@@ -111,6 +214,7 @@ class UpdateSession:
         with self.__scheduler_lock:
             self.reset_countdown()
             self.__aborted = False
+            self.__confirmed_at = PhaseTimer.now()
             if self.__cached_countdown <= 0 and self.__scheduler.running:
                 self.scheduler_stop()
             else:
@@ -144,6 +248,22 @@ class UpdateSession:
             self.__aborted = True
             self.scheduler_stop()
 
+    @named_thread
+    def pre_extract(
+        self,
+        regions: List[Region],
+        chunks: Dict[Region, FrozenSet[int]],
+        timer: PhaseTimer,
+        cancel_event: threading.Event,
+    ):
+        self.__rfum.logger.info(
+            f"Pre-extracting files of {len(regions)} regions into staging area"
+        )
+        with timer.phase(PHASE_PRE_EXTRACT):
+            return self.__rfum.region_upstream_manager.stage_regions(
+                regions, chunks, cancel_event
+            )
+
     def run_session(
         self,
         source: CommandSource,
@@ -167,7 +287,25 @@ class UpdateSession:
         acq = self.__session_pending_lock.acquire(blocking=False)
         if not acq:
             raise RuntimeError("Session already exists")
+        staging_thread: Optional[FunctionThread] = None
+        staging_cancel_event = threading.Event()
+        timer = PhaseTimer()
+        results: Optional[List[FileExtractResult]] = None
+        stopped_at: Optional[float] = None
+        recorded = False
+        succeeded = False
+        entered = False
         try:
+            # Use confirm & countdown time to extract files while server is running
+            if self.__rfum.config.update_operation.pre_extract_to_staging:
+                with self.__region_list_lock:
+                    staging_thread = self.pre_extract(
+                        list(self.__regions.keys()),
+                        self.get_current_chunks(),
+                        timer,
+                        staging_cancel_event,
+                    )
+
             # Wait confirm & countdown
             if requires_confirm:
                 self.scheduler_add_job(
@@ -178,25 +316,47 @@ class UpdateSession:
                 self.confirm_session()
             if requires_confirm or self.__cached_countdown > 0:
                 self.scheduler_start()
+            waited_at = PhaseTimer.now()
+            confirmed_at = self.__confirmed_at or waited_at
+            timer.record(PHASE_CONFIRM_WAIT, confirmed_at - timer.created_at)
+            timer.record(PHASE_COUNTDOWN, waited_at - confirmed_at)
 
             if self.__aborted:
                 self.__rfum.server.broadcast(
                     get_rfum_comp_prefix(self.__rfum.rtr("session.task_aborted"))
                 )
                 return
+            staged_tasks: Optional[List[FileExtractResult]] = None
+            if staging_thread is not None:
+                self.__rfum.verbose("Waiting for pre-extraction to finish")
+                with timer.phase(PHASE_PRE_EXTRACT_WAIT):
+                    staged_tasks = staging_thread.get_return_value(block=True)
+
             # Stop server
-            server.stop()
-            server.wait_until_stop()
+            stopped_at = PhaseTimer.now()
+            with timer.phase(PHASE_SERVER_STOP):
+                server.stop()
+                server.wait_until_stop()
 
             self.__rfum.file_utilities.__enter__()
+            entered = True
             # Run update
             with self.__region_list_lock:
                 region_list = self.__regions
+                chunk_selection = self.get_current_chunks()
                 self.__regions = {}
+                self.__chunks = {}
                 try:
                     self.__started_lock.acquire(blocking=True)
-                    for region in region_list.keys():
-                        region_upstream_manager.extract_region_files(region)
+                    if staged_tasks is not None:
+                        results = staged_tasks
+                        with timer.phase(PHASE_APPLY):
+                            region_upstream_manager.apply_staged_files(staged_tasks)
+                    else:
+                        with timer.phase(PHASE_EXTRACT):
+                            results = region_upstream_manager.extract_regions(
+                                region_list.keys(), chunks=chunk_selection
+                            )
                 finally:
                     history.record(
                         get_player_from_src(source),
@@ -204,29 +364,67 @@ class UpdateSession:
                         {str(region): player for region, player in region_list.items()},
                         self.__rfum.region_upstream_manager.get_current_upstream().name,
                     )
+                    recorded = True
                     if self.__started_lock.locked():
                         self.__started_lock.release()
+            succeeded = True
 
             # Start server
-            server.start()
+            with timer.phase(PHASE_SERVER_START):
+                server.start()
 
         except Exception as exc:
             self.__rfum.logger.exception("Error running update session")
-            self.__rfum.verbose("Restoring files")
-            self.__rfum.file_utilities.restore_all()
+            if entered:
+                self.__rfum.verbose("Restoring files")
+                with timer.phase(PHASE_RESTORE):
+                    self.__rfum.file_utilities.restore_all()
             if server.is_server_startup():
                 server.say(self.__rfum.rtr("session.error_occurred", str(exc)))
             if not server.is_server_running():
-                server.start()
+                with timer.phase(PHASE_SERVER_START):
+                    server.start()
         finally:
+            if stopped_at is not None:
+                timer.record(PHASE_DOWNTIME, PhaseTimer.now() - stopped_at)
+            if recorded:
+                history.record_timings(
+                    History.SessionTimings.create(
+                        timer.get_phases(),
+                        results,
+                        region_upstream_manager.get_current_upstream().name,
+                    )
+                )
+                self.__rfum.verbose(f"Session phase timings: {timer.get_phases()}")
+            if staging_thread is not None:
+                # On abort or error the staged files are discarded, stop extracting them
+                staging_cancel_event.set()
+                staging_thread.join()
+                region_upstream_manager.discard_staging()
             if self.started:
                 self.__started_lock.release()
             if acq:
                 self.__session_pending_lock.release()
             self.__waiting = False
             self.__aborted = True
+            self.__confirmed_at = None
             self.__scheduler = get_scheduler(BlockingScheduler)
-            self.__rfum.file_utilities.__exit__(*sys.exc_info())
+            if succeeded:
+                self.take_snapshot(results)
+            if entered:
+                self.__rfum.file_utilities.__exit__(*sys.exc_info())
+
+    def take_snapshot(self, results: Optional[List[FileExtractResult]]):
+        history = self.__rfum.history
+        if history.data is None:
+            return
+        try:
+            snapshot = self.__rfum.snapshot_store.take(history.data, results)
+        except Exception:
+            self.__rfum.logger.exception("Error keeping replaced files in snapshot")
+            return
+        if snapshot is not None:
+            history.record_snapshot(snapshot.snapshot_id)
 
     def register_event_listeners(self):
         self.__rfum.server.register_event_listener(
@@ -1,13 +1,33 @@
+import os
+import tempfile
 from abc import ABC, abstractmethod
 
-from typing import TYPE_CHECKING
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Tuple,
+    Optional,
+    Iterable,
+    Set,
+    Dict,
+    NamedTuple,
+    BinaryIO,
+    Callable,
+)
 from region_file_updater_multi.mcdr_globals import PathLike
+from region_file_updater_multi.utils.file_utils import RFUMFileNotFound
 
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
 
 
+class UpstreamFileReader(NamedTuple):
+    # Content size, None if unknown before reading
+    size: Optional[int]
+    open: Callable[[], BinaryIO]
+
+
 class AbstractUpstream(ABC):
     # Deprecated
     @classmethod
@@ -34,3 +54,97 @@ class AbstractUpstream(ABC):
         target_world_path: PathLike,
         enable_recycle: bool = True,
     ) -> None: ...
+
+    @property
+    def supports_batch_extraction(self) -> bool:
+        return False
+
+    def close(self):
+        """
+        Releases processes and connections held by upstream, called on plugin unload
+        """
+        pass
+
+    def get_local_file_path(self, file_name: PathLike) -> Optional[PathLike]:
+        """
+        Path of the file which can be read in place without extracting, None if not supported
+        """
+        return None
+
+    def get_existing_files(self, file_names: Iterable[PathLike]) -> Optional[Set[str]]:
+        """
+        Names of the files which upstream has among file_names, resolved in bulk
+        None if upstream can't tell without extracting them
+        """
+        file_names = list(file_names)
+        if len(file_names) == 0 or self.get_local_file_path(file_names[0]) is None:
+            return None
+        existing_files = set()
+        for file_name in file_names:
+            local_path = self.get_local_file_path(file_name)
+            if local_path is not None and os.path.isfile(local_path):
+                existing_files.add(str(file_name))
+        return existing_files
+
+    @staticmethod
+    def __get_file_opener(local_path: PathLike) -> Callable[[], BinaryIO]:
+        return lambda: open(local_path, "rb")
+
+    def get_file_readers(
+        self, file_names: Iterable[PathLike]
+    ) -> Optional[Dict[str, UpstreamFileReader]]:
+        """
+        Streams of the files which can be read without extracting, resolved in bulk
+        Missing files are left out, None if upstream doesn't support reading in place
+        """
+        file_names = list(file_names)
+        if len(file_names) == 0 or self.get_local_file_path(file_names[0]) is None:
+            return None
+        readers: Dict[str, UpstreamFileReader] = {}
+        for file_name in file_names:
+            local_path = self.get_local_file_path(file_name)
+            if local_path is None:
+                continue
+            try:
+                size = os.stat(local_path).st_size
+            except OSError:
+                continue
+            readers[str(file_name)] = UpstreamFileReader(
+                size, self.__get_file_opener(local_path)
+            )
+        return readers
+
+    def read_file_head(self, file_name: PathLike, size: int) -> Optional[bytes]:
+        """
+        First bytes of the file without touching the destination world, None if not found
+        Files which can't be read in place are extracted into a temporary directory
+        """
+        local_path = self.get_local_file_path(file_name)
+        if local_path is not None:
+            try:
+                with open(local_path, "rb") as f:
+                    return f.read(size)
+            except FileNotFoundError:
+                return None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                self.extract_file(file_name, temp_dir, enable_recycle=False)
+            except RFUMFileNotFound:
+                return None
+            with open(os.path.join(temp_dir, file_name), "rb") as f:
+                return f.read(size)
+
+    def extract_files(
+        self,
+        file_names: List[PathLike],
+        target_world_path: PathLike,
+    ) -> List[Tuple[PathLike, Optional[Exception]]]:
+        results: List[Tuple[PathLike, Optional[Exception]]] = []
+        for file_name in file_names:
+            try:
+                self.extract_file(file_name, target_world_path)
+            except Exception as exc:
+                results.append((file_name, exc))
+            else:
+                results.append((file_name, None))
+        return results
@@ -0,0 +1,411 @@
+import functools
+import gzip
+import lzma
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    List,
+    Tuple,
+    Dict,
+    Iterable,
+    NamedTuple,
+    BinaryIO,
+    Union,
+    Set,
+)
+
+from region_file_updater_multi.mcdr_globals import *
+from region_file_updater_multi.upstream.abstract_upstream import (
+    AbstractUpstream,
+    UpstreamFileReader,
+)
+from region_file_updater_multi.upstream.impl.pb_upstream import PrimeBackupFileNotFound
+
+if TYPE_CHECKING:
+    from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+
+
+class PrimeBackupDatabaseError(Exception):
+    pass
+
+
+class PrimeBackupBackupNotFound(PrimeBackupDatabaseError):
+    pass
+
+
+class PrimeBackupUnsupportedBlob(PrimeBackupDatabaseError):
+    pass
+
+
+class PrimeBackupBackupRow(NamedTuple):
+    id: int
+    fileset_ids: Tuple[int, ...]
+
+
+class PrimeBackupFileRow(NamedTuple):
+    path: str
+    mode: int
+    blob_hash: Optional[str]
+    blob_compress: Optional[str]
+    blob_raw_size: Optional[int]
+
+
+# prime_backup.db.values.FileRole
+_FILE_ROLE_DELTA_REMOVE = 4
+# prime_backup.db.values.BlobStorageMethod
+_BLOB_STORAGE_DIRECT = 1
+_SQLITE_MAX_VARIABLES = 500
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def get_path_in_backup(world_name: str, file_name: PathLike) -> str:
+    return "/".join([world_name, *str(file_name).replace("\\", "/").split("/")])
+
+
+class PrimeBackupDatabase:
+    """
+    Read-only access to a Prime Backup database file and its blob store
+
+    Supports both the fileset schema (PB >= 1.7) and the older per-backup file table
+    """
+
+    def __init__(self, db_path: PathLike):
+        self.__db_path = str(db_path)
+        self.__storage_root = os.path.dirname(os.path.abspath(self.__db_path))
+        self.__local = threading.local()
+        # Every connection opened by any thread, so close() can release all of them
+        self.__connections: List[sqlite3.Connection] = []
+        self.__connections_lock = threading.Lock()
+        self.__schema_lock = threading.Lock()
+        self.__file_columns: Optional[List[str]] = None
+        self.__blob_columns: Optional[List[str]] = None
+
+    @property
+    def db_path(self):
+        return self.__db_path
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads safely, keep one for each
+        conn = getattr(self.__local, "connection", None)
+        if conn is None:
+            uri = "file:{}?mode=ro".format(
+                os.path.abspath(self.__db_path).replace("?", "%3f").replace("#", "%23")
+            )
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            with self.__connections_lock:
+                self.__connections.append(conn)
+            self.__local.connection = conn
+        return conn
+
+    def close(self):
+        with self.__connections_lock:
+            connections, self.__connections = self.__connections, []
+        for conn in connections:
+            conn.close()
+        # Threads still holding a closed connection open a new one on next access
+        self.__local = threading.local()
+
+    def __get_columns(self, table: str) -> List[str]:
+        return [
+            row[1]
+            for row in self.connection.execute(f"PRAGMA table_info({table})").fetchall()
+        ]
+
+    def __ensure_schema(self):
+        with self.__schema_lock:
+            if self.__file_columns is None:
+                file_columns = self.__get_columns("file")
+                blob_columns = self.__get_columns("blob")
+                if len(file_columns) == 0 or len(self.__get_columns("backup")) == 0:
+                    raise PrimeBackupDatabaseError(
+                        f"{self.__db_path} is not a Prime Backup database"
+                    )
+                self.__file_columns, self.__blob_columns = file_columns, blob_columns
+        return self.__file_columns
+
+    @property
+    def is_fileset_schema(self):
+        return "fileset_id" in self.__ensure_schema()
+
+    def validate(self):
+        self.__ensure_schema()
+
+    def get_backup(self, backup_id: Union[int, str] = LATEST) -> PrimeBackupBackupRow:
+        if self.is_fileset_schema:
+            columns = "id, fileset_id_base, fileset_id_delta"
+        else:
+            columns = "id"
+        if backup_id == LATEST:
+            row = self.connection.execute(
+                f"SELECT {columns} FROM backup ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        else:
+            row = self.connection.execute(
+                f"SELECT {columns} FROM backup WHERE id = ?", (int(backup_id),)
+            ).fetchone()
+        if row is None:
+            raise PrimeBackupBackupNotFound(f"Backup {backup_id} not found")
+        if self.is_fileset_schema:
+            return PrimeBackupBackupRow(row[0], (row[1], row[2]))
+        return PrimeBackupBackupRow(row[0], ())
+
+    def get_files(
+        self, backup: PrimeBackupBackupRow, paths: Iterable[str]
+    ) -> Dict[str, PrimeBackupFileRow]:
+        """
+        Resolves the file entries of given paths in one backup, missing paths are not included
+        """
+        paths = list(dict.fromkeys(paths))
+        ret: Dict[str, PrimeBackupFileRow] = {}
+        columns = "path, mode, blob_hash, blob_compress, blob_raw_size"
+        for i in range(0, len(paths), _SQLITE_MAX_VARIABLES):
+            chunk = paths[i : i + _SQLITE_MAX_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            if self.is_fileset_schema:
+                base_id, delta_id = backup.fileset_ids
+                rows = self.connection.execute(
+                    f"SELECT {columns}, fileset_id, role FROM file "
+                    f"WHERE fileset_id IN (?, ?) AND path IN ({placeholders})",
+                    (base_id, delta_id, *chunk),
+                ).fetchall()
+                # Delta fileset entries override the base fileset ones
+                for row in sorted(rows, key=lambda r: r[5] == delta_id):
+                    if row[5] == delta_id and row[6] == _FILE_ROLE_DELTA_REMOVE:
+                        ret.pop(row[0], None)
+                    else:
+                        ret[row[0]] = PrimeBackupFileRow(*row[:5])
+            else:
+                rows = self.connection.execute(
+                    f"SELECT {columns} FROM file "
+                    f"WHERE backup_id = ? AND path IN ({placeholders})",
+                    (backup.id, *chunk),
+                ).fetchall()
+                for row in rows:
+                    ret[row[0]] = PrimeBackupFileRow(*row)
+        return ret
+
+    def get_file(
+        self, backup: PrimeBackupBackupRow, path: str
+    ) -> Optional[PrimeBackupFileRow]:
+        return self.get_files(backup, [path]).get(path)
+
+    def get_existing_files(
+        self,
+        backup: PrimeBackupBackupRow,
+        world_name: str,
+        file_names: Iterable[PathLike],
+    ) -> Set[str]:
+        """
+        Names of world files present in the backup, all resolved with a few queries
+        """
+        paths = {
+            get_path_in_backup(world_name, file_name): str(file_name)
+            for file_name in file_names
+        }
+        return {
+            paths[path]
+            for path, file_row in self.get_files(backup, paths.keys()).items()
+            if stat.S_ISREG(file_row.mode)
+        }
+
+    def get_blob_path(self, blob_hash: str):
+        return os.path.join(self.__storage_root, "blobs", blob_hash[:2], blob_hash)
+
+    def __assert_blob_direct(self, blob_hash: str):
+        self.__ensure_schema()
+        if self.__blob_columns is None or "storage_method" not in self.__blob_columns:
+            return
+        row = self.connection.execute(
+            "SELECT storage_method FROM blob WHERE hash = ?", (blob_hash,)
+        ).fetchone()
+        if row is not None and row[0] not in (None, _BLOB_STORAGE_DIRECT):
+            raise PrimeBackupUnsupportedBlob(
+                f"Blob {blob_hash} uses storage method {row[0]}, which is not supported"
+            )
+
+    def open_blob(self, file_row: PrimeBackupFileRow) -> BinaryIO:
+        if file_row.blob_hash is None:
+            raise PrimeBackupUnsupportedBlob(f"{file_row.path} has no blob")
+        self.__assert_blob_direct(file_row.blob_hash)
+        blob_path = self.get_blob_path(file_row.blob_hash)
+        compress = file_row.blob_compress or "plain"
+        if compress == "plain":
+            return open(blob_path, "rb")
+        if compress == "gzip":
+            return gzip.open(blob_path, "rb")  # type: ignore[return-value]
+        if compress == "lzma":
+            return lzma.open(blob_path, "rb")  # type: ignore[return-value]
+        if compress == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise PrimeBackupUnsupportedBlob(
+                    "Python module 'zstandard' is required to read zstd blobs"
+                )
+            return zstandard.ZstdDecompressor().stream_reader(
+                open(blob_path, "rb"), closefd=True
+            )
+        if compress == "lz4":
+            try:
+                import lz4.frame
+            except ImportError:
+                raise PrimeBackupUnsupportedBlob(
+                    "Python module 'lz4' is required to read lz4 blobs"
+                )
+            return lz4.frame.open(blob_path, "rb")
+        raise PrimeBackupUnsupportedBlob(f"Unknown compress method {compress}")
+
+    def extract(self, file_row: PrimeBackupFileRow, target_file_path: PathLike):
+        if not stat.S_ISREG(file_row.mode):
+            raise PrimeBackupUnsupportedBlob(f"{file_row.path} is not a regular file")
+        temp_file_path = str(target_file_path) + ".tmp"
+        with self.open_blob(file_row) as src, open(temp_file_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+            written = dst.tell()
+        if file_row.blob_raw_size is not None and written != file_row.blob_raw_size:
+            os.remove(temp_file_path)
+            raise PrimeBackupDatabaseError(
+                f"Size mismatched for {file_row.path}: expected {file_row.blob_raw_size}, got {written}"
+            )
+        os.replace(temp_file_path, target_file_path)
+        return written
+
+
+class PrimeBackupDatabaseUpstream(AbstractUpstream):
+    @classmethod
+    def assert_path_valid(cls, path: PathLike, rfum: "RegionFileUpdaterMulti"):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        if not os.path.isfile(path):
+            raise IsADirectoryError(path)
+        if not os.path.splitext(path)[1] == ".db":
+            raise ValueError("Not a db file path provided")
+        database = PrimeBackupDatabase(path)
+        try:
+            database.validate()
+        finally:
+            database.close()
+
+    @classmethod
+    def is_path_valid(cls, path: PathLike):
+        return os.path.isfile(path) and os.path.splitext(path)[1] == ".db"
+
+    def __init__(
+        self, rfum: "RegionFileUpdaterMulti", name: str, file_path: str, world_name: str
+    ):
+        self.__rfum = rfum
+        self.__name = name
+        self.__path = file_path
+        self.__world_name = world_name
+        self.__database = PrimeBackupDatabase(file_path)
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def database(self):
+        return self.__database
+
+    def close(self):
+        self.__database.close()
+
+    def get_path_in_backup(self, file_name: PathLike) -> str:
+        return get_path_in_backup(self.__world_name, file_name)
+
+    def __extract(
+        self,
+        backup: PrimeBackupBackupRow,
+        file_row: Optional[PrimeBackupFileRow],
+        file_name: PathLike,
+        target_world_path: PathLike,
+    ):
+        if file_row is None:
+            raise PrimeBackupFileNotFound(
+                f"File '{self.get_path_in_backup(file_name)}' in backup #{backup.id} does not exist"
+            )
+        target_file_path = os.path.join(target_world_path, file_name)
+        self.__rfum.file_utilities.safe_ensure_dir(os.path.dirname(target_file_path))
+        if os.path.exists(target_file_path):
+            self.__rfum.file_utilities.recycle(target_file_path)
+        size = self.__database.extract(file_row, target_file_path)
+        self.__rfum.verbose(
+            f"Extracted {file_row.path} ({size} bytes) from backup #{backup.id}"
+        )
+
+    def extract_file(
+        self,
+        file_name: PathLike,
+        target_world_path: PathLike,
+        enable_recycle: bool = True,
+    ) -> None:
+        backup = self.__database.get_backup(LATEST)
+        file_row = self.__database.get_file(backup, self.get_path_in_backup(file_name))
+        self.__extract(backup, file_row, file_name, target_world_path)
+
+    def get_existing_files(self, file_names: Iterable[PathLike]) -> Optional[Set[str]]:
+        return self.__database.get_existing_files(
+            self.__database.get_backup(LATEST), self.__world_name, file_names
+        )
+
+    def get_file_readers(
+        self, file_names: Iterable[PathLike]
+    ) -> Optional[Dict[str, UpstreamFileReader]]:
+        # Blob raw size is recorded, files of another size are known changed without reading
+        backup = self.__database.get_backup(LATEST)
+        paths = {
+            self.get_path_in_backup(file_name): str(file_name)
+            for file_name in file_names
+        }
+        return {
+            paths[path]: UpstreamFileReader(
+                file_row.blob_raw_size,
+                functools.partial(self.__database.open_blob, file_row),
+            )
+            for path, file_row in self.__database.get_files(backup, paths.keys()).items()
+            if stat.S_ISREG(file_row.mode)
+        }
+
+    def read_file_head(self, file_name: PathLike, size: int) -> Optional[bytes]:
+        # Blobs are decompressed as streams, only the head is read
+        backup = self.__database.get_backup(LATEST)
+        file_row = self.__database.get_file(backup, self.get_path_in_backup(file_name))
+        if file_row is None:
+            return None
+        with self.__database.open_blob(file_row) as f:
+            return f.read(size)
+
+    @property
+    def supports_batch_extraction(self) -> bool:
+        return True
+
+    def extract_files(
+        self,
+        file_names: List[PathLike],
+        target_world_path: PathLike,
+    ) -> List[Tuple[PathLike, Optional[Exception]]]:
+        # Resolve the backup once, so every file of the batch comes from the same backup
+        backup = self.__database.get_backup(LATEST)
+        file_rows = self.__database.get_files(
+            backup, [self.get_path_in_backup(file_name) for file_name in file_names]
+        )
+        results: List[Tuple[PathLike, Optional[Exception]]] = []
+        for file_name in file_names:
+            try:
+                self.__extract(
+                    backup,
+                    file_rows.get(self.get_path_in_backup(file_name)),
+                    file_name,
+                    target_world_path,
+                )
+            except Exception as exc:
+                results.append((file_name, exc))
+            else:
+                results.append((file_name, None))
+        return results
@@ -0,0 +1,78 @@
+"""
+Driver script executed by the Python interpreter configured for Prime Backup
+
+It imports the Prime Backup package once, then runs its CLI entry for every job
+so interpreter startup and zipimport are paid once for a whole update session
+
+Usage: python -c <PB_DRIVER_SCRIPT> <pb_path> <db_path> <backup_id> [serve]
+Jobs are passed through stdin as a JSON list of [path_in_backup, output_dir]
+With serve, every stdin line is a job list and a done marker follows each of them,
+the process keeps running until stdin is closed
+"""
+
+from typing import Optional, Tuple
+
+PB_DRIVER_MARKER = "[RFUMulti-PB-Driver]"
+PB_DRIVER_BEGIN = "begin"
+PB_DRIVER_END = "end"
+PB_DRIVER_DONE = "done"
+PB_DRIVER_SERVE = "serve"
+
+PB_DRIVER_SCRIPT = f"""
+import json
+import runpy
+import sys
+import traceback
+
+pb_path, db_path, backup_id = sys.argv[1:4]
+serve = sys.argv[4:5] == [{PB_DRIVER_SERVE!r}]
+sys.path.insert(0, pb_path)
+
+
+def emit(*args):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    print({PB_DRIVER_MARKER!r}, *args, flush=True)
+
+
+def run(jobs):
+    for index, (path, output) in enumerate(jobs):
+        emit({PB_DRIVER_BEGIN!r}, index)
+        sys.argv = [pb_path, "-d", db_path, "extract", backup_id, path, "-o", output]
+        code = 0
+        try:
+            runpy.run_path(pb_path, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        emit({PB_DRIVER_END!r}, index, code)
+
+
+if serve:
+    for line in sys.stdin:
+        run(json.loads(line))
+        emit({PB_DRIVER_DONE!r}, 0)
+else:
+    run(json.loads(sys.stdin.readline()))
+"""
+
+
+def parse_driver_marker(line: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Returns (event, job index, return code) for driver marker lines, None for PB output
+    """
+    if not line.startswith(PB_DRIVER_MARKER):
+        return None
+    args = line[len(PB_DRIVER_MARKER) :].split()
+    try:
+        event, index = args[0], int(args[1])
+        code = int(args[2]) if len(args) > 2 else 0
+    except (IndexError, ValueError):
+        return None
+    return event, index, code
@@ -0,0 +1,80 @@
+from string import Formatter
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+
+from parse import compile as compile_format, Parser
+
+from region_file_updater_multi.mcdr_globals import PrimeBackupLogParsingArguments
+
+
+def iter_lines(stream: IO[bytes], decoding: str) -> Iterator[str]:
+    """
+    Reads a buffered process output line by line until it's closed
+    """
+    for line_buf in stream:
+        yield line_buf.decode(decoding, errors="replace").strip()
+
+
+def get_longest_literal(fmt: str) -> str:
+    """
+    Longest constant text of a parse format, every matching line contains it
+    """
+    return max((literal for literal, *_ in Formatter().parse(fmt)), key=len, default="")
+
+
+class PrimeBackupLogParser:
+    """
+    Finds 'file not found' messages in Prime Backup output
+
+    Formats are compiled once, lines without the constant text of any message format
+    are skipped before parsing
+    """
+
+    def __init__(self, log_formats: Iterable[str], not_found_formats: Iterable[str]):
+        self.__log_parsers: List[Parser] = [compile_format(fmt) for fmt in log_formats]
+        not_found_formats = list(not_found_formats)
+        self.__not_found_parsers: List[Parser] = [
+            compile_format(fmt) for fmt in not_found_formats
+        ]
+        literals = [get_longest_literal(fmt) for fmt in not_found_formats]
+        # A format without any constant text could match anything
+        self.__literals: Optional[List[str]] = None if "" in literals else literals
+
+    @staticmethod
+    def __parse(
+        parsers: List[Parser],
+        text: str,
+        target_items: List[str],
+        allow_not_found: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        for parser in parsers:
+            result = parser.parse(text)
+            if result is None:
+                continue
+            items = {item: result.named.get(item) for item in target_items}
+            if any(value is None for value in items.values()) and not allow_not_found:
+                continue
+            if all(value is None for value in items.values()):
+                continue
+            return items
+        return None
+
+    def parse_not_found_line(self, line_text: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns file_name and backup_id of the missing file, None for other lines
+        """
+        if self.__literals is not None and not any(
+            literal in line_text for literal in self.__literals
+        ):
+            return None
+        msg_key = PrimeBackupLogParsingArguments.MSG.identifier
+        log_result = self.__parse(
+            self.__log_parsers, line_text, [msg_key], allow_not_found=False
+        )
+        if log_result is None:
+            return None
+        # Target text: File 'world/level.data' in backup #4 does not exist
+        return self.__parse(
+            self.__not_found_parsers,
+            log_result[msg_key].strip(),
+            ["file_name", "backup_id"],
+        )
@@ -1,20 +1,42 @@
 import json
 import os
+import sqlite3
+import threading
 from subprocess import Popen, STDOUT, PIPE, SubprocessError
-from typing import TYPE_CHECKING, Optional, Any, List, Union
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    Any,
+    List,
+    Union,
+    Dict,
+    Tuple,
+    Iterable,
+    Set,
+)
 from zipfile import ZipFile
 
-import psutil
 from mcdreforged.api.types import Metadata, VersionRequirement
-from parse import parse
 
 from region_file_updater_multi.mcdr_globals import *
 from region_file_updater_multi.upstream.abstract_upstream import AbstractUpstream
+from region_file_updater_multi.upstream.impl.pb_driver import (
+    PB_DRIVER_SCRIPT,
+    PB_DRIVER_BEGIN,
+    PB_DRIVER_END,
+    PB_DRIVER_SERVE,
+    parse_driver_marker,
+)
+from region_file_updater_multi.upstream.impl.pb_worker import PrimeBackupWorkerPool
+from region_file_updater_multi.upstream.impl.pb_log_parser import iter_lines
 from region_file_updater_multi.utils.file_utils import RFUMFileNotFound
 from region_file_updater_multi.utils.logging import get_pb_logger
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+    from region_file_updater_multi.upstream.impl.pb_db_upstream import (
+        PrimeBackupDatabase,
+    )
 
 
 _NONE = object()
@@ -100,34 +122,58 @@ class PrimeBackupUpstream(AbstractUpstream):
         self.__name = name
         self.__path = file_path
         self.__world_name = world_name
+        self.__database: Optional["PrimeBackupDatabase"] = None
+        self.__worker_pool: Optional[PrimeBackupWorkerPool] = None
+        self.__worker_pool_lock = threading.Lock()
 
     @property
     def name(self):
         return self.__name
 
-    def parse_log_line(
-        self,
-        patterns: List[str],
-        text: str,
-        target_items: List[str],
-        allow_not_found: bool = True,
-    ):
-        for p in patterns:
-            result = parse(p, text)
-            if result is not None:
-                return_items = {}
-                for item in target_items:
-                    return_items[item] = result.named.get(item)
-                if (
-                    any([i is None for i in return_items.values()])
-                    and not allow_not_found
-                ):
-                    continue
-                if not any([i is not None for i in return_items.values()]):
-                    continue
-                return return_items
-            self.__rfum.verbose(f"Not matched: {p}")
-        return None
+    def get_existing_files(self, file_names: Iterable[PathLike]) -> Optional[Set[str]]:
+        # Imported here as pb_db_upstream depends on this module
+        from region_file_updater_multi.upstream.impl.pb_db_upstream import (
+            PrimeBackupDatabase,
+            PrimeBackupDatabaseError,
+        )
+
+        # The database is only read, extraction still goes through Prime Backup CLI
+        if self.__database is None:
+            self.__database = PrimeBackupDatabase(self.__path)
+        try:
+            return self.__database.get_existing_files(
+                self.__database.get_backup(LATEST), self.__world_name, file_names
+            )
+        except (PrimeBackupDatabaseError, sqlite3.Error) as exc:
+            self.__rfum.verbose(
+                f"Can't query files from {self.__path} directly, fallback to extraction: {exc}"
+            )
+            return None
+
+    def get_decoding(self):
+        return self.__rfum.config_snapshot.popen_decoding
+
+    def get_logger(self):
+        return get_pb_logger(
+            self.__rfum.server,
+            os.path.join(self.__rfum.get_data_folder(), CLI_STDOUT_LOG_FILE),
+        )
+
+    def parse_not_found_line(self, line_text: str) -> Optional[Dict[str, Any]]:
+        result = self.__rfum.config_snapshot.pb_log_parser.parse_not_found_line(
+            line_text
+        )
+        if result is not None:
+            self.__rfum.verbose(f"Parsed content: {result}")
+        return result
+
+    def __prepare_target(self, file_name: PathLike, target_world_path: PathLike):
+        target_file_path = os.path.join(target_world_path, file_name)
+        target_dir_path = os.path.dirname(target_file_path)
+        self.__rfum.file_utilities.safe_ensure_dir(target_dir_path)
+        if os.path.exists(target_file_path):
+            self.__rfum.file_utilities.recycle(target_file_path)
+        return target_file_path, target_dir_path
 
     def extract_file(
         self,
@@ -139,85 +185,176 @@ class PrimeBackupUpstream(AbstractUpstream):
             raise RuntimeError(
                 "Cannot invoke extract_file() on the task executor thread"
             )
-        config = self.__rfum.config
-        logger = get_pb_logger(
-            self.__rfum.server,
-            os.path.join(self.__rfum.get_data_folder(), CLI_STDOUT_LOG_FILE),
-        )
-        target_file_path = os.path.join(target_world_path, file_name)
-        target_dir_path = os.path.dirname(target_file_path)
-        self.__rfum.file_utilities.safe_ensure_dir(target_dir_path)
-        if os.path.exists(target_file_path):
-            self.__rfum.file_utilities.recycle(target_file_path)
-        decoding = (
-            self.__rfum.config.get_popen_decoding()
-            or self.__rfum.server.get_mcdr_config().get(MCDR_CFG_DECODING_KEY)
-            or "utf8"
+        if self.__get_worker_pool() is not None:
+            _, error = self.extract_files([file_name], target_world_path)[0]
+            if error is not None:
+                raise error
+            return
+        snapshot = self.__rfum.config_snapshot
+        logger = self.get_logger()
+        target_file_path, target_dir_path = self.__prepare_target(
+            file_name, target_world_path
         )
+        decoding = snapshot.popen_decoding
         command = [
-            config.get_python_executable(),
+            snapshot.python_executable,
             "-X",
             decoding,
             self.get_pb_path(self.__rfum),
             "-d",
             self.__path,
             "extract",
-            "latest",
+            LATEST,
             os.path.join(self.__world_name, file_name),
             "-o",
             target_dir_path,
         ]
         with Popen(command, stderr=STDOUT, stdout=PIPE, stdin=PIPE) as process:
+            assert process.stdout is not None
             self.__rfum.verbose(f'Process started: {" ".join(command)}')
-            decoding = (
-                self.__rfum.config.get_popen_decoding()
-                or self.__rfum.server.get_mcdr_config().get(MCDR_CFG_DECODING_KEY)
-                or "utf8"
-            )
-            num = 0
-            log_fmt = self.__rfum.config.get_pb_log_format()
-            msg_fmt = self.__rfum.config.update_operation.prime_backup_file_not_found_log_format
-            self.__rfum.verbose(f"Current parsing fmt: {log_fmt}")
-            result = None
-            while psutil.pid_exists(process.pid):
-                num += 1
-                if process.stdout is None:
-                    continue
-                try:
-                    line_buf = next(iter(process.stdout))
-                except StopIteration:
-                    break
-                else:
-                    line_text = line_buf.decode(decoding).strip()
-                    logger.info(line_text)
-                    if result is None:
-                        step_1_result = self.parse_log_line(
-                            log_fmt,
-                            line_text,
-                            [PrimeBackupLogParsingArguments.MSG.identifier],
-                            allow_not_found=False,
-                        )
-                        if step_1_result is None:
-                            continue
-                        msg = step_1_result[PrimeBackupLogParsingArguments.MSG.identifier]
-                        self.__rfum.verbose(f"Parsed message: {msg}")
-                        # Target text: File 'world/level.data' in backup #4 does not exist
-                        file_name_name = "file_name"
-                        backup_id_name = "backup_id"
-                        result = self.parse_log_line(
-                            msg_fmt,
-                            msg.strip(),
-                            [file_name_name, backup_id_name],
-                            allow_not_found=True,
-                        )
-                        self.__rfum.verbose(f"Parsed content: {result}")
-                        if result is not None:
-                            raise PrimeBackupFileNotFound(result.get(file_name_name))
+            for line_text in iter_lines(process.stdout, decoding):
+                logger.info(line_text)
+                result = self.parse_not_found_line(line_text)
+                if result is not None:
+                    raise PrimeBackupFileNotFound(result.get("file_name"))
 
-        process.wait(self.__rfum.config.get_popen_terminate_timeout())
+        process.wait(snapshot.popen_terminate_timeout)
         if process.returncode != 0:
             raise PrimeBackupProcessError(f"Prime Backup returned {process.returncode}")
         if not os.path.isfile(target_file_path):
             raise PrimeBackupFileNotFound(
                 "File not found after Prime Backup normal exits"
             )
+
+    @property
+    def supports_batch_extraction(self) -> bool:
+        return (
+            self.__rfum.config_snapshot.pb_batch_extraction
+            or self.__get_worker_pool() is not None
+        )
+
+    def close(self):
+        with self.__worker_pool_lock:
+            worker_pool, self.__worker_pool = self.__worker_pool, None
+        if worker_pool is not None:
+            worker_pool.shutdown()
+        if self.__database is not None:
+            self.__database.close()
+
+    def __get_worker_pool(self) -> Optional[PrimeBackupWorkerPool]:
+        size = self.__rfum.config_snapshot.pb_worker_processes
+        if size <= 0:
+            return None
+        with self.__worker_pool_lock:
+            if self.__worker_pool is None:
+                self.__worker_pool = PrimeBackupWorkerPool(
+                    self.__rfum,
+                    self.__get_driver_command(serve=True),
+                    self.get_decoding(),
+                    size,
+                )
+            return self.__worker_pool
+
+    def __get_driver_command(self, serve: bool = False):
+        snapshot = self.__rfum.config_snapshot
+        command = [
+            snapshot.python_executable,
+            "-X",
+            snapshot.popen_decoding,
+            "-u",
+            "-c",
+            PB_DRIVER_SCRIPT,
+            self.get_pb_path(self.__rfum),
+            self.__path,
+            LATEST,
+        ]
+        if serve:
+            command.append(PB_DRIVER_SERVE)
+        return command
+
+    def __read_driver_output(
+        self, lines: Iterable[str], logger
+    ) -> Dict[int, Optional[Exception]]:
+        job_errors: Dict[int, Optional[Exception]] = {}
+        current_error: Optional[Exception] = None
+        for line_text in lines:
+            marker = parse_driver_marker(line_text)
+            if marker is None:
+                logger.info(line_text)
+                if current_error is None:
+                    result = self.parse_not_found_line(line_text)
+                    if result is not None:
+                        current_error = PrimeBackupFileNotFound(
+                            result.get("file_name")
+                        )
+                continue
+            event, index, code = marker
+            if event == PB_DRIVER_BEGIN:
+                current_error = None
+            elif event == PB_DRIVER_END:
+                if current_error is None and code != 0:
+                    current_error = PrimeBackupProcessError(
+                        f"Prime Backup returned {code}"
+                    )
+                job_errors[index] = current_error
+                current_error = None
+        return job_errors
+
+    def extract_files(
+        self,
+        file_names: List[PathLike],
+        target_world_path: PathLike,
+    ) -> List[Tuple[PathLike, Optional[Exception]]]:
+        worker_pool = self.__get_worker_pool()
+        if worker_pool is None and (
+            not self.supports_batch_extraction or len(file_names) <= 1
+        ):
+            return super().extract_files(file_names, target_world_path)
+        if self.__rfum.server.is_on_executor_thread():
+            raise RuntimeError(
+                "Cannot invoke extract_files() on the task executor thread"
+            )
+        logger = self.get_logger()
+        target_file_paths, jobs = [], []
+        for file_name in file_names:
+            target_file_path, target_dir_path = self.__prepare_target(
+                file_name, target_world_path
+            )
+            target_file_paths.append(target_file_path)
+            jobs.append(
+                [os.path.join(self.__world_name, file_name), str(target_dir_path)]
+            )
+        if worker_pool is not None:
+            with worker_pool.worker() as worker:
+                self.__rfum.verbose(
+                    f"Sending {len(jobs)} files to Prime Backup worker {worker.pid}"
+                )
+                job_errors = self.__read_driver_output(worker.submit(jobs), logger)
+            exit_text = "Prime Backup worker exited before extracting"
+        else:
+            command = self.__get_driver_command()
+            with Popen(command, stderr=STDOUT, stdout=PIPE, stdin=PIPE) as process:
+                assert process.stdin is not None and process.stdout is not None
+                self.__rfum.verbose(
+                    f"Batch process started for {len(jobs)} files: {command[0]} {command[-3:]}"
+                )
+                process.stdin.write((json.dumps(jobs) + "\n").encode("utf8"))
+                process.stdin.close()
+                job_errors = self.__read_driver_output(
+                    iter_lines(process.stdout, self.get_decoding()), logger
+                )
+            process.wait(self.__rfum.config_snapshot.popen_terminate_timeout)
+            exit_text = f"Prime Backup batch process exited with {process.returncode} before extracting"
+
+        results: List[Tuple[PathLike, Optional[Exception]]] = []
+        for index, file_name in enumerate(file_names):
+            if index not in job_errors:
+                error: Optional[Exception] = PrimeBackupProcessError(exit_text)
+            else:
+                error = job_errors[index]
+            if error is None and not os.path.isfile(target_file_paths[index]):
+                error = PrimeBackupFileNotFound(
+                    "File not found after Prime Backup normal exits"
+                )
+            results.append((file_name, error))
+        return results
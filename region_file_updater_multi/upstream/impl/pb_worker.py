@@ -0,0 +1,148 @@
+import json
+import threading
+from contextlib import contextmanager
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+from typing import TYPE_CHECKING, List, Iterator, Optional
+
+from region_file_updater_multi.upstream.impl.pb_driver import (
+    PB_DRIVER_DONE,
+    parse_driver_marker,
+)
+from region_file_updater_multi.upstream.impl.pb_log_parser import iter_lines
+
+if TYPE_CHECKING:
+    from region_file_updater_multi.rfum import RegionFileUpdaterMulti
+
+
+class PrimeBackupWorker:
+    """
+    A driver process in serve mode, it handles job lists one after another until stdin is closed
+    """
+
+    def __init__(self, command: List[str], decoding: str):
+        self.__process = Popen(command, stderr=STDOUT, stdout=PIPE, stdin=PIPE)
+        assert self.__process.stdin is not None and self.__process.stdout is not None
+        self.__stdin, self.__stdout = self.__process.stdin, self.__process.stdout
+        self.__lines = iter_lines(self.__stdout, decoding)
+        # Output of a job list is not fully read, the worker can't take another one
+        self.__pending = False
+
+    @property
+    def pid(self):
+        return self.__process.pid
+
+    @property
+    def alive(self):
+        return self.__process.poll() is None
+
+    @property
+    def reusable(self):
+        return self.alive and not self.__pending
+
+    def submit(self, jobs: List[List[str]]) -> Iterator[str]:
+        """
+        Yields output lines until the worker finishes these jobs or exits
+        """
+        self.__pending = True
+        self.__stdin.write((json.dumps(jobs) + "\n").encode("utf8"))
+        self.__stdin.flush()
+        for line_text in self.__lines:
+            marker = parse_driver_marker(line_text)
+            if marker is not None and marker[0] == PB_DRIVER_DONE:
+                self.__pending = False
+                return
+            yield line_text
+
+    def stop(self, timeout: float):
+        try:
+            self.__stdin.close()
+        except OSError:
+            pass
+        try:
+            self.__process.wait(timeout)
+        except TimeoutExpired:
+            self.__process.kill()
+            self.__process.wait()
+        self.__stdout.close()
+
+
+class PrimeBackupWorkerPool:
+    """
+    Keeps at most size workers alive, they are started when needed
+
+    Workers that crashed or were left with unread output are dropped on release,
+    a new one is started for the next job list
+    """
+
+    def __init__(
+        self,
+        rfum: "RegionFileUpdaterMulti",
+        command: List[str],
+        decoding: str,
+        size: int,
+    ):
+        self.__rfum = rfum
+        self.__command = command
+        self.__decoding = decoding
+        self.__size = max(size, 1)
+        self.__condition = threading.Condition()
+        self.__idle: List[PrimeBackupWorker] = []
+        self.__count = 0
+        self.__closed = False
+
+    def __acquire(self) -> Optional[PrimeBackupWorker]:
+        """
+        Returns an idle worker, or None when a new one should be started
+        """
+        with self.__condition:
+            while True:
+                if self.__closed:
+                    raise RuntimeError("Prime Backup worker pool is shut down")
+                while len(self.__idle) > 0:
+                    worker = self.__idle.pop()
+                    if worker.alive:
+                        return worker
+                    self.__count -= 1
+                    worker.stop(0)
+                    self.__rfum.verbose(f"Prime Backup worker {worker.pid} exited")
+                if self.__count < self.__size:
+                    self.__count += 1
+                    return None
+                self.__condition.wait()
+
+    @contextmanager
+    def worker(self):
+        worker = self.__acquire()
+        if worker is None:
+            try:
+                worker = PrimeBackupWorker(self.__command, self.__decoding)
+            except BaseException:
+                with self.__condition:
+                    self.__count -= 1
+                    self.__condition.notify()
+                raise
+            self.__rfum.verbose(f"Prime Backup worker {worker.pid} started")
+        try:
+            yield worker
+        finally:
+            with self.__condition:
+                keep = worker.reusable and not self.__closed
+                if keep:
+                    self.__idle.append(worker)
+                else:
+                    self.__count -= 1
+                self.__condition.notify()
+            if not keep:
+                self.__rfum.verbose(f"Prime Backup worker {worker.pid} dropped")
+                worker.stop(self.__rfum.config_snapshot.popen_terminate_timeout)
+
+    def shutdown(self):
+        with self.__condition:
+            self.__closed = True
+            workers, self.__idle = self.__idle, []
+            self.__count -= len(workers)
+            self.__condition.notify_all()
+        for worker in workers:
+            worker.stop(self.__rfum.config_snapshot.popen_terminate_timeout)
+        if len(workers) > 0:
+            self.__rfum.verbose(f"Stopped {len(workers)} Prime Backup workers")
@@ -35,6 +35,9 @@ class WorldSaveUpstream(AbstractUpstream):
     def name(self):
         return self.__name
 
+    def get_local_file_path(self, file_name: PathLike) -> PathLike:
+        return os.path.join(self.__path, self.__world_name, file_name)
+
     def extract_file(
         self,
         file_name: PathLike,
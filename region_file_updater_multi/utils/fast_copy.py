@@ -0,0 +1,181 @@
+import enum
+import errno
+import os
+import shutil
+import sys
+import time
+from typing import NamedTuple, Optional, Iterable, Callable, Dict
+
+from region_file_updater_multi.mcdr_globals import PathLike
+from region_file_updater_multi.utils.units import ByteCount
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+_CHUNK_SIZE = 64 * 1024 * 1024
+# Errors meaning "this strategy can't be used for these two files", try the next one
+_UNSUPPORTED_ERRNO = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+    errno.EPERM,
+}
+
+
+class CopyStrategy(enum.Enum):
+    reflink = "reflink"
+    copy_file_range = "copy_file_range"
+    sendfile = "sendfile"
+    fallback = "fallback"
+
+
+class CopyResult(NamedTuple):
+    strategy: Optional[CopyStrategy]
+    size: int
+    time_cost: float
+
+    @property
+    def speed(self) -> float:
+        if self.time_cost <= 0:
+            return float("inf") if self.size > 0 else 0.0
+        return self.size / self.time_cost
+
+    def __str__(self):
+        strategy = "mixed" if self.strategy is None else self.strategy.value
+        speed = self.speed
+        speed_str = "inf" if speed == float("inf") else ByteCount(speed).auto_str()
+        return f"{strategy}, {ByteCount(self.size).auto_str()} in {round(self.time_cost * 1000, 2)}ms, {speed_str}/s"
+
+    def merge(self, other: "CopyResult") -> "CopyResult":
+        return CopyResult(
+            self.strategy if self.strategy == other.strategy else None,
+            self.size + other.size,
+            self.time_cost + other.time_cost,
+        )
+
+
+class _StrategyUnsupported(Exception):
+    pass
+
+
+def _is_unsupported(exc: OSError):
+    return exc.errno in _UNSUPPORTED_ERRNO
+
+
+def _copy_reflink(src_fd: int, dst_fd: int, size: int):
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise _StrategyUnsupported
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as exc:
+        if _is_unsupported(exc):
+            raise _StrategyUnsupported
+        raise
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int):
+    if not hasattr(os, "copy_file_range"):
+        raise _StrategyUnsupported
+    offset = 0
+    while offset < size:
+        try:
+            copied = os.copy_file_range(
+                src_fd, dst_fd, min(_CHUNK_SIZE, size - offset), offset, offset
+            )
+        except OSError as exc:
+            if offset == 0 and _is_unsupported(exc):
+                raise _StrategyUnsupported
+            raise
+        if copied == 0:
+            # Some filesystems report success without copying anything
+            if offset == 0:
+                raise _StrategyUnsupported
+            break
+        offset += copied
+
+
+def _copy_sendfile(src_fd: int, dst_fd: int, size: int):
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        raise _StrategyUnsupported
+    offset = 0
+    while offset < size:
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            sent = os.sendfile(dst_fd, src_fd, offset, min(_CHUNK_SIZE, size - offset))
+        except OSError as exc:
+            if offset == 0 and _is_unsupported(exc):
+                raise _StrategyUnsupported
+            raise
+        if sent == 0:
+            if offset == 0:
+                raise _StrategyUnsupported
+            break
+        offset += sent
+
+
+def _copy_fallback(src_fd: int, dst_fd: int, size: int):
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    with open(src_fd, "rb", closefd=False) as src, open(
+        dst_fd, "wb", closefd=False
+    ) as dst:
+        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+
+
+_STRATEGY_FUNCTIONS: Dict[CopyStrategy, Callable[[int, int, int], None]] = {
+    CopyStrategy.reflink: _copy_reflink,
+    CopyStrategy.copy_file_range: _copy_file_range,
+    CopyStrategy.sendfile: _copy_sendfile,
+    CopyStrategy.fallback: _copy_fallback,
+}
+
+
+def get_strategies(names: Optional[Iterable[str]] = None):
+    """
+    Strategies in the order they are tried, fallback is always the last resort
+    """
+    if names is None:
+        return list(CopyStrategy)
+    strategies = [CopyStrategy(name) for name in names]
+    if CopyStrategy.fallback not in strategies:
+        strategies.append(CopyStrategy.fallback)
+    return strategies
+
+
+def fast_copy_file(
+    src: PathLike, dst: PathLike, strategies: Optional[Iterable[CopyStrategy]] = None
+) -> CopyResult:
+    """
+    Copies file content and metadata like shutil.copy2 does
+
+    Tries reflink first, which shares extents on CoW filesystems (btrfs, XFS with reflink)
+    then in-kernel copies, then the plain user space copy
+    """
+    start = time.perf_counter()
+    size = os.stat(src).st_size
+    used: Optional[CopyStrategy] = None
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+        for strategy in strategies or get_strategies():
+            try:
+                _STRATEGY_FUNCTIONS[strategy](src_fd, dst_fd, size)
+            except _StrategyUnsupported:
+                os.ftruncate(dst_fd, 0)
+                continue
+            used = strategy
+            break
+        if used is None:
+            # Only reachable with a strategy list without fallback passed in directly
+            _copy_fallback(src_fd, dst_fd, size)
+            used = CopyStrategy.fallback
+    shutil.copystat(src, dst)
+    return CopyResult(used, size, time.perf_counter() - start)
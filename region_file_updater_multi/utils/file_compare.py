@@ -0,0 +1,47 @@
+import os
+from typing import BinaryIO, Callable, NamedTuple, Optional
+
+from region_file_updater_multi.mcdr_globals import PathLike
+from region_file_updater_multi.utils.mca import MCA_SUFFIX, HEADER_SIZE
+
+_COMPARE_BUFFER_SIZE = 1024 * 1024
+
+
+class FileFingerprint(NamedTuple):
+    """
+    Changes whenever the file is rewritten or modified in place
+    """
+
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def of(cls, path: PathLike) -> Optional["FileFingerprint"]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return cls(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def is_same_stream(opener: Callable[[], BinaryIO], path: PathLike) -> bool:
+    """
+    Compares a stream with a file, sizes should have been checked by the caller
+    Location and timestamp header of region files is compared first, then both are
+    compared block by block, stopping at the first difference
+    """
+    try:
+        with opener() as f1, open(path, "rb") as f2:
+            if str(path).endswith(MCA_SUFFIX):
+                if f1.read(HEADER_SIZE) != f2.read(HEADER_SIZE):
+                    return False
+            while True:
+                block_1 = f1.read(_COMPARE_BUFFER_SIZE)
+                block_2 = f2.read(_COMPARE_BUFFER_SIZE)
+                if block_1 != block_2:
+                    return False
+                if not block_1:
+                    return True
+    except OSError:
+        return False
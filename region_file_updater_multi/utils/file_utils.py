@@ -1,3 +1,4 @@
+import errno
 import json
 import os.path
 import shutil
@@ -6,11 +7,26 @@ import time
 from contextlib import contextmanager
 from pathlib import Path
 from zipfile import ZipFile
-from typing import TYPE_CHECKING, Optional, List
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+)
 
 from mcdreforged.api.utils import deserialize, serialize, Serializable
 
 from region_file_updater_multi.mcdr_globals import *
+from region_file_updater_multi.utils.fast_copy import (
+    CopyResult,
+    CopyStrategy,
+    fast_copy_file,
+)
 
 if TYPE_CHECKING:
     from region_file_updater_multi.rfum import RegionFileUpdaterMulti
@@ -24,6 +40,10 @@ class RFUMMetaSavingFailed(Exception):
     pass
 
 
+class RFUMInterruptedSessionFound(Exception):
+    pass
+
+
 class RecycledFile:
     class Metadata(Serializable):
         original_file_path: str
@@ -39,87 +59,60 @@ class RecycledFile:
         self,
         path_in_bin: str,
         rfum: "RegionFileUpdaterMulti",
+        metadata: "RecycledFile.Metadata",
         lock: Optional[threading.RLock] = None,
+        on_closed: Optional[Callable[[str, "RecycledFile"], Any]] = None,
     ):
         self.__rfum = rfum
         self.__slot_path = path_in_bin
-        self.__meta: Optional[RecycledFile.Metadata] = None
+        self.__meta = metadata
         self.__lock = lock or threading.RLock()
-        self.load_metadata()
+        # Called with the operation after the file leaves recycle bin
+        self.__on_closed = on_closed
 
-    def load_metadata(self):
-        with self.__lock:
-            if not os.path.isfile(self.meta_path):
-                return False
-            try:
-                with open(self.meta_path, "r", encoding="utf8") as f:
-                    raw = json.load(f)
-                    self.__rfum.verbose(f"Loading metadata: {raw}")
-                    self.__meta = deserialize(raw, self.Metadata)
-            except Exception as e:
-                self.__rfum.verbose(f"[{e.__class__.__name__}] {str(e)}")
-                self.__meta = None
-            return self.__meta is not None
+    @property
+    def slot_name(self) -> str:
+        return os.path.basename(self.__slot_path)
+
+    @property
+    def metadata(self) -> "RecycledFile.Metadata":
+        return self.__meta
 
     @property
     def is_available(self):
-        return all(
-            [
-                os.path.isdir(self.__slot_path),
-                self.load_metadata(),
-                os.path.exists(self.file_path),
-            ]
-        )
+        return os.path.exists(self.file_path)
 
     @property
     def path_in_bin(self) -> Path:
         return Path(self.__slot_path)
 
-    @property
-    def meta_path(self) -> Path:
-        return Path(os.path.join(self.__slot_path, RECYCLED_FILE_META))
-
     @property
     def file_path(self):
         return os.path.join(self.__slot_path, RECYCLED_FILE_NAME)
 
     @property
-    def original_path(self) -> Optional[Path]:
-        if self.__meta is None:
-            return None
+    def original_path(self) -> Path:
         return Path(self.__meta.original_file_path)
 
     @property
     def delete_time(self):
-        if self.__meta is None:
-            return None
         return self.__meta.delete_time
 
-    def save_metadata(self, metadata: Optional["Metadata"] = None):
-        with self.__lock:
-            if metadata is not None:
-                self.__meta = metadata
-            try:
-                with open(self.meta_path, "w", encoding="utf8") as f:
-                    serialized = serialize(metadata)
-                    self.__rfum.verbose(f"Saving metadata: {serialized}")
-                    json.dump(serialized, f, ensure_ascii=False, indent=4)
-            except Exception as e:
-                self.__rfum.verbose(f"[{e.__class__.__name__}] {str(e)}")
-                self.__meta = None
-                return False
-            return True
+    def __closed(self, operation: str):
+        if self.__on_closed is not None:
+            self.__on_closed(operation, self)
 
     def restore(self):
         with self.__lock:
             if not self.is_available:
-                raise RFUMFileNotFound("Metadata not found")
+                raise RFUMFileNotFound(self.file_path)
             self.__rfum.verbose(f"Restoring deleted file with metadata {self.__meta}")
             if os.path.isfile(self.original_path):
                 os.remove(self.original_path)
             if os.path.isdir(self.original_path):
                 os.removedirs(self.original_path)
             shutil.move(self.file_path, self.original_path)
+            self.__closed(RecycleJournalOperation.restore)
 
     def delete(self):
         with self.__lock:
@@ -128,75 +121,285 @@ class RecycledFile:
             )
             if os.path.isdir(self.__slot_path):
                 shutil.rmtree(self.__slot_path)
+            self.__closed(RecycleJournalOperation.delete)
 
     def __lt__(self, other: "RecycledFile"):
         return self.delete_time < other.delete_time
 
 
+class RecycleJournalOperation:
+    begin = "begin"
+    recycle = "recycle"
+    restore = "restore"
+    delete = "delete"
+
+
+class InterruptedSession(NamedTuple):
+    begin_time: float
+    files: List[RecycledFile]
+
+
 class FileUtils:
+    """
+    Recycle bin holds files replaced in one update session, it's emptied when the session ends
+
+    Every change of recycle bin is appended to a journal inside it, which is synced at batch
+    boundaries. A journal left on disk means the last session was interrupted, its recycled
+    files are found by replaying the journal instead of scanning the slots
+    """
+
     def __init__(self, recycle_bin_path: str, rfum: "RegionFileUpdaterMulti"):
         self.__rfum = rfum
         self.__lock = threading.RLock()
         self.__internal_count = 0
+        self.__index: Dict[str, RecycledFile] = {}
+        # Normalized original path -> files recycled from it, oldest first
+        self.__original_index: Dict[str, List[RecycledFile]] = {}
+        self.__journal: Optional[IO[str]] = None
+        self.__interrupted: Optional[InterruptedSession] = None
         self.__path = self.ensure_dir(recycle_bin_path)
+        self.__load_journal()
+
+    @property
+    def recycle_bin_path(self) -> str:
+        return self.__path
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.__path, RECYCLE_JOURNAL_FILE)
+
+    @property
+    def interrupted_session(self) -> Optional[InterruptedSession]:
+        """
+        Session found in the journal on load, whose recycled files were never restored or emptied
+        """
+        return self.__interrupted
+
+    def set_recycle_bin_path(self, recycle_bin_path: str):
+        with self.__lock:
+            if os.path.abspath(recycle_bin_path) == os.path.abspath(self.__path):
+                return
+            self.__rfum.verbose(f"Recycle bin path set to {recycle_bin_path}")
+            self.__close_journal()
+            self.__path = self.ensure_dir(recycle_bin_path)
+            self.__internal_count = 0
+            self.__load_journal()
+
+    def __load_journal(self):
+        """
+        Replays the journal to rebuild the index, a torn last line is ignored
+        """
+        with self.__lock:
+            self.__index = {}
+            self.__original_index = {}
+            self.__interrupted = None
+            if not os.path.isfile(self.journal_path):
+                return
+            begin_time: Optional[float] = None
+            with open(self.journal_path, "r", encoding="utf8") as f:
+                for line in f:
+                    try:
+                        entry: Dict[str, Any] = json.loads(line)
+                    except ValueError:
+                        self.__rfum.verbose(f"Skipped broken journal line: {line!r}")
+                        continue
+                    operation, slot = entry.get("op"), entry.get("slot")
+                    if operation == RecycleJournalOperation.begin:
+                        begin_time = entry.get("time")
+                    elif operation == RecycleJournalOperation.recycle:
+                        self.__add_to_index(
+                            self.__create_recycled_file(
+                                slot,
+                                deserialize(entry.get("meta"), RecycledFile.Metadata),
+                            )
+                        )
+                    elif slot in self.__index:
+                        self.__remove_from_index(self.__index[slot])
+            files = self.get_recycled_files()
+            self.__rfum.verbose(
+                f"Replayed recycle journal {self.journal_path}: {len(files)} files"
+            )
+            if len(files) > 0:
+                self.__interrupted = InterruptedSession(
+                    begin_time=begin_time or min(item.delete_time for item in files),
+                    files=files,
+                )
+
+    def __create_recycled_file(self, slot: str, metadata: RecycledFile.Metadata):
+        return RecycledFile(
+            os.path.join(self.__path, slot),
+            self.__rfum,
+            metadata,
+            self.__lock,
+            self.__on_recycled_file_closed,
+        )
+
+    @staticmethod
+    def __get_index_key(path: PathLike) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def __add_to_index(self, recycled_file: RecycledFile):
+        self.__index[recycled_file.slot_name] = recycled_file
+        self.__original_index.setdefault(
+            self.__get_index_key(recycled_file.original_path), []
+        ).append(recycled_file)
+
+    def __remove_from_index(self, recycled_file: RecycledFile):
+        if self.__index.pop(recycled_file.slot_name, None) is None:
+            return
+        key = self.__get_index_key(recycled_file.original_path)
+        same_path = self.__original_index.get(key, [])
+        if recycled_file in same_path:
+            same_path.remove(recycled_file)
+        if len(same_path) == 0:
+            self.__original_index.pop(key, None)
+
+    def __on_recycled_file_closed(self, operation: str, recycled_file: RecycledFile):
+        with self.__lock:
+            if recycled_file.slot_name not in self.__index:
+                return
+            self.__remove_from_index(recycled_file)
+            self.__append_journal(operation, slot=recycled_file.slot_name)
+
+    def __append_journal(self, operation: str, **kwargs):
+        with self.__lock:
+            if self.__journal is None:
+                self.__journal = open(self.journal_path, "a", encoding="utf8")
+            self.__journal.write(
+                json.dumps(dict(op=operation, **kwargs), ensure_ascii=False) + "\n"
+            )
+            self.__journal.flush()
+
+    def sync_journal(self):
+        """
+        Makes journal entries written so far survive a power loss
+        """
+        with self.__lock:
+            if self.__journal is not None:
+                os.fsync(self.__journal.fileno())
+
+    def __close_journal(self):
+        with self.__lock:
+            if self.__journal is not None:
+                self.__journal.close()
+                self.__journal = None
 
     def get_recycled_files(self, reverse_order: bool = False) -> List[RecycledFile]:
         with self.__lock:
-            slots = []
-            for item in os.listdir(self.__path):
-                dir_ = os.path.join(self.__path, item)
-                file_slot = RecycledFile(dir_, self.__rfum, self.__lock)
-                if file_slot.is_available:
-                    slots.append(file_slot)
+            slots = [item for item in self.__index.values() if item.is_available]
             return sorted(slots, reverse=reverse_order)
 
     def empty(self):
         with self.__lock:
+            self.__close_journal()
+            # Journal goes first, slots left by a crash here are only garbage
+            self.delete(self.journal_path)
             self.delete(self.__path)
+            self.__index = {}
+            self.__original_index = {}
+            self.__interrupted = None
             self.__internal_count = 0
 
-    def get_recycled_file_by_original_path(self, original_path: PathLike):
+    def get_recycled_file_by_original_path(
+        self, original_path: PathLike
+    ) -> Optional[RecycledFile]:
+        """
+        The earliest recycled file of original_path, which holds its content before the session
+        """
         with self.__lock:
-            for recycled_file in self.get_recycled_files():
-                if recycled_file.original_path is None:
-                    continue
-                if os.path.samefile(recycled_file.original_path, original_path):
+            for recycled_file in self.__original_index.get(
+                self.__get_index_key(original_path), []
+            ):
+                if recycled_file.is_available:
                     return recycled_file
+            return None
 
     def restore(self, original_path: PathLike):
         with self.__lock:
-            self.get_recycled_file_by_original_path(original_path).restore()
+            recycled_file = self.get_recycled_file_by_original_path(original_path)
+            if recycled_file is None:
+                raise RFUMFileNotFound(original_path)
+            recycled_file.restore()
 
     def restore_all(self):
         with self.__lock:
             for item in self.get_recycled_files(True):
                 item.restore()
+            self.sync_journal()
+
+    def recover_interrupted_session(self) -> List[RecycledFile]:
+        """
+        Puts files of the interrupted session back into the world, then empties recycle bin
+        Returns the restored files
+        """
+        with self.__lock:
+            restored = []
+            for item in self.get_recycled_files(True):
+                item.restore()
+                restored.append(item)
+            self.empty()
+            os.makedirs(self.__path)
+            return restored
+
+    def discard_interrupted_session(self):
+        with self.__lock:
+            self.empty()
+            os.makedirs(self.__path)
+
+    def detach(self, target_path: PathLike) -> int:
+        """
+        Moves recycled files together with the journal to target_path, a rename on the same
+        filesystem, and leaves an empty recycle bin behind
+        Returns total size of the moved files
+        """
+        with self.__lock:
+            size = sum(
+                os.path.getsize(item.file_path) for item in self.get_recycled_files()
+            )
+            self.sync_journal()
+            self.__close_journal()
+            self.move(self.__path, str(target_path), allow_overwrite=False)
+            self.__index = {}
+            self.__original_index = {}
+            self.__internal_count = 0
+            self.ensure_dir(self.__path)
+            return size
 
     def get_a_temp_dir_path(self):
         with self.__lock:
-            files = os.listdir(self.__path)
             while True:
-                new_dir_name = str(self.__internal_count)
+                path = os.path.join(self.__path, str(self.__internal_count))
                 self.__internal_count += 1
-                if new_dir_name not in files:
-                    path = os.path.join(self.__path, new_dir_name)
+                try:
                     os.makedirs(path)
-                    return path
+                except FileExistsError:
+                    continue
+                return path
 
     def recycle(self, target_file: str):
+        if not os.path.exists(target_file):
+            raise RFUMFileNotFound(target_file)
+        meta = RecycledFile.Metadata(
+            original_file_path=os.path.abspath(target_file), delete_time=time.time()
+        )
+        # Only the slot allocation needs the lock, each slot is exclusive to its caller
         with self.__lock:
-            if not os.path.exists(target_file):
-                raise RFUMFileNotFound(target_file)
-            dir_path = self.get_a_temp_dir_path()
-            meta = RecycledFile.Metadata(
-                original_file_path=target_file, delete_time=time.time()
+            recycled_file = self.__create_recycled_file(
+                os.path.basename(self.get_a_temp_dir_path()), meta
             )
-            recycled_file = RecycledFile(dir_path, self.__rfum, self.__lock)
+            # Written ahead, a slot without file is skipped on replay
+            self.__append_journal(
+                RecycleJournalOperation.recycle,
+                slot=recycled_file.slot_name,
+                meta=serialize(meta),
+            )
+            self.__add_to_index(recycled_file)
+        try:
             self.move(target_file, recycled_file.file_path)
-            self.__rfum.verbose(f"Saving metadata {meta} to {recycled_file.meta_path}")
-            if not recycled_file.save_metadata(meta):
-                raise RFUMMetaSavingFailed(recycled_file.meta_path)
-            return recycled_file
+        except BaseException:
+            recycled_file.delete()
+            raise
+        return recycled_file
 
     @staticmethod
     def delete(target_file: str, allow_not_found: bool = True):
@@ -216,23 +419,63 @@ class FileUtils:
         recycle_overwritten_file: bool = True,
     ):
         def delete_target():
-            if os.path.exists(target_path):
-                if allow_overwrite:
-                    if recycle_overwritten_file:
-                        self.recycle(target_path)
-                    else:
-                        self.delete(target_path)
-                else:
-                    raise FileExistsError(target_path)
+            self.__prepare_overwrite(
+                target_path, allow_overwrite, recycle_overwritten_file
+            )
 
+        result: Optional[CopyResult] = None
         if os.path.isdir(original_file):
             delete_target()
-            shutil.copytree(original_file, target_path)
+            results: List[CopyResult] = []
+
+            def copy_function(src: str, dst: str):
+                results.append(self.__copy_file(src, dst))
+                return dst
+
+            shutil.copytree(original_file, target_path, copy_function=copy_function)
+            for item in results:
+                result = item if result is None else result.merge(item)
         elif os.path.isfile(original_file):
             delete_target()
-            shutil.copy2(original_file, target_path)
+            result = self.__copy_file(original_file, target_path)
         elif not allow_not_found:
             raise RFUMFileNotFound(original_file)
+        if result is not None:
+            self.__rfum.verbose(f"Copied {original_file} -> {target_path} ({result})")
+        return result
+
+    def __prepare_overwrite(
+        self,
+        target_path: PathLike,
+        allow_overwrite: bool,
+        recycle_overwritten_file: bool,
+    ):
+        if os.path.exists(target_path):
+            if allow_overwrite:
+                if recycle_overwritten_file:
+                    self.recycle(str(target_path))
+                else:
+                    self.delete(str(target_path))
+            else:
+                raise FileExistsError(target_path)
+
+    @staticmethod
+    def is_same_device(original_file: PathLike, target_path: PathLike):
+        target_dir = os.path.dirname(os.path.abspath(target_path))
+        try:
+            return os.stat(original_file).st_dev == os.stat(target_dir).st_dev
+        except OSError:
+            return False
+
+    def __copy_file(self, original_file: PathLike, target_path: PathLike):
+        try:
+            strategies: Optional[Iterable[CopyStrategy]] = (
+                self.__rfum.config_snapshot.copy_strategies
+            )
+        except RuntimeError:
+            # FileUtils is created before config loading
+            strategies = None
+        return fast_copy_file(original_file, target_path, strategies)
 
     def move(
         self,
@@ -242,6 +485,23 @@ class FileUtils:
         allow_overwrite: bool = True,
         recycle_overwritten_file: bool = True,
     ):
+        if not os.path.exists(original_file):
+            if allow_not_found:
+                return
+            raise RFUMFileNotFound(original_file)
+        if self.is_same_device(original_file, target_path):
+            self.__prepare_overwrite(
+                target_path, allow_overwrite, recycle_overwritten_file
+            )
+            try:
+                os.replace(original_file, target_path)
+            except OSError as exc:
+                # Bind mounts of one filesystem share st_dev but still refuse renaming
+                if exc.errno != errno.EXDEV:
+                    raise
+            else:
+                self.__rfum.verbose(f"Moved {original_file} -> {target_path} (rename)")
+                return
         self.copy(
             original_file,
             target_path,
@@ -262,7 +522,7 @@ class FileUtils:
     @staticmethod
     def safe_ensure_dir(folder_path: PathLike):
         if not os.path.isdir(folder_path):
-            os.makedirs(folder_path)
+            os.makedirs(folder_path, exist_ok=True)
         return folder_path
 
     def lf_read(
@@ -304,11 +564,21 @@ class FileUtils:
         self.delete(temp_file_path)
         with open(temp_file_path, "w", encoding=encoding) as file:
             yield file
+            file.flush()
+            os.fsync(file.fileno())
         os.replace(temp_file_path, target_file_path)
 
     def __enter__(self):
+        if self.__interrupted is not None:
+            # Only recovering or discarding it explicitly may drop the journal
+            raise RFUMInterruptedSessionFound(
+                f"Recycle bin holds {len(self.__interrupted.files)} files of an "
+                f"interrupted session, recover or discard it first"
+            )
         self.empty()
         os.makedirs(self.__path)
+        self.__append_journal(RecycleJournalOperation.begin, time=time.time())
+        self.sync_journal()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_tb is not None:
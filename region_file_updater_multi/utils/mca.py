@@ -0,0 +1,224 @@
+"""
+Anvil region file (.mca) helpers
+
+A region file starts with two 4KiB tables of 1024 big-endian 32-bit integers
+- Locations: (sector offset << 8) | sector count, 0 if the chunk is not generated
+- Timestamps: last saved time of the chunk in epoch seconds
+Chunk data takes whole 4KiB sectors after the header
+"""
+import os
+import sys
+from array import array
+from contextlib import nullcontext
+from typing import Optional, Tuple, Iterable, List, NamedTuple
+
+from region_file_updater_multi.mcdr_globals import PathLike
+from region_file_updater_multi.utils.fast_copy import fast_copy_file
+
+MCA_SUFFIX = ".mca"
+SECTOR_SIZE = 4096
+HEADER_SECTORS = 2
+HEADER_SIZE = SECTOR_SIZE * HEADER_SECTORS
+CHUNKS_PER_REGION = 1024
+CHUNKS_PER_AXIS = 32
+# Chunk payload compression type has this bit set when stored in c.<x>.<z>.mcc
+EXTERNAL_CHUNK_FLAG = 0x80
+
+_TYPECODE = next(code for code in ("I", "L") if array(code).itemsize == 4)
+
+
+class MCAFormatError(ValueError):
+    pass
+
+
+class MCAHeader(NamedTuple):
+    locations: array
+    timestamps: array
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            array(_TYPECODE, bytes(SECTOR_SIZE)), array(_TYPECODE, bytes(SECTOR_SIZE))
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if len(data) < HEADER_SIZE:
+            raise MCAFormatError(f"Header too short: {len(data)} bytes")
+        locations = array(_TYPECODE, data[:SECTOR_SIZE])
+        timestamps = array(_TYPECODE, data[SECTOR_SIZE:HEADER_SIZE])
+        if sys.byteorder == "little":
+            locations.byteswap()
+            timestamps.byteswap()
+        return cls(locations, timestamps)
+
+    def to_bytes(self) -> bytes:
+        locations, timestamps = array(_TYPECODE, self.locations), array(
+            _TYPECODE, self.timestamps
+        )
+        if sys.byteorder == "little":
+            locations.byteswap()
+            timestamps.byteswap()
+        return locations.tobytes() + timestamps.tobytes()
+
+    def get_location(self, index: int) -> Tuple[int, int]:
+        """
+        Returns (sector offset, sector count) of a chunk
+        """
+        location = self.locations[index]
+        return location >> 8, location & 0xFF
+
+    def set_location(self, index: int, offset: int, count: int, timestamp: int):
+        self.locations[index] = (offset << 8) | count
+        self.timestamps[index] = timestamp
+
+    def clear(self, index: int):
+        self.locations[index] = 0
+        self.timestamps[index] = 0
+
+
+def chunk_index(chunk_x: int, chunk_z: int) -> int:
+    """
+    Index of a chunk in the header tables, accepts both absolute and region local coordinates
+    """
+    return (chunk_x & 31) + (chunk_z & 31) * CHUNKS_PER_AXIS
+
+
+def chunk_coordinates(index: int, region_x: int, region_z: int) -> Tuple[int, int]:
+    return (
+        region_x * CHUNKS_PER_AXIS + index % CHUNKS_PER_AXIS,
+        region_z * CHUNKS_PER_AXIS + index // CHUNKS_PER_AXIS,
+    )
+
+
+def external_chunk_file_name(chunk_x: int, chunk_z: int):
+    return f"c.{chunk_x}.{chunk_z}.mcc"
+
+
+def read_header(path: PathLike) -> MCAHeader:
+    if os.path.getsize(path) == 0:
+        return MCAHeader.empty()
+    with open(path, "rb") as f:
+        return MCAHeader.from_bytes(f.read(HEADER_SIZE))
+
+
+class SpliceResult(NamedTuple):
+    written_chunks: int
+    cleared_chunks: int
+    written_bytes: int
+    # Names of c.<x>.<z>.mcc files which should be copied beside the output file
+    external_chunk_files: List[str]
+
+
+def splice_chunks(
+    base_path: Optional[PathLike],
+    source_path: Optional[PathLike],
+    indexes: Iterable[int],
+    output_path: PathLike,
+    *,
+    region_x: int = 0,
+    region_z: int = 0,
+    clear_missing: bool = False,
+) -> SpliceResult:
+    """
+    Writes base region file with selected chunks replaced by the source ones to output path
+
+    Selected chunk sectors are appended after the last used sector of base file,
+    old sectors are left unused, Minecraft reuses them when saving chunks later
+    Chunks which are not generated in source are cleared when clear_missing is on,
+    source path can be None if upstream doesn't have this region file at all
+    """
+    source_header = (
+        read_header(source_path) if source_path is not None else MCAHeader.empty()
+    )
+    if base_path is not None:
+        fast_copy_file(base_path, output_path)
+        header = read_header(output_path)
+    else:
+        with open(output_path, "wb") as f:
+            f.write(bytes(HEADER_SIZE))
+        header = MCAHeader.empty()
+
+    written, cleared, written_bytes = 0, 0, 0
+    external: List[str] = []
+    src_context = open(source_path, "rb") if source_path is not None else nullcontext()
+    with src_context as src, open(output_path, "r+b") as dst:
+        # Sectors are appended after the end of the file, which is sector aligned in vanilla
+        dst.seek(0, os.SEEK_END)
+        next_sector = max(-(-dst.tell() // SECTOR_SIZE), HEADER_SECTORS)
+        for index in sorted(set(indexes)):
+            offset, count = source_header.get_location(index)
+            if offset == 0 or count == 0:
+                if clear_missing and header.locations[index] != 0:
+                    header.clear(index)
+                    cleared += 1
+                continue
+            if offset < HEADER_SECTORS:
+                raise MCAFormatError(f"Chunk {index} overlaps the header")
+            # Empty header of a missing source has no chunk located
+            assert src is not None
+            src.seek(offset * SECTOR_SIZE)
+            data = src.read(count * SECTOR_SIZE)
+            if len(data) < 5:
+                raise MCAFormatError(f"Chunk {index} is truncated")
+            if data[4] & EXTERNAL_CHUNK_FLAG:
+                external.append(
+                    external_chunk_file_name(
+                        *chunk_coordinates(index, region_x, region_z)
+                    )
+                )
+            # Pad the last sector in case source file is not sector aligned
+            data = data.ljust(count * SECTOR_SIZE, b"\x00")
+            dst.seek(next_sector * SECTOR_SIZE)
+            dst.write(data)
+            header.set_location(
+                index, next_sector, count, source_header.timestamps[index]
+            )
+            next_sector += count
+            written += 1
+            written_bytes += len(data)
+        dst.truncate(next_sector * SECTOR_SIZE)
+        dst.seek(0)
+        dst.write(header.to_bytes())
+    return SpliceResult(written, cleared, written_bytes, external)
+
+
+class HeaderDiff(NamedTuple):
+    # Chunk indexes whose upstream timestamps differ from the world ones
+    changed: List[int]
+    # Chunks only generated in upstream
+    added: List[int]
+    # Chunks only generated in world, these are removed by an update
+    missing: List[int]
+
+    @property
+    def is_empty(self):
+        return not (self.changed or self.added or self.missing)
+
+
+def diff_headers(
+    world: MCAHeader, upstream: MCAHeader, indexes: Optional[Iterable[int]] = None
+) -> HeaderDiff:
+    """
+    Compares chunk timestamps of two region headers, limited to indexes if given
+    """
+    if indexes is None:
+        if (
+            world.timestamps == upstream.timestamps
+            and world.locations == upstream.locations
+        ):
+            return HeaderDiff([], [], [])
+        indexes = range(CHUNKS_PER_REGION)
+    changed, added, missing = [], [], []
+    world_locations, upstream_locations = world.locations, upstream.locations
+    world_timestamps, upstream_timestamps = world.timestamps, upstream.timestamps
+    for index in sorted(indexes):
+        in_world, in_upstream = world_locations[index], upstream_locations[index]
+        if in_world and in_upstream:
+            if world_timestamps[index] != upstream_timestamps[index]:
+                changed.append(index)
+        elif in_upstream:
+            added.append(index)
+        elif in_world:
+            missing.append(index)
+    return HeaderDiff(changed, added, missing)
@@ -0,0 +1,39 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class PhaseTimer:
+    """
+    Accumulates monotonic durations of named phases, safe to use across threads
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__phases: Dict[str, float] = {}
+        self.__created_at = time.monotonic()
+
+    @staticmethod
+    def now() -> float:
+        return time.monotonic()
+
+    @property
+    def created_at(self):
+        return self.__created_at
+
+    def record(self, name: str, seconds: float):
+        with self.__lock:
+            self.__phases[name] = self.__phases.get(name, 0.0) + max(seconds, 0.0)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def get_phases(self) -> Dict[str, float]:
+        with self.__lock:
+            return self.__phases.copy()
@@ -0,0 +1,17 @@
+import os
+import sys
+import types
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PACKAGE = "region_file_updater_multi"
+
+
+def load_package():
+    """
+    Makes plugin modules importable outside MCDR, skipping the plugin entrypoint
+    in the package __init__ which requires a running MCDR
+    """
+    if _PACKAGE not in sys.modules:
+        package = types.ModuleType(_PACKAGE)
+        package.__path__ = [os.path.join(_ROOT, _PACKAGE)]
+        sys.modules[_PACKAGE] = package
@@ -0,0 +1,72 @@
+"""
+Compares region lookups in AreaIndex with a linear scan over the areas
+
+Areas are laid out on a grid in one dimension, lookups are random regions
+around the grid, so both hits and misses are measured
+
+Usage: python scripts/bench_area_index.py [area_count] [lookup_count]
+"""
+
+import math
+import random
+import sys
+import time
+
+from _package import load_package
+
+load_package()
+
+from region_file_updater_multi.region_upstream_manager import Region, RegionArea
+from region_file_updater_multi.storage.group import AreaIndex
+
+# Size of each area and the gap between neighbours, in regions
+_AREA_SIZE = 40
+_AREA_STRIDE = 50
+
+
+def main():
+    area_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3600
+    lookup_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    side = math.ceil(math.sqrt(area_count))
+    areas = [
+        RegionArea(
+            (i % side) * _AREA_STRIDE,
+            (i // side) * _AREA_STRIDE,
+            (i % side) * _AREA_STRIDE + _AREA_SIZE - 1,
+            (i // side) * _AREA_STRIDE + _AREA_SIZE - 1,
+            "0",
+        )
+        for i in range(area_count)
+    ]
+    rnd = random.Random(0)
+    bound = side * _AREA_STRIDE
+    regions = [
+        Region(rnd.randrange(-10, bound + 10), rnd.randrange(-10, bound + 10), "0")
+        for _ in range(lookup_count)
+    ]
+
+    start = time.perf_counter()
+    index = AreaIndex()
+    owner = object()
+    for area in areas:
+        index.add(area, owner)  # type: ignore[arg-type]
+    next(index.find(regions[0]), None)
+    built = time.perf_counter()
+    index_hits = sum(
+        1 for region in regions if next(index.find(region), None) is not None
+    )
+    indexed = time.perf_counter()
+    linear_hits = sum(
+        1 for region in regions if any(area.contains(region) for area in areas)
+    )
+    scanned = time.perf_counter()
+
+    assert index_hits == linear_hits
+    print(f"{area_count} areas, {lookup_count} lookups, {index_hits} hits")
+    print(f"index build: {built - start:.3f}s")
+    print(f"index lookups: {indexed - built:.3f}s")
+    print(f"linear scan: {scanned - indexed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Times recycling files into the recycle bin and restoring them
+
+Half of the files are restored one by one by their original path,
+the rest by restore_all(), as a failed update session does
+
+Usage: python scripts/bench_recycle.py [file_count]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+from _package import load_package
+
+load_package()
+
+from region_file_updater_multi.utils.file_utils import FileUtils
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rfum = types.SimpleNamespace(
+        logger=logging.getLogger("bench_recycle"), verbose=lambda *args: None
+    )
+    with tempfile.TemporaryDirectory() as root:
+        world = os.path.join(root, "world")
+        os.makedirs(world)
+        paths = [os.path.join(world, f"r.{i}.0.mca") for i in range(file_count)]
+        for path in paths:
+            open(path, "wb").close()
+        file_utils = FileUtils(os.path.join(root, "recycle_bin"), rfum)
+        file_utils.__enter__()
+
+        start = time.perf_counter()
+        for path in paths:
+            file_utils.recycle(path)
+        recycled = time.perf_counter()
+        for path in paths[: file_count // 2]:
+            file_utils.restore(path)
+        restored = time.perf_counter()
+        file_utils.restore_all()
+        end = time.perf_counter()
+
+        file_utils.__exit__(None, None, None)
+        assert len(os.listdir(world)) == file_count
+    print(f"{file_count} files")
+    print(f"recycle: {recycled - start:.3f}s")
+    print(f"restore by path ({file_count // 2}): {restored - recycled:.3f}s")
+    print(f"restore_all ({file_count - file_count // 2}): {end - restored:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares memory use and dict/set lookups of Region with the mutable class it replaced
+
+The previous Region kept x, z and dim in an instance dict, wrapped each dimension in
+a new DimensionString, and validated itself on every hash and equality check
+
+Usage: python scripts/bench_region.py [region_count]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from _package import load_package
+
+load_package()
+
+from region_file_updater_multi.region_upstream_manager import DimensionString, Region
+
+_DIMENSIONS = ["0", "-1", "1", "minecraft:overworld"]
+
+
+class LegacyRegion:
+    def __init__(self, x=None, z=None, dim=None):
+        self.x = x
+        self.z = z
+        self.dim = DimensionString(dim) if dim is not None else None
+
+    def assert_valid(self):
+        if self.x is None or self.z is None or self.dim is None:
+            raise ValueError("Value not initiated")
+
+    def __eq__(self, other):
+        self.assert_valid()
+        if not isinstance(other, type(self)):
+            return False
+        return (
+            self.x == other.x and self.z == other.z and str(self.dim) == str(other.dim)
+        )
+
+    def __hash__(self):
+        self.assert_valid()
+        return hash((self.x, self.z, self.dim))
+
+
+def create(region_cls, region_count: int):
+    # Dimension strings are copied, as if each one was parsed from a command or file
+    return [
+        region_cls(i % 300, i // 300, "".join(_DIMENSIONS[i % len(_DIMENSIONS)]))
+        for i in range(region_count)
+    ]
+
+
+def measure(region_cls, region_count: int):
+    tracemalloc.start()
+    regions = create(region_cls, region_count)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    probes = create(region_cls, region_count)
+
+    start = time.perf_counter()
+    region_set = set(regions)
+    built = time.perf_counter()
+    hits = sum(1 for region in probes if region in region_set)
+    end = time.perf_counter()
+    assert hits == region_count
+    print(
+        f"{region_cls.__name__}: {memory / region_count:.0f} B/region, "
+        f"set build {built - start:.3f}s, {region_count} lookups {end - built:.3f}s"
+    )
+
+
+def main():
+    region_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    measure(LegacyRegion, region_count)
+    measure(Region, region_count)
+
+
+if __name__ == "__main__":
+    main()
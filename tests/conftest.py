@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# The package __init__ is the MCDR plugin entrypoint, which can't be imported
+# while MCDR is not running. Register the package without executing it so its
+# modules can be tested on their own
+_PACKAGE = "region_file_updater_multi"
+if _PACKAGE not in sys.modules:
+    _package = types.ModuleType(_PACKAGE)
+    _package.__path__ = [
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), _PACKAGE)
+    ]
+    sys.modules[_PACKAGE] = _package
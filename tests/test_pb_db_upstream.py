@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from region_file_updater_multi.mcdr_globals import LATEST
+from region_file_updater_multi.upstream.impl.pb_db_upstream import (
+    PrimeBackupDatabase,
+    PrimeBackupUnsupportedBlob,
+)
+
+_MODE_FILE = 0o100644
+_MODE_DIR = 0o040755
+_ROLE_STANDALONE = 1
+_ROLE_DELTA_OVERRIDE = 2
+_ROLE_DELTA_REMOVE = 4
+
+
+class _DatabaseBuilder:
+    """
+    Minimal fileset schema Prime Backup database with its blob store
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.db_path = os.path.join(self.root, "prime_backup.db")
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE backup(
+                id INTEGER PRIMARY KEY, fileset_id_base INT, fileset_id_delta INT
+            );
+            CREATE TABLE blob(
+                hash TEXT PRIMARY KEY, compress TEXT, raw_size INT, storage_method INT
+            );
+            CREATE TABLE file(
+                fileset_id INT, role INT, path TEXT, mode INT,
+                blob_hash TEXT, blob_compress TEXT, blob_raw_size INT
+            );
+            """
+        )
+
+    def add_blob(self, data: bytes, compress: str = "plain", storage_method: int = 1):
+        blob_hash = hashlib.sha256(data + compress.encode()).hexdigest()
+        blob_dir = os.path.join(self.root, "blobs", blob_hash[:2])
+        os.makedirs(blob_dir, exist_ok=True)
+        with open(os.path.join(blob_dir, blob_hash), "wb") as f:
+            f.write(gzip.compress(data) if compress == "gzip" else data)
+        self.conn.execute(
+            "INSERT OR IGNORE INTO blob VALUES (?, ?, ?, ?)",
+            (blob_hash, compress, len(data), storage_method),
+        )
+        return blob_hash
+
+    def add_file(
+        self,
+        fileset_id: int,
+        path: str,
+        data: bytes = None,
+        compress: str = "plain",
+        role: int = _ROLE_STANDALONE,
+        mode: int = _MODE_FILE,
+        storage_method: int = 1,
+    ):
+        blob_hash = (
+            None if data is None else self.add_blob(data, compress, storage_method)
+        )
+        self.conn.execute(
+            "INSERT INTO file VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                fileset_id,
+                role,
+                path,
+                mode,
+                blob_hash,
+                None if data is None else compress,
+                None if data is None else len(data),
+            ),
+        )
+
+    def add_backup(self, backup_id: int, base_id: int, delta_id: int):
+        self.conn.execute(
+            "INSERT INTO backup VALUES (?, ?, ?)", (backup_id, base_id, delta_id)
+        )
+
+    def commit(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    builder = _DatabaseBuilder(tmp_path)
+    builder.add_file(1, "world", mode=_MODE_DIR)
+    builder.add_file(1, "world/region/r.0.0.mca", b"base 0.0" * 100, "gzip")
+    builder.add_file(1, "world/region/r.1.0.mca", b"base 1.0")
+    builder.add_file(1, "world/region/r.2.0.mca", b"base 2.0")
+    builder.add_file(1, "world/region/r.3.0.mca", b"chunked", storage_method=2)
+    builder.add_file(
+        2, "world/region/r.1.0.mca", b"delta 1.0", "gzip", _ROLE_DELTA_OVERRIDE
+    )
+    builder.add_file(2, "world/region/r.2.0.mca", role=_ROLE_DELTA_REMOVE)
+    builder.add_backup(1, 1, 1)
+    builder.add_backup(2, 1, 2)
+    builder.commit()
+    database = PrimeBackupDatabase(builder.db_path)
+    yield database
+    database.close()
+
+
+def test_get_latest_backup(database):
+    assert database.is_fileset_schema
+    assert database.get_backup(LATEST).id == 2
+    assert database.get_backup(1).fileset_ids == (1, 1)
+
+
+def test_get_existing_files(database):
+    file_names = [
+        "region/r.0.0.mca",
+        "region/r.1.0.mca",
+        "region/r.2.0.mca",
+        "region/r.4.0.mca",
+    ]
+    # The directory entry is not a file, r.2.0 is removed by the delta fileset
+    assert database.get_existing_files(
+        database.get_backup(LATEST), "world", file_names + [""]
+    ) == {"region/r.0.0.mca", "region/r.1.0.mca"}
+    assert database.get_existing_files(database.get_backup(1), "world", file_names) == {
+        "region/r.0.0.mca",
+        "region/r.1.0.mca",
+        "region/r.2.0.mca",
+    }
+
+
+def test_extract(database, tmp_path):
+    backup = database.get_backup(LATEST)
+    for path, content in [
+        ("world/region/r.0.0.mca", b"base 0.0" * 100),
+        ("world/region/r.1.0.mca", b"delta 1.0"),
+    ]:
+        target = tmp_path / os.path.basename(path)
+        assert database.extract(database.get_file(backup, path), target) == len(
+            content
+        )
+        assert target.read_bytes() == content
+        assert not os.path.exists(str(target) + ".tmp")
+
+
+def test_delta_remove(database):
+    path = "world/region/r.2.0.mca"
+    assert database.get_file(database.get_backup(LATEST), path) is None
+    assert database.get_file(database.get_backup(1), path) is not None
+
+
+def test_reject_non_direct_blob(database, tmp_path):
+    file_row = database.get_file(database.get_backup(LATEST), "world/region/r.3.0.mca")
+    with pytest.raises(PrimeBackupUnsupportedBlob):
+        database.extract(file_row, tmp_path / "r.3.0.mca")
+    assert not os.path.exists(tmp_path / "r.3.0.mca")
+
+
+def test_close_connections_of_all_threads(database):
+    connections = [database.connection]
+    thread = threading.Thread(target=lambda: connections.append(database.connection))
+    thread.start()
+    thread.join()
+    assert connections[0] is not connections[1]
+    database.close()
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    # Usable again after being closed
+    assert database.get_backup(LATEST).id == 2